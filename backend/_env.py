@@ -0,0 +1,27 @@
+"""
+Environment loading helper.
+
+Parses the .env file at most once per process, shared by every module that
+needs it. main.py loads first with override=True so .env wins over the shell
+during local development; set MEMO_BOT_SKIP_DOTENV=1 to skip .env entirely
+when the deployment injects environment variables directly.
+"""
+
+import os
+import threading
+
+import dotenv
+
+_loaded = False
+_lock = threading.Lock()
+
+def load_once(override: bool = False) -> None:
+    """Load .env into os.environ once; later calls are no-ops whatever their override."""
+    global _loaded
+    with _lock:
+        if _loaded:
+            return
+        _loaded = True
+        if os.getenv("MEMO_BOT_SKIP_DOTENV") == "1":
+            return
+        dotenv.load_dotenv(override=override)
@@ -0,0 +1,48 @@
+"""
+JSON encoding helpers.
+
+Uses orjson when it is installed and falls back to the standard library
+otherwise, so hot paths (SSE frames, structured logs) share one fast encoder.
+SSE frames are built as bytes so StreamingResponse sends them without re-encoding.
+"""
+
+import json
+from typing import Any
+
+JSONDecodeError = json.JSONDecodeError
+
+try:
+    import orjson
+
+    def dumps(obj: Any) -> str:
+        """Serialize obj to a JSON string."""
+        return orjson.dumps(obj, default=str).decode()
+
+    def dumps_bytes(obj: Any) -> bytes:
+        """Serialize obj to UTF-8 JSON bytes."""
+        return orjson.dumps(obj, default=str)
+
+    def loads(data: Any) -> Any:
+        """Parse a JSON string or bytes."""
+        return orjson.loads(data)  # orjson.JSONDecodeError subclasses json.JSONDecodeError
+except ImportError:  # pragma: no cover - orjson is in requirements.txt
+    def dumps(obj: Any) -> str:
+        """Serialize obj to a JSON string."""
+        return json.dumps(obj, default=str)
+
+    def dumps_bytes(obj: Any) -> bytes:
+        """Serialize obj to UTF-8 JSON bytes."""
+        return json.dumps(obj, default=str).encode()
+
+    def loads(data: Any) -> Any:
+        """Parse a JSON string or bytes."""
+        return json.loads(data)
+
+# Server-sent event framing shared by the chat streams
+SSE_DONE = b"data:[DONE]\n\n"
+# Keep caches and reverse proxies (nginx) from buffering the stream
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def sse_frame(payload: Any) -> bytes:
+    """Encode payload as a server-sent event data frame."""
+    return b"data:" + dumps_bytes(payload) + b"\n\n"
@@ -9,9 +9,10 @@ This module provides:
 """
 
 import os
-from dotenv import load_dotenv
 
-load_dotenv()
+from _env import load_once
+
+load_once()
 
 def show_current_config() -> None:
     """Display current Chroma configuration and status."""
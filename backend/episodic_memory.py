@@ -11,59 +11,140 @@ This module provides:
 
 from __future__ import annotations
 import os
-import uuid
 import time
-from typing import Dict, Any, List, Optional, Tuple
+import random
+import itertools
+import heapq
+import asyncio
+import atexit
+import shelve
+import calendar
+import hashlib
+import threading
+import functools
+from collections import OrderedDict
+from operator import itemgetter
+from typing import Dict, Any, List, Optional, Sequence, Tuple
 from datetime import datetime
+from dataclasses import dataclass
 
-import chromadb
-from chromadb.config import Settings
-from openai import OpenAI
-from dotenv import load_dotenv
+import httpx
+import numpy as np
 
-load_dotenv(override=True)
+from _env import load_once
+
+load_once()
 
 # Configuration
-CHROMA_API_KEY = os.getenv("CHROMA_API_KEY")
-CHROMA_TENANT = os.getenv("CHROMA_TENANT") 
-CHROMA_DATABASE = os.getenv("CHROMA_DATABASE")
+@dataclass(frozen=True)
+class ChromaConfig:
+    """Chroma connection settings, resolved once at import."""
+    mode: str  # "local" or "cloud"
+    api_key: Optional[str]
+    tenant: Optional[str]
+    database: Optional[str]
+    path: str = "./chroma_db"
+
+_CONFIG = ChromaConfig(
+    mode=os.getenv("CHROMA_MODE", "local").lower(),
+    api_key=os.getenv("CHROMA_API_KEY"),
+    tenant=os.getenv("CHROMA_TENANT"),
+    database=os.getenv("CHROMA_DATABASE"),
+)
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
-# Chroma deployment mode: "local" or "cloud"
-CHROMA_MODE = os.getenv("CHROMA_MODE", "local").lower()
+# Embedding configuration
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_DIM = 1536
+EMBEDDING_CACHE_SIZE = 4096
+# Per-request budget for batched embedding calls (model input limit is 8191 tokens)
+EMBEDDING_MAX_BATCH_TOKENS = 8191
+EMBEDDING_MAX_BATCH_SIZE = 2048
+# Optional on-disk embedding cache (shelve file path); unset disables persistence.
+# dbm files do not support concurrent writers, so the disk tier is off with several workers.
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH")
+if EMBEDDING_CACHE_PATH and int(os.getenv("WEB_CONCURRENCY", "1")) > 1:
+    print("WARNING: EMBEDDING_CACHE_PATH is ignored with more than one worker; embeddings are cached in memory only")
+    EMBEDDING_CACHE_PATH = None
 
-# OpenAI client for embeddings
-if OPENAI_API_KEY:
-    _openai_client = OpenAI(api_key=OPENAI_API_KEY)
-    _use_openai = True
-else:
-    _openai_client = None
-    _use_openai = False
+# Most recent episodes kept per user for incremental get_recent_episodes calls
+RECENT_EPISODES_CACHE_SIZE = 100
 
-# ChromaDB client setup
-def get_chroma_client():
-    """Initialize and return Chroma client (local or cloud based on CHROMA_MODE)."""
+# Shared read-only fallbacks used when embeddings are unavailable
+_ZERO_EMBEDDING: Tuple[float, ...] = (0.0,) * EMBEDDING_DIM
+_ZERO_VECTOR = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+_ZERO_VECTOR.setflags(write=False)
+
+# In-process LRU of text -> embedding, guarded by _embedding_cache_lock
+_embedding_memo: "OrderedDict[str, Tuple[float, ...]]" = OrderedDict()
+_embedding_cache_lock = threading.Lock()
+# On-disk store, opened once per process on first use; guarded by _embedding_cache_lock
+_embedding_store: Optional[shelve.Shelf] = None
+
+# OpenAI clients for embeddings are built on first use; importing openai (and
+# chromadb below) is deferred so helpers and tests don't pay for it at import
+_use_openai = bool(OPENAI_API_KEY)
+
+@functools.lru_cache(maxsize=1)
+def _get_openai_client():
+    """Return the process-wide OpenAI client (one pooled HTTP/2 transport)."""
+    from openai import OpenAI
     
-    if CHROMA_MODE == "cloud":
-        # Use Chroma Cloud
-        if not all([CHROMA_API_KEY, CHROMA_TENANT, CHROMA_DATABASE]):
-            raise ValueError(
-                "Chroma Cloud mode requires CHROMA_API_KEY, CHROMA_TENANT, and CHROMA_DATABASE environment variables."
-            )
-        
-        print("Using Chroma Cloud")
-        return chromadb.CloudClient(
-            api_key=CHROMA_API_KEY,
-            tenant=CHROMA_TENANT,
-            database=CHROMA_DATABASE,
-        )
+    return OpenAI(
+        api_key=OPENAI_API_KEY,
+        http_client=httpx.Client(
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=50),
+            http2=True,
+            timeout=httpx.Timeout(30.0),
+        ),
+    )
+
+@functools.lru_cache(maxsize=1)
+def _get_async_openai_client():
+    """Return the process-wide AsyncOpenAI client (one pooled HTTP/2 transport)."""
+    from openai import AsyncOpenAI
     
-    else:
-        # Use local Chroma (default)
-        print("Using local Chroma database")
-        return chromadb.PersistentClient(
-            path="./chroma_db"  # Local persistence
+    return AsyncOpenAI(
+        api_key=OPENAI_API_KEY,
+        http_client=httpx.AsyncClient(
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=50),
+            http2=True,
+            timeout=httpx.Timeout(30.0),
+        ),
+    )
+
+# ChromaDB client setup
+def _make_cloud_client():
+    """Create a Chroma Cloud client from _CONFIG."""
+    if not all([_CONFIG.api_key, _CONFIG.tenant, _CONFIG.database]):
+        raise ValueError(
+            "Chroma Cloud mode requires CHROMA_API_KEY, CHROMA_TENANT, and CHROMA_DATABASE environment variables."
         )
+    
+    import chromadb
+    
+    print("Using Chroma Cloud")
+    return chromadb.CloudClient(
+        api_key=_CONFIG.api_key,
+        tenant=_CONFIG.tenant,
+        database=_CONFIG.database,
+    )
+
+def _make_local_client():
+    """Create a local persistent Chroma client from _CONFIG."""
+    import chromadb
+    
+    print("Using local Chroma database")
+    return chromadb.PersistentClient(
+        path=_CONFIG.path  # Local persistence
+    )
+
+# Any mode other than "cloud" uses the local database
+_CLIENT_FACTORIES = {"cloud": _make_cloud_client}
+
+def get_chroma_client():
+    """Initialize and return Chroma client (local or cloud based on CHROMA_MODE)."""
+    return _CLIENT_FACTORIES.get(_CONFIG.mode, _make_local_client)()
 
 def get_episodic_collection():
     """Get or create the episodic memory collection."""
@@ -76,39 +157,162 @@ def get_episodic_collection():
         # Create collection if it doesn't exist
         collection = client.create_collection(
             name="episodic_memory",
-            metadata={"description": "Conversation rounds stored as episodes with embeddings"}
+            metadata={
+                "description": "Conversation rounds stored as episodes with embeddings",
+                # Cosine distance is scale-invariant, so quantized vectors rank the same
+                "hnsw:space": "cosine"
+            }
         )
     
     return collection
 
 # Embedding functions
-def get_embedding(text: str) -> List[float]:
-    """Get embedding for text using OpenAI's text-embedding-3-small model."""
+def _embedding_cache_key(text: str) -> str:
+    """Build the on-disk cache key for a text/model pair."""
+    return f"{hashlib.sha1(text.encode('utf-8')).hexdigest()}::{EMBEDDING_MODEL}"
+
+def _remember_embedding(text: str, embedding: Tuple[float, ...]) -> None:
+    """Insert into the in-process LRU. Caller must hold _embedding_cache_lock."""
+    _embedding_memo[text] = embedding
+    _embedding_memo.move_to_end(text)
+    if len(_embedding_memo) > EMBEDDING_CACHE_SIZE:
+        _embedding_memo.popitem(last=False)
+
+def _get_embedding_store() -> shelve.Shelf:
+    """Open the on-disk store once per process. Caller must hold _embedding_cache_lock."""
+    global _embedding_store
+    if _embedding_store is None:
+        _embedding_store = shelve.open(EMBEDDING_CACHE_PATH)
+        atexit.register(_embedding_store.close)
+    return _embedding_store
+
+def _cache_get(text: str) -> Optional[Tuple[float, ...]]:
+    """Look up an embedding in the in-process LRU, then the optional on-disk store."""
+    with _embedding_cache_lock:
+        embedding = _embedding_memo.get(text)
+        if embedding is not None:
+            _embedding_memo.move_to_end(text)
+            return embedding
+        
+        if EMBEDDING_CACHE_PATH:
+            embedding = _get_embedding_store().get(_embedding_cache_key(text))
+            if embedding is not None:
+                _remember_embedding(text, embedding)
+        
+        return embedding
+
+def _cache_put(text: str, embedding: Tuple[float, ...]) -> None:
+    """Store an embedding in the in-process LRU and the optional on-disk store."""
+    with _embedding_cache_lock:
+        _remember_embedding(text, embedding)
+        if EMBEDDING_CACHE_PATH:
+            _get_embedding_store()[_embedding_cache_key(text)] = embedding
+
+def _embedding_batches(texts: List[str]):
+    """Split texts into request-sized batches using a ~4 chars/token estimate."""
+    batch: List[str] = []
+    batch_tokens = 0
+    for text in texts:
+        tokens = len(text) // 4 + 1
+        if batch and (batch_tokens + tokens > EMBEDDING_MAX_BATCH_TOKENS
+                      or len(batch) >= EMBEDDING_MAX_BATCH_SIZE):
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append(text)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+def _request_embeddings(texts: List[str]) -> List[Tuple[float, ...]]:
+    """Fetch embeddings for texts from OpenAI in a single request."""
+    response = _get_openai_client().embeddings.create(
+        model=EMBEDDING_MODEL,
+        input=texts[0] if len(texts) == 1 else texts
+    )
+    return [tuple(item.embedding) for item in response.data]
+
+async def _request_embeddings_async(texts: List[str]) -> List[Tuple[float, ...]]:
+    """Fetch embeddings for texts from OpenAI in a single non-blocking request."""
+    response = await _get_async_openai_client().embeddings.create(
+        model=EMBEDDING_MODEL,
+        input=texts[0] if len(texts) == 1 else texts
+    )
+    return [tuple(item.embedding) for item in response.data]
+
+def _split_cached(texts: List[str]) -> Tuple[Dict[str, Tuple[float, ...]], List[str]]:
+    """Partition unique texts into cached embeddings and texts still to fetch."""
+    found: Dict[str, Tuple[float, ...]] = {}
+    misses = []
+    for text in dict.fromkeys(texts):
+        cached = _cache_get(text)
+        if cached is not None:
+            found[text] = cached
+        else:
+            misses.append(text)
+    return found, misses
+
+def get_embeddings_batch(texts: List[str]) -> List[Sequence[float]]:
+    """Get embeddings for several texts, fetching cache misses in as few requests as possible.
+    
+    Returned sequences are shared cache entries and must not be mutated;
+    texts without an embedding get the shared _ZERO_EMBEDDING.
+    """
     if not _use_openai:
-        # Fallback: return random embedding for testing
-        return [0.0] * 1536
+        # Fallback: return zero embedding for testing
+        return [_ZERO_EMBEDDING] * len(texts)
     
-    try:
-        response = _openai_client.embeddings.create(
-            model="text-embedding-3-small",
-            input=text
-        )
-        return response.data[0].embedding
-    except Exception as e:
-        print(f"Error getting embedding: {e}")
-        return [0.0] * 1536
+    found, misses = _split_cached(texts)
+    
+    for batch in _embedding_batches(misses):
+        try:
+            for text, embedding in zip(batch, _request_embeddings(batch)):
+                _cache_put(text, embedding)
+                found[text] = embedding
+        except Exception as e:
+            print(f"Error getting embedding: {e}")
+    
+    return [found.get(text, _ZERO_EMBEDDING) for text in texts]
 
-def create_episode_embeddings(user_message: str, ai_response: str) -> Dict[str, List[float]]:
-    """Create embeddings for episode storage."""
+async def get_embeddings_batch_async(texts: List[str]) -> List[Sequence[float]]:
+    """Async variant of get_embeddings_batch using the AsyncOpenAI client."""
+    if not _use_openai:
+        return [_ZERO_EMBEDDING] * len(texts)
+    
+    found, misses = _split_cached(texts)
+    
+    for batch in _embedding_batches(misses):
+        try:
+            for text, embedding in zip(batch, await _request_embeddings_async(batch)):
+                _cache_put(text, embedding)
+                found[text] = embedding
+        except Exception as e:
+            print(f"Error getting embedding: {e}")
+    
+    return [found.get(text, _ZERO_EMBEDDING) for text in texts]
+
+def get_embedding(text: str) -> List[float]:
+    """Get embedding for text using OpenAI's text-embedding-3-small model."""
+    return list(get_embeddings_batch([text])[0])
+
+def _combine_embeddings(user_vector: Sequence[float], ai_vector: Sequence[float]) -> Dict[str, np.ndarray]:
+    """Build the user and AI float32 embeddings and their average for an episode.
+    
+    The combined vector stays float32: Chroma stores float32 embeddings, so a
+    narrower dtype would only lose precision without saving space.
+    """
+    if user_vector is _ZERO_EMBEDDING and ai_vector is _ZERO_EMBEDDING:
+        # Nothing to average; share read-only zero vectors
+        return {
+            "user_embedding": _ZERO_VECTOR,
+            "ai_embedding": _ZERO_VECTOR,
+            "combined_embedding": _ZERO_VECTOR
+        }
     
-    # Get individual embeddings
-    user_embedding = get_embedding(user_message)
-    ai_embedding = get_embedding(ai_response)
+    user_embedding = np.asarray(user_vector, dtype=np.float32)
+    ai_embedding = np.asarray(ai_vector, dtype=np.float32)
     
     # Combined embedding as average
-    combined_embedding = [
-        (u + a) / 2 for u, a in zip(user_embedding, ai_embedding)
-    ]
+    combined_embedding = (user_embedding + ai_embedding) * 0.5
     
     return {
         "user_embedding": user_embedding,
@@ -116,31 +320,83 @@ def create_episode_embeddings(user_message: str, ai_response: str) -> Dict[str,
         "combined_embedding": combined_embedding
     }
 
+def create_episode_embeddings(user_message: str, ai_response: str) -> Dict[str, np.ndarray]:
+    """Create float32 embeddings for episode storage."""
+    
+    # Get individual embeddings in a single request
+    user_vector, ai_vector = get_embeddings_batch([user_message, ai_response])
+    return _combine_embeddings(user_vector, ai_vector)
+
+async def create_episode_embeddings_async(user_message: str, ai_response: str) -> Dict[str, np.ndarray]:
+    """Async variant of create_episode_embeddings."""
+    user_vector, ai_vector = await get_embeddings_batch_async([user_message, ai_response])
+    return _combine_embeddings(user_vector, ai_vector)
+
+def _cosine_similarities(query: Sequence[float], stored: Sequence[Sequence[float]]) -> np.ndarray:
+    """Cosine similarity of query against each stored vector in one matrix product."""
+    matrix = np.asarray(stored, dtype=np.float32)
+    query_vec = np.asarray(query, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query_vec)
+    # Zero vectors (embedding failures) get similarity 0 rather than NaN
+    return np.divide(matrix @ query_vec, norms, out=np.zeros(len(matrix), dtype=np.float32), where=norms > 0)
+
+def _to_unix(timestamp: datetime) -> int:
+    """Convert a naive UTC datetime to integer Unix seconds."""
+    return calendar.timegm(timestamp.timetuple())
+
+def _recency_key(metadata: Dict[str, Any]) -> Tuple[int, str, int]:
+    """Sort key ordering episodes by time; ties within a second fall back to ISO time, then round."""
+    return (
+        metadata.get("timestamp_unix") or 0,
+        str(metadata.get("timestamp") or ""),
+        metadata.get("round_number") or 0,
+    )
+
+# Episode id suffixes: a random start salted with the pid keeps ids unique
+# across workers without a urandom syscall per episode
+_EP_COUNTER = itertools.count(random.SystemRandom().randrange(1 << 32) ^ (os.getpid() << 16))
+
 # Episode data model
+
 class Episode:
     """Represents a single conversation round as an episode."""
     
+    __slots__ = (
+        "id", "user_id", "user_message", "ai_response", "round_number",
+        "session_id", "timestamp", "timestamp_unix", "timestamp_iso", "tokens",
+        "user_embedding", "ai_embedding", "combined_embedding",
+    )
+    
     def __init__(self, user_id: str, user_message: str, ai_response: str, 
-                 round_number: int, session_id: str, timestamp: Optional[datetime] = None):
-        self.id = f"ep_{int(time.time())}_{uuid.uuid4().hex[:8]}"
+                 round_number: int, session_id: str, timestamp: Optional[datetime] = None,
+                 embeddings: Optional[Dict[str, np.ndarray]] = None):
+        now = time.time()
+        self.id = f"ep_{int(now)}_{next(_EP_COUNTER) & 0xFFFFFFFF:08x}"
         self.user_id = user_id
         self.user_message = user_message
         self.ai_response = ai_response
         self.round_number = round_number
         self.session_id = session_id
-        self.timestamp = timestamp or datetime.utcnow()
+        if timestamp is None:
+            self.timestamp = datetime.utcfromtimestamp(now)
+            self.timestamp_unix = int(now)
+        else:
+            self.timestamp = timestamp
+            self.timestamp_unix = _to_unix(timestamp)
+        self.timestamp_iso = self.timestamp.isoformat()
         
-        # Generate embeddings
-        embeddings = create_episode_embeddings(user_message, ai_response)
+        # Generate embeddings unless precomputed (see create_episodes)
+        if embeddings is None:
+            embeddings = create_episode_embeddings(user_message, ai_response)
         self.user_embedding = embeddings["user_embedding"]
         self.ai_embedding = embeddings["ai_embedding"]
         self.combined_embedding = embeddings["combined_embedding"]
         
-        # Calculate tokens (rough estimation)
-        self.tokens = len(user_message.split()) + len(ai_response.split())
+        # Calculate tokens (rough estimation, ~4 characters per token)
+        self.tokens = (len(user_message) + len(ai_response)) // 4
     
     def to_dict(self) -> Dict[str, Any]:
-        """Convert episode to dictionary for storage."""
+        """Convert episode to dictionary for storage (embeddings are stored separately)."""
         return {
             "id": self.id,
             "user_id": self.user_id,
@@ -148,11 +404,9 @@ class Episode:
             "ai_response": self.ai_response,
             "round_number": self.round_number,
             "session_id": self.session_id,
-            "timestamp": self.timestamp.isoformat(),
-            "tokens": self.tokens,
-            "user_embedding": self.user_embedding,
-            "ai_embedding": self.ai_embedding,
-            "combined_embedding": self.combined_embedding
+            "timestamp": self.timestamp_iso,
+            "timestamp_unix": self.timestamp_unix,
+            "tokens": self.tokens
         }
 
 # Episode storage and retrieval
@@ -161,28 +415,34 @@ class EpisodicMemory:
     
     def __init__(self):
         self.collection = get_episodic_collection()
+        # Per-user cache of the most recent episodes and the newest timestamp_unix seen
+        self._recent_cache: Dict[str, List[Dict[str, Any]]] = {}
+        self._recent_cursor: Dict[str, int] = {}
+        # Per-user episode counts, reconciled from Chroma on first use
+        self._count_cache: Dict[str, int] = {}
+    
+    def _track_stored(self, episode: Episode) -> None:
+        """Keep cached per-user counters in step with a stored episode."""
+        user_id = episode.user_id
+        if user_id in self._count_cache:
+            self._count_cache[user_id] += 1
     
     def store_episode(self, episode: Episode) -> str:
         """Store an episode in Chroma Cloud."""
         try:
-            # Prepare data for Chroma
-            episode_data = episode.to_dict()
+            # Prepare metadata for Chroma
+            metadata = episode.to_dict()
+            del metadata["id"]
             
             # Store in Chroma collection
             self.collection.add(
-                embeddings=[episode.combined_embedding],
-                metadatas=[{
-                    "user_id": episode.user_id,
-                    "user_message": episode.user_message,
-                    "ai_response": episode.ai_response,
-                    "round_number": episode.round_number,
-                    "session_id": episode.session_id,
-                    "timestamp": episode.timestamp.isoformat(),
-                    "tokens": episode.tokens
-                }],
+                embeddings=[episode.combined_embedding.tolist()],
+                metadatas=[metadata],
                 ids=[episode.id]
             )
             
+            self._track_stored(episode)
+            
             print(f"Stored episode {episode.id} for user {episode.user_id}")
             return episode.id
             
@@ -190,34 +450,80 @@ class EpisodicMemory:
             print(f"Error storing episode: {e}")
             raise
     
-    def search_episodes(self, user_id: str, query: str, limit: int = 5) -> List[Dict[str, Any]]:
-        """Search for relevant episodes using semantic similarity."""
+    def store_episodes(self, episodes: List[Episode]) -> List[str]:
+        """Store several episodes in a single Chroma add call."""
+        if not episodes:
+            return []
+        
+        try:
+            metadatas = []
+            for episode in episodes:
+                metadata = episode.to_dict()
+                del metadata["id"]
+                metadatas.append(metadata)
+            
+            ids = [episode.id for episode in episodes]
+            self.collection.add(
+                embeddings=[episode.combined_embedding.tolist() for episode in episodes],
+                metadatas=metadatas,
+                ids=ids
+            )
+            
+            for episode in episodes:
+                self._track_stored(episode)
+            
+            print(f"Stored {len(ids)} episodes")
+            return ids
+            
+        except Exception as e:
+            print(f"Error storing episodes: {e}")
+            raise
+    
+    def search_episodes(self, user_id: str, query: str, limit: int = 5,
+                        rerank: bool = False) -> List[Dict[str, Any]]:
+        """Search for relevant episodes using semantic similarity.
+        
+        With rerank=True the stored embeddings are fetched and similarity is
+        recomputed client-side against the query, and results are re-sorted.
+        """
         try:
             # Get query embedding
             query_embedding = get_embedding(query)
             
             # Search in Chroma with user_id filter
+            include = ["metadatas", "distances", "embeddings"] if rerank else ["metadatas", "distances"]
             results = self.collection.query(
                 query_embeddings=[query_embedding],
                 n_results=limit,
-                where={"user_id": user_id}  # Filter by user_id
+                where={"user_id": user_id},  # Filter by user_id
+                include=include
             )
             
             # Format results
             episodes = []
             if results['metadatas'] and results['metadatas'][0]:
-                for i, metadata in enumerate(results['metadatas'][0]):
-                    episode = {
-                        "id": results['ids'][0][i],
+                ids = results['ids'][0]
+                metadatas = results['metadatas'][0]
+                if rerank:
+                    similarities = _cosine_similarities(query_embedding, results['embeddings'][0])
+                else:
+                    # Convert distances to similarities in one vectorized pass
+                    similarities = 1.0 - np.asarray(results['distances'][0], dtype=np.float64)
+                episodes = [
+                    {
+                        "id": episode_id,
                         "user_message": metadata["user_message"],
                         "ai_response": metadata["ai_response"],
                         "round_number": metadata["round_number"],
                         "session_id": metadata["session_id"],
                         "timestamp": metadata["timestamp"],
                         "tokens": metadata["tokens"],
-                        "similarity": 1 - results['distances'][0][i]  # Convert distance to similarity
+                        "similarity": similarity
                     }
-                    episodes.append(episode)
+                    for episode_id, metadata, similarity in zip(ids, metadatas, similarities.tolist())
+                ]
+                if rerank:
+                    episodes.sort(key=itemgetter("similarity"), reverse=True)
             
             return episodes
             
@@ -226,48 +532,147 @@ class EpisodicMemory:
             return []
     
     def get_recent_episodes(self, user_id: str, limit: int = 10) -> List[Dict[str, Any]]:
-        """Get recent episodes for a user (fallback when no query provided)."""
+        """Get recent episodes for a user (fallback when no query provided).
+        
+        The first call per user scans all of the user's episodes; later calls
+        only fetch episodes at or after the newest timestamp already cached.
+        """
         try:
-            # Get all episodes for user (this is a limitation of Chroma - no direct timestamp ordering)
-            # We'll need to implement this differently or use a different approach
-            results = self.collection.get(
-                where={"user_id": user_id}
-            )
+            cursor = self._recent_cursor.get(user_id)
+            if cursor is None or limit > RECENT_EPISODES_CACHE_SIZE:
+                where = {"user_id": user_id}
+                known = []
+            else:
+                where = {"$and": [{"user_id": user_id}, {"timestamp_unix": {"$gte": cursor}}]}
+                known = self._recent_cache.get(user_id, [])
             
-            # Sort by timestamp if available
-            episodes = []
+            results = self.collection.get(where=where, include=["metadatas"])
+            
+            episodes = {episode["id"]: episode for episode in known}
             if results['metadatas']:
-                for i, metadata in enumerate(results['metadatas']):
-                    episode = {
-                        "id": results['ids'][i],
+                for episode_id, metadata in zip(results['ids'], results['metadatas']):
+                    timestamp_unix = metadata.get("timestamp_unix")
+                    if timestamp_unix is None:
+                        # Episodes stored before timestamp_unix was recorded
+                        timestamp_unix = _to_unix(datetime.fromisoformat(metadata["timestamp"]))
+                    episodes[episode_id] = {
+                        "id": episode_id,
                         "user_message": metadata["user_message"],
                         "ai_response": metadata["ai_response"],
                         "round_number": metadata["round_number"],
                         "session_id": metadata["session_id"],
                         "timestamp": metadata["timestamp"],
+                        "timestamp_unix": timestamp_unix,
                         "tokens": metadata["tokens"]
                     }
-                    episodes.append(episode)
             
-            # Sort by timestamp (most recent first)
-            episodes.sort(key=lambda x: x["timestamp"], reverse=True)
-            return episodes[:limit]
+            # Most recent first, without sorting the full history; timestamp_unix is whole
+            # seconds, so same-second episodes are ordered by ISO time and round number
+            recent = heapq.nlargest(
+                max(limit, RECENT_EPISODES_CACHE_SIZE),
+                episodes.values(),
+                key=_recency_key
+            )
+            self._recent_cache[user_id] = recent[:RECENT_EPISODES_CACHE_SIZE]
+            if recent:
+                self._recent_cursor[user_id] = recent[0]["timestamp_unix"]
+            return recent[:limit]
             
         except Exception as e:
             print(f"Error getting recent episodes: {e}")
             return []
     
+    def _reconcile_count(self, user_id: str) -> int:
+        """Count a user's episodes in Chroma and cache the result."""
+        # ids are always returned, so skip every other payload
+        results = self.collection.get(
+            where={"user_id": user_id},
+            include=[]
+        )
+        count = len(results['ids']) if results['ids'] else 0
+        self._count_cache[user_id] = count
+        return count
+    
     def get_episode_count(self, user_id: str) -> int:
         """Get total number of episodes for a user."""
         try:
-            results = self.collection.get(
-                where={"user_id": user_id}
-            )
-            return len(results['ids']) if results['ids'] else 0
+            count = self._count_cache.get(user_id)
+            if count is None:
+                count = self._reconcile_count(user_id)
+            return count
         except Exception as e:
             print(f"Error getting episode count: {e}")
             return 0
 
+    def get_next_round_number(self, user_id: str) -> int:
+        """Round number after the highest one stored for the user (scans their metadata)."""
+        try:
+            results = self.collection.get(
+                where={"user_id": user_id},
+                include=["metadatas"]
+            )
+            max_round = max(
+                (metadata.get("round_number", 0) for metadata in results['metadatas'] or []),
+                default=0
+            )
+            return max_round + 1
+        except Exception as e:
+            print(f"Error getting next round number: {e}")
+            return 1
+
+class AsyncEpisodicMemory:
+    """Async front end for EpisodicMemory that overlaps embedding and storage I/O.
+    
+    Embeddings use AsyncOpenAI; Chroma writes run in a worker thread because
+    the local PersistentClient has no async API.
+    """
+    
+    def __init__(self, memory: Optional[EpisodicMemory] = None):
+        self.memory = memory or _get_memory()
+    
+    async def store_conversation_round(self, user_id: str, user_message: str, ai_response: str,
+                                       round_number: int, session_id: str) -> str:
+        """Store a conversation round as an episode without blocking the event loop."""
+        embeddings = await create_episode_embeddings_async(user_message, ai_response)
+        episode = Episode(user_id, user_message, ai_response, round_number, session_id,
+                          embeddings=embeddings)
+        return await asyncio.to_thread(self.memory.store_episode, episode)
+    
+    async def store_conversation_rounds(self, user_id: str, rounds: List[Tuple[str, str]],
+                                        session_id: str, start_round: int = 1,
+                                        batch_size: int = 16) -> List[str]:
+        """Bulk-store rounds, embedding the next batch while the previous one is written."""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=4)
+        
+        async def produce() -> None:
+            try:
+                for offset in range(0, len(rounds), batch_size):
+                    batch = rounds[offset:offset + batch_size]
+                    texts = [text for round_pair in batch for text in round_pair]
+                    vectors = await get_embeddings_batch_async(texts)
+                    episodes = [
+                        Episode(user_id, user_message, ai_response, start_round + offset + i,
+                                session_id,
+                                embeddings=_combine_embeddings(vectors[2 * i], vectors[2 * i + 1]))
+                        for i, (user_message, ai_response) in enumerate(batch)
+                    ]
+                    await queue.put(episodes)
+            except Exception as e:
+                await queue.put(e)
+                return
+            await queue.put(None)
+        
+        producer = asyncio.create_task(produce())
+        episode_ids: List[str] = []
+        try:
+            while (item := await queue.get()) is not None:
+                if isinstance(item, Exception):
+                    raise item
+                episode_ids.extend(await asyncio.to_thread(self.memory.store_episodes, item))
+        finally:
+            producer.cancel()
+        return episode_ids
+
 # Convenience functions
 def create_episode(user_id: str, user_message: str, ai_response: str, 
                   round_number: int, session_id: str) -> Episode:
@@ -280,22 +685,102 @@ def create_episode(user_id: str, user_message: str, ai_response: str,
         session_id=session_id
     )
 
+def create_episodes(user_id: str, rounds: List[Tuple[str, str]], session_id: str,
+                    start_round: int = 1) -> List[Episode]:
+    """Create episodes for consecutive conversation rounds with one embedding request."""
+    texts = [text for round_pair in rounds for text in round_pair]
+    vectors = get_embeddings_batch(texts)
+    
+    return [
+        Episode(
+            user_id=user_id,
+            user_message=user_message,
+            ai_response=ai_response,
+            round_number=start_round + i,
+            session_id=session_id,
+            embeddings=_combine_embeddings(vectors[2 * i], vectors[2 * i + 1])
+        )
+        for i, (user_message, ai_response) in enumerate(rounds)
+    ]
+
+_memory: Optional[EpisodicMemory] = None
+_memory_lock = threading.Lock()
+
+def _get_memory() -> EpisodicMemory:
+    """Return the process-wide EpisodicMemory, creating it on first use."""
+    global _memory
+    if _memory is None:
+        with _memory_lock:
+            if _memory is None:
+                _memory = EpisodicMemory()
+    return _memory
+
 def store_conversation_round(user_id: str, user_message: str, ai_response: str, 
                            round_number: int, session_id: str) -> str:
     """Store a conversation round as an episode."""
     episode = create_episode(user_id, user_message, ai_response, round_number, session_id)
-    memory = EpisodicMemory()
-    return memory.store_episode(episode)
+    return _get_memory().store_episode(episode)
+
+def store_conversation_rounds(user_id: str, rounds: List[Tuple[str, str]], session_id: str,
+                              start_round: int = 1) -> List[str]:
+    """Store consecutive conversation rounds as episodes in bulk."""
+    episodes = create_episodes(user_id, rounds, session_id, start_round)
+    return _get_memory().store_episodes(episodes)
 
 def search_user_episodes(user_id: str, query: str, limit: int = 5) -> List[Dict[str, Any]]:
     """Search for episodes relevant to a query."""
-    memory = EpisodicMemory()
-    return memory.search_episodes(user_id, query, limit)
+    return _get_memory().search_episodes(user_id, query, limit)
 
 def get_user_recent_episodes(user_id: str, limit: int = 10) -> List[Dict[str, Any]]:
     """Get recent episodes for a user."""
-    memory = EpisodicMemory()
-    return memory.get_recent_episodes(user_id, limit)
+    return _get_memory().get_recent_episodes(user_id, limit)
+
+def get_next_round_number(user_id: str) -> int:
+    """Get the round number for a user's next conversation round."""
+    return _get_memory().get_next_round_number(user_id)
+
+def _id_seconds(episode_id: str) -> Optional[int]:
+    """Creation second encoded in an episode id ("ep_<unix seconds>_<suffix>"), or None."""
+    parts = episode_id.split("_", 2)
+    if len(parts) == 3 and parts[0] == "ep" and parts[1].isdigit():
+        return int(parts[1])
+    return None
+
+def get_user_episode_metadata(user_id: str, limit: int = 50, offset: int = 0) -> Dict[str, Any]:
+    """Get a page of a user's episodes (ids and metadata, no documents), most recent first.
+    
+    Episode ids start with their creation second, so the page is picked from the ids
+    alone and metadata is fetched only for it, plus any episodes sharing a boundary
+    second so same-second ties sort exactly. "total" is the user's episode count.
+    """
+    collection = _get_memory().collection
+    ids = collection.get(where={"user_id": user_id}, include=[])['ids'] or []
+    seconds = {episode_id: _id_seconds(episode_id) for episode_id in ids}
+    
+    if None in seconds.values():
+        # Ids without a timestamp prefix: order needs every metadata record
+        skipped = 0
+        results = collection.get(where={"user_id": user_id}, include=["metadatas"])
+    else:
+        window = sorted(ids, key=seconds.__getitem__, reverse=True)[offset:offset + limit]
+        if not window:
+            return {"ids": [], "metadatas": [], "total": len(ids)}
+        newest, oldest = seconds[window[0]], seconds[window[-1]]
+        skipped = sum(1 for second in seconds.values() if second > newest)
+        candidates = [episode_id for episode_id in ids if oldest <= seconds[episode_id] <= newest]
+        results = collection.get(ids=candidates, include=["metadatas"])
+    
+    episodes = sorted(
+        zip(results['ids'] or [], results['metadatas'] or []),
+        key=lambda episode: _recency_key(episode[1] or {}),
+        reverse=True,
+    )
+    page = episodes[offset - skipped:offset - skipped + limit]
+    return {
+        "ids": [episode_id for episode_id, _ in page],
+        "metadatas": [metadata for _, metadata in page],
+        "total": len(ids),
+    }
 
 # Test functions
 def test_episodic_memory():
@@ -316,8 +801,8 @@ def test_episodic_memory():
     ]
     
     # Store episodes
-    for i, (user_msg, ai_msg) in enumerate(episodes, 1):
-        episode_id = store_conversation_round(user_id, user_msg, ai_msg, i, session_id)
+    episode_ids = store_conversation_rounds(user_id, episodes, session_id)
+    for i, episode_id in enumerate(episode_ids, 1):
         print(f"Stored episode {i}: {episode_id}")
     
     # Test search
@@ -0,0 +1,50 @@
+"""
+Firebase ID-token verification with PyJWT.
+
+Verifies tokens locally against Google's published signing keys, which are
+fetched once and cached, so a verification is a single RS256 signature check
+with no Firebase Admin round trip. When the Firebase Auth emulator is in use
+(its tokens are unsigned) verification is delegated to firebase_admin.
+"""
+
+import os
+from typing import Dict, Any
+
+import jwt
+from jwt import PyJWKClient
+from firebase_admin import auth as fb_auth
+
+from _env import load_once
+
+load_once()
+
+FIREBASE_PROJECT_ID = os.getenv("FIREBASE_PROJECT_ID", "gen-lang-client-0574433212")
+_JWKS_URL = "https://www.googleapis.com/service_accounts/v1/jwk/securetoken@system.gserviceaccount.com"
+_ISSUER = f"https://securetoken.google.com/{FIREBASE_PROJECT_ID}"
+
+# Signing keys are cached for an hour; Google rotates them far less often
+_jwks = PyJWKClient(_JWKS_URL, cache_keys=True, lifespan=3600, timeout=5)
+
+def verify_id_token(token: str) -> Dict[str, Any]:
+    """Verify a Firebase ID token and return its claims, with "uid" set from "sub".
+
+    Raises:
+        jwt.PyJWTError: If the signature, audience, issuer or expiry is invalid
+        ValueError: If the token has no subject
+    """
+    if os.getenv("FIREBASE_AUTH_EMULATOR_HOST"):
+        return fb_auth.verify_id_token(token)
+
+    signing_key = _jwks.get_signing_key_from_jwt(token)
+    claims = jwt.decode(
+        token,
+        signing_key.key,
+        algorithms=["RS256"],
+        audience=FIREBASE_PROJECT_ID,
+        issuer=_ISSUER,
+        options={"require": ["exp", "iat", "sub"]},
+    )
+    if not claims.get("sub"):
+        raise ValueError("Token has no subject")
+    claims["uid"] = claims["sub"]
+    return claims
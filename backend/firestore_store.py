@@ -12,95 +12,430 @@ from __future__ import annotations
 import os
 import time
 import re
-from typing import List, Dict, Any, Optional
+import secrets
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Callable, List, Dict, Any, Optional, NamedTuple
 
-from dotenv import load_dotenv
+from cachetools import TTLCache
 from google.cloud import firestore
 from google.cloud.firestore_v1 import FieldFilter
 
-load_dotenv()
+from _env import load_once
+
+load_once()
 
 # Firestore client configuration
 _PROJECT = os.getenv("FIRESTORE_PROJECT")
 _db = firestore.Client(project=_PROJECT)
 
+# Short-lived read caches: uid -> {(limit, offset): docs}. Pages expire with their uid's entry,
+# so a write invalidates all of a user's pages with one pop.
+READ_CACHE_TTL = float(os.getenv("FIRESTORE_READ_CACHE_TTL", "10"))
+_facts_cache: TTLCache = TTLCache(maxsize=10_000, ttl=READ_CACHE_TTL)
+_messages_cache: TTLCache = TTLCache(maxsize=10_000, ttl=READ_CACHE_TTL)
+_cache_lock = threading.Lock()
+
+# Write-through recent-history cache: uid -> deque of the last HISTORY_WINDOW messages,
+# oldest first. log_message appends to it, so chat turns read history without a round trip.
+# Entries expire HISTORY_CACHE_TTL seconds after being seeded from Firestore, which bounds
+# how stale one process's copy gets when other workers or instances write for the same user.
+HISTORY_WINDOW = 12
+HISTORY_CACHE_USERS = 2048
+HISTORY_CACHE_TTL = float(os.getenv("FIRESTORE_HISTORY_CACHE_TTL", "60"))
+_history_cache: TTLCache = TTLCache(maxsize=HISTORY_CACHE_USERS, ttl=HISTORY_CACHE_TTL)
+# Per uid-hash bucket: write counters (bumped when a write is staged and again when it lands)
+# and writes still in flight. A cold read only seeds the cache if no write raced it.
+_history_epochs = [0] * 256
+_history_inflight = [0] * 256
+
+# Background pool for warm_user prefetches
+_prefetch_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="firestore-prefetch")
+
+# Background pool for message writes, which stay off the request path
+_write_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="firestore-write")
+
+# Readiness probe results are reused for this many seconds
+HEALTH_PROBE_INTERVAL = 60.0
+_last_probe_ts = 0.0
+_last_probe_result: Optional[Dict[str, Any]] = None
+_probe_lock = threading.Lock()
+
+# Page size the web client and chat context request by default
+DEFAULT_PAGE_SIZE = 12
+
 # Helper functions
-def _user_refs(uid: str):
+class _UserRefs(NamedTuple):
+    user: Any
+    memories: Any
+    messages: Any
+    profile: Any
+    episodes: Any
+
+@lru_cache(maxsize=4096)
+def _user_refs(uid: str) -> _UserRefs:
+    """Firestore references for a user; pure function of uid, so cached."""
     user = _db.collection("users").document(uid)
-    return {
-        "user": user,
-        "memories": user.collection("memories"),
-        "messages": user.collection("messages"),
-        "profile": user.collection("meta").document("profile"),
-    }
+    return _UserRefs(
+        user=user,
+        memories=user.collection("memories"),
+        messages=user.collection("messages"),
+        profile=user.collection("meta").document("profile"),
+        episodes=user.collection("meta").document("episodes"),
+    )
 
 _slug_rx = re.compile(r"[^a-z0-9]+")
+# ASCII fast path: map every character outside [a-z0-9] to "-"
+_SLUG_TABLE = str.maketrans({
+    chr(c): "-" for c in range(128)
+    if not (ord("a") <= c <= ord("z") or ord("0") <= c <= ord("9"))
+})
 
 def _slug(s: str) -> str:
     """Convert string to URL-safe slug."""
-    return _slug_rx.sub("-", s.lower()).strip("-")
+    s = s.lower()
+    if not s.isascii():
+        return _slug_rx.sub("-", s).strip("-")
+    # Collapsing empty parts matches the regex's run-of-separators behaviour
+    return "-".join(part for part in s.translate(_SLUG_TABLE).split("-") if part)
+
+def _invalidate(cache: TTLCache, uid: str) -> None:
+    """Drop every cached read for uid."""
+    with _cache_lock:
+        cache.pop(uid, None)
+
+def _cached_page(cache: TTLCache, uid: str, page: tuple) -> Optional[list]:
+    """Look up a cached (limit, offset) page for uid. Caller must hold _cache_lock."""
+    pages = cache.get(uid)
+    return pages.get(page) if pages is not None else None
+
+def _cache_page(cache: TTLCache, uid: str, page: tuple, docs: list) -> None:
+    """Cache a (limit, offset) page for uid. Caller must hold _cache_lock."""
+    pages = cache.get(uid)
+    if pages is None:
+        pages = cache[uid] = {}
+    pages[page] = docs
 
 def _now() -> float:
     """Get current timestamp."""
     return float(time.time())
 
+# Existing-memory fields add_memory reads to decide how to merge
+_MERGE_FIELDS = ["type", "value", "confidence", "salience", "ts"]
+
+# Fields the web memory panel reads; ts/updated_at are not sent back
+_FACT_FIELDS = ["type", "key", "value", "confidence", "salience", "score"]
+
+# Write records: fields are coerced to Firestore primitives once, at construction
+@dataclass(slots=True)
+class MemoryRecord:
+    """A memory document as written by add_memory."""
+    type: str
+    key: str
+    value: Any
+    confidence: float
+    salience: float
+    ts: float
+    score: float = field(init=False)
+    
+    def __post_init__(self):
+        self.confidence = float(self.confidence)
+        self.salience = float(self.salience)
+        self.ts = float(self.ts)
+        self.score = round(self.salience * self.confidence, 6)
+    
+    def to_firestore_dict(self) -> Dict[str, Any]:
+        return {
+            "type": self.type,
+            "key": self.key,
+            "value": self.value,
+            "confidence": self.confidence,
+            "salience": self.salience,
+            "ts": self.ts,
+            "score": self.score,
+        }
+
+@dataclass(slots=True)
+class MessageRecord:
+    """A chat message document as written by log_message."""
+    role: str
+    content: str
+    ts: float
+    
+    def to_firestore_dict(self) -> Dict[str, Any]:
+        return {"role": self.role, "content": self.content, "ts": self.ts}
+
 VERSION_TAG = "firestore_store v0.2 NON-TRANSACTIONAL"
 
+def _parse_memory(item: Dict[str, Any]) -> MemoryRecord:
+    """Incoming memory item with add_memory's defaults applied."""
+    return MemoryRecord(
+        type=item.get("type", "semantic"),
+        key=item.get("key", ""),
+        value=item.get("value", ""),
+        confidence=item.get("confidence", 0.9),
+        salience=item.get("salience", 1.0),
+        ts=item.get("ts", _now()),
+    )
+
+def _memory_doc_id(record: MemoryRecord) -> str:
+    return f"{record.type}:{_slug(record.key) or 'key'}"
+
+def _merge_memory(record: MemoryRecord, cur: Dict[str, Any]) -> MemoryRecord:
+    """Merge an incoming memory with the stored fields (if any) of the same document."""
+    if not cur:
+        return record
+    salience, confidence = record.salience, record.confidence
+    # If same {type,key,value} re-appears, nudge salience & keep higher confidence
+    if (cur.get("value") == record.value) and (cur.get("type") == record.type):
+        salience = min(float(cur.get("salience", 1.0)) + 0.2, 10.0)
+        confidence = max(float(cur.get("confidence", 0.9)), confidence)
+    return MemoryRecord(
+        type=record.type,
+        key=record.key,
+        value=record.value,
+        confidence=confidence,
+        salience=salience,
+        ts=cur.get("ts", record.ts),
+    )
+
+def _memory_write(record: MemoryRecord) -> Dict[str, Any]:
+    # updated_at is stamped by Firestore at commit; ts stays a client float
+    # because callers supply it and existing documents are ordered by it
+    return {**record.to_firestore_dict(), "updated_at": firestore.SERVER_TIMESTAMP}
+
 # Public API functions
 def add_memory(uid: str, item: Dict[str, Any]) -> Dict[str, Any]:
     """Non-transactional upsert (MVP)."""
     refs = _user_refs(uid)
-    mtype = item.get("type", "semantic")
-    key = item.get("key", "")
-    value = item.get("value", "")
-    confidence = float(item.get("confidence", 0.9))
-    salience = float(item.get("salience", 1.0))
-    ts = float(item.get("ts", _now()))
-    doc_id = f"{mtype}:{_slug(key) or 'key'}"
-    doc_ref = refs["memories"].document(doc_id)
-
-    snap = doc_ref.get()
-    cur = snap.to_dict() if snap.exists else {}
+    record = _parse_memory(item)
+    doc_ref = refs.memories.document(_memory_doc_id(record))
 
-    # If same {type,key,value} re-appears, nudge salience & keep higher confidence
-    if cur and (cur.get("value") == value) and (cur.get("type") == mtype):
-        salience = min(float(cur.get("salience", 1.0)) + 0.2, 10.0)
-        confidence = max(float(cur.get("confidence", 0.9)), confidence)
+    # Deterministic id makes this an upsert; only read the fields the merge needs
+    snap = doc_ref.get(field_paths=_MERGE_FIELDS)
+    record = _merge_memory(record, snap.to_dict() if snap.exists else {})
+
+    doc_ref.set(_memory_write(record), merge=True)
+    _invalidate(_facts_cache, uid)
+    return record.to_firestore_dict()
 
-    data = {
-        **(cur or {}),
-        "type": mtype,
-        "key": key,
-        "value": value,
-        "confidence": confidence,
-        "salience": salience,
-        "ts": cur.get("ts", ts) if cur else ts,
-        "updated_at": _now(),
+def add_memories_bulk(uid: str, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Upsert many memories with one batched read and a BulkWriter session.
+    
+    Items that map to the same document collapse to the last one.
+    """
+    refs = _user_refs(uid)
+    records = {}
+    for item in items:
+        record = _parse_memory(item)
+        records[_memory_doc_id(record)] = record
+    if not records:
+        return []
+    
+    doc_refs = [refs.memories.document(doc_id) for doc_id in records]
+    current = {
+        snap.id: snap.to_dict()
+        for snap in _db.get_all(doc_refs, field_paths=_MERGE_FIELDS)
+        if snap.exists
     }
-    data["score"] = round(float(data["salience"]) * float(data["confidence"]), 6)
-    doc_ref.set(data)
-    return data
+    
+    saved = []
+    writer = _db.bulk_writer()
+    for doc_ref in doc_refs:
+        record = _merge_memory(records[doc_ref.id], current.get(doc_ref.id, {}))
+        writer.set(doc_ref, _memory_write(record), merge=True)
+        saved.append(record.to_firestore_dict())
+    writer.close()
+    _invalidate(_facts_cache, uid)
+    return saved
 
 def get_top_facts(uid: str, limit: int = 6, offset: int = 0) -> list[dict]:
+    """Top semantic facts by precomputed score (served by the type+score index in firestore.indexes.json)."""
+    page = (int(limit), int(offset))
+    with _cache_lock:
+        cached = _cached_page(_facts_cache, uid, page)
+    if cached is not None:
+        return list(cached)
+    
     refs = _user_refs(uid)
     q = (
-        refs["memories"]
+        refs.memories
         .where(filter=FieldFilter("type", "==", "semantic"))
         .order_by("score", direction=firestore.Query.DESCENDING)
         .limit(int(limit))
         .offset(int(offset))
+        .select(_FACT_FIELDS)
     )
-    return [{**d.to_dict(), "id": d.id} for d in q.stream()]
+    facts = [{**d.to_dict(), "id": d.id} for d in q.stream()]
+    with _cache_lock:
+        _cache_page(_facts_cache, uid, page, facts)
+    return list(facts)
+
+def _message_id(ts: float) -> str:
+    """Time-sortable message id: microsecond timestamp in hex plus a random suffix."""
+    return f"{int(ts * 1_000_000):016x}-{secrets.token_hex(4)}"
+
+def _history_bucket(uid: str) -> int:
+    """Index of uid's write counter in _history_epochs."""
+    return hash(uid) & (len(_history_epochs) - 1)
+
+def _seed_history(uid: str, docs: List[Dict[str, Any]], epoch: int) -> None:
+    """Cache a user's complete recent history unless a write was staged or landed during the read."""
+    bucket = _history_bucket(uid)
+    with _cache_lock:
+        if _history_epochs[bucket] != epoch or _history_inflight[bucket]:
+            return
+        _history_cache[uid] = deque(docs[-HISTORY_WINDOW:], maxlen=HISTORY_WINDOW)
+
+def _land_messages(uid: str, count: int, stored: bool) -> None:
+    """Record that count staged messages finished writing, successfully or not."""
+    bucket = _history_bucket(uid)
+    with _cache_lock:
+        # Reads that overlapped the write may have missed it, so they must not seed the cache
+        _history_epochs[bucket] += 1
+        _history_inflight[bucket] -= count
+        if not stored:
+            # The write-through copy now holds messages Firestore never stored
+            _history_cache.pop(uid, None)
+    _invalidate(_messages_cache, uid)
+
+def _write_message(uid: str, ref, doc: Dict[str, Any]) -> None:
+    """Persist a logged message, then drop any history cached while it was in flight."""
+    stored = False
+    try:
+        ref.set(doc)
+        stored = True
+    except Exception as e:
+        print(f"Error logging message {ref.id} for {uid}: {e}")
+    finally:
+        _land_messages(uid, 1, stored)
+
+def _write_messages(uid: str, staged: List[tuple]) -> None:
+    """Persist several logged messages in one batch commit."""
+    stored = False
+    try:
+        batch = _db.batch()
+        for ref, doc in staged:
+            batch.set(ref, doc)
+        batch.commit()
+        stored = True
+    except Exception as e:
+        print(f"Error logging {len(staged)} messages for {uid}: {e}")
+    finally:
+        _land_messages(uid, len(staged), stored)
+
+def _stage_message(uid: str, role: str, content: str, ts: Optional[float]) -> tuple:
+    """Build a message's (document ref, data) and add it to the write-through history."""
+    record = MessageRecord(role=role, content=content, ts=float(ts or _now()))
+    doc = record.to_firestore_dict()
+    ref = _user_refs(uid).messages.document(_message_id(record.ts))
+    bucket = _history_bucket(uid)
+    with _cache_lock:
+        _history_epochs[bucket] += 1
+        _history_inflight[bucket] += 1
+        history = _history_cache.get(uid)
+        if history is not None:
+            history.append(dict(doc))
+    return ref, doc
 
 def log_message(uid: str, role: str, content: str, ts: Optional[float] = None) -> str:
-    refs = _user_refs(uid)
-    doc = {"role": role, "content": content, "ts": float(ts or _now())}
-    ref = refs["messages"].document()
-    ref.set(doc)
+    """Queue a message write and return its client-generated id without waiting."""
+    ref, doc = _stage_message(uid, role, content, ts)
+    _invalidate(_messages_cache, uid)
+    _write_executor.submit(_write_message, uid, ref, doc)
     return ref.id
 
+def log_messages_batch(uid: str, messages: List[Dict[str, Any]]) -> List[str]:
+    """Queue several messages (dicts with role, content and optional ts) as one batched write.
+    
+    Used to persist a whole chat turn with a single commit. Returns the
+    client-generated ids in order without waiting for the write.
+    """
+    staged = [_stage_message(uid, m["role"], m["content"], m.get("ts")) for m in messages]
+    _invalidate(_messages_cache, uid)
+    _write_executor.submit(_write_messages, uid, staged)
+    return [ref.id for ref, _ in staged]
+
 def get_last_messages(uid: str, limit: int = 6, offset: int = 0) -> List[Dict[str, Any]]:
+    limit, offset = int(limit), int(offset)
+    if offset == 0 and limit <= HISTORY_WINDOW:
+        with _cache_lock:
+            history = _history_cache.get(uid)
+            if history is not None:
+                items = [dict(m) for m in history]
+                return items[max(len(items) - limit, 0):]
+    
+    page = (limit, offset)
+    with _cache_lock:
+        cached = _cached_page(_messages_cache, uid, page)
+        epoch = _history_epochs[_history_bucket(uid)]
+    if cached is not None:
+        return list(cached)
+    
     refs = _user_refs(uid)
-    q = refs["messages"].order_by("ts", direction=firestore.Query.DESCENDING).limit(int(limit)).offset(int(offset))
-    docs = [d.to_dict() for d in q.stream()]
-    return list(reversed(docs))
+    q = refs.messages.order_by("ts", direction=firestore.Query.DESCENDING).limit(limit).offset(offset)
+    # Stream arrives newest first; appendleft leaves the buffer oldest first
+    buf: deque = deque(maxlen=limit)
+    for d in q.stream():
+        buf.appendleft(d.to_dict())
+    docs = list(buf)
+    with _cache_lock:
+        _cache_page(_messages_cache, uid, page, docs)
+    # A first page that is full-window, or shorter than asked (whole history), is complete
+    if offset == 0 and (limit >= HISTORY_WINDOW or len(docs) < limit):
+        _seed_history(uid, docs, epoch)
+    return list(docs)
+
+def allocate_round_number(uid: str, first_round: Callable[[], int]) -> int:
+    """Atomically reserve the user's next episode round number.
+    
+    The last issued round lives in one Firestore document, so every worker and
+    instance draws from the same sequence. first_round() seeds a missing counter.
+    """
+    ref = _user_refs(uid).episodes
+    
+    @firestore.transactional
+    def reserve(transaction) -> int:
+        snapshot = ref.get(transaction=transaction)
+        last_round = (snapshot.to_dict() or {}).get("last_round") if snapshot.exists else None
+        round_number = first_round() if last_round is None else int(last_round) + 1
+        transaction.set(ref, {"last_round": round_number}, merge=True)
+        return round_number
+    
+    return reserve(_db.transaction())
+
+def _prefetch(fn, uid: str) -> None:
+    """Run a read for its cache side effect, logging instead of raising."""
+    try:
+        fn(uid, DEFAULT_PAGE_SIZE, 0)
+    except Exception as e:
+        print(f"Prefetch {fn.__name__} failed for {uid}: {e}")
+
+def warm_user(uid: str) -> None:
+    """Start loading a user's top facts and recent messages into the read caches.
+    
+    Returns immediately; the first chat turn and page loads then hit warm caches.
+    """
+    _prefetch_executor.submit(_prefetch, get_top_facts, uid)
+    _prefetch_executor.submit(_prefetch, get_last_messages, uid)
+
+def health_check(deep: bool = False) -> Dict[str, Any]:
+    """Firestore health; deep=True runs a real read at most once per HEALTH_PROBE_INTERVAL."""
+    global _last_probe_ts, _last_probe_result
+    if not deep:
+        return {"healthy": _db is not None, "cached": True}
+    
+    with _probe_lock:
+        if _last_probe_result is not None and _now() - _last_probe_ts < HEALTH_PROBE_INTERVAL:
+            return {**_last_probe_result, "cached": True}
+        try:
+            list(_db.collection("_health_check").limit(1).stream())
+            result = {"healthy": True}
+        except Exception as e:
+            result = {"healthy": False, "error": str(e)}
+        _last_probe_ts = _now()
+        _last_probe_result = result
+        return {**result, "cached": False}
@@ -11,14 +11,18 @@ This module handles:
 
 from __future__ import annotations
 import os
-import json
 import asyncio
+import logging
 import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import Dict, Any, List, Optional, AsyncGenerator, Tuple
 
-from openai import OpenAI
+import httpx
+import numpy as np
+from openai import AsyncOpenAI
 from fastapi.responses import StreamingResponse
-from dotenv import load_dotenv
 
 # Local imports
 from profile_card import (
@@ -29,35 +33,43 @@ from profile_card import (
     validate_updates, 
     contains_new_information
 )
+import _serde
+from _env import load_once
 from monitoring import metrics
 from logging_config import log_request
-from firestore_store import log_message, get_last_messages
-from episodic_memory import store_conversation_round, search_user_episodes, get_user_recent_episodes
+from firestore_store import log_message, log_messages_batch, get_last_messages, allocate_round_number
+from episodic_memory import store_conversation_round, search_user_episodes, get_user_recent_episodes, get_next_round_number, get_embedding
 
-load_dotenv(override=True)
+load_once()
+
+logger = logging.getLogger(__name__)
 
 # Configuration
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-5-nano")
 
+# Runs independent context lookups (Firestore history, Chroma episodes) concurrently
+_context_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="llm-context")
+
 if OPENAI_API_KEY:
-    _client = OpenAI(api_key=OPENAI_API_KEY)
+    # One process-wide client over a pooled HTTP/2 transport, so chat turns reuse warm
+    # connections instead of paying a TLS handshake; timeouts match the SDK defaults.
+    _client = AsyncOpenAI(
+        api_key=OPENAI_API_KEY,
+        http_client=httpx.AsyncClient(
+            limits=httpx.Limits(max_keepalive_connections=50, max_connections=100),
+            http2=True,
+            timeout=httpx.Timeout(600.0, connect=5.0),
+        ),
+    )
     _use_openai = True
 else:
     _client = None
     _use_openai = False
 
-# LLM prompt templates and context formatting
-def format_llm_messages(user_id: str, user_message: str, profile_card: ProfileCard) -> List[Dict[str, str]]:
-    """Format messages for LLM using system and user roles with function calling."""
-    
-    profile_context = format_profile_for_llm(profile_card)
-    
-    # Get relevant episodes for context
-    episode_context = get_episode_context(user_id, user_message)
-    
-    # System message contains instructions and context
-    system_content = f"""You are **Roary**, a playful, curious dinosaur buddy for kids aged 6–10.  
+# Static part of the system prompt, built once; only the profile and episode context vary.
+# Keeping these bytes identical across requests also helps OpenAI's prompt-prefix caching.
+_SYSTEM_PREFIX = """You are **Roary**, a playful, curious dinosaur buddy for kids aged 6–10.  
 You love making friends, asking questions, and collecting “dino-snacks of knowledge.”  
 You are excitable, sometimes clumsy, but always encouraging and safe.  
 Your mission: be a fun companion that sparks curiosity and imagination, while also learning about the user to provide personalized experiences.  
@@ -101,17 +113,42 @@ Your mission: be a fun companion that sparks curiosity and imagination, while al
 # Context
 
 <user_profile>
-{profile_context}
-</user_profile>
-
-{episode_context}
 """
+_SYSTEM_MID = "\n</user_profile>\n\n"
 
-    # Get conversation history (past 6 rounds = 12 messages)
-    conversation_history = get_last_messages(user_id, limit=12, offset=0)
+# LLM prompt templates and context formatting
+def estimate_tokens(num_chars: int) -> int:
+    """Approximate token count from text length (~4 characters per token for English)."""
+    return num_chars // 4
+
+def start_context_lookups(user_id: str, user_message: str) -> Tuple[Future, Future]:
+    """Start the conversation-history and episode lookups on the context pool."""
+    # Get conversation history (past 6 rounds = 12 messages) while episodes are searched
+    history_future = _context_executor.submit(get_last_messages, user_id, limit=12, offset=0)
+    episode_future = _context_executor.submit(get_episode_context, user_id, user_message)
+    return history_future, episode_future
+
+def format_llm_messages(user_id: str, user_message: str, profile_card: ProfileCard,
+                        lookups: Optional[Tuple[Future, Future]] = None,
+                        stats: Optional[Dict[str, int]] = None) -> List[Dict[str, str]]:
+    """Format messages for LLM using system and user roles with function calling."""
+    
+    # Callers that started the lookups early (before loading the profile) pass them in
+    history_future, episode_future = lookups or start_context_lookups(user_id, user_message)
     
-    # Build messages array starting with system message
+    profile_context = format_profile_for_llm(profile_card)
+    
+    # Get relevant episodes for context
+    episode_context = episode_future.result()
+    
+    # System message: static instructions plus per-request context
+    system_content = _SYSTEM_PREFIX + profile_context + _SYSTEM_MID + episode_context + "\n"
+
+    conversation_history = history_future.result()
+    
+    # Build messages array starting with system message, counting prompt characters as we go
     messages = [{"role": "system", "content": system_content}]
+    input_chars = len(system_content)
     
     # Add conversation history
     for msg in conversation_history:
@@ -119,57 +156,136 @@ Your mission: be a fun companion that sparks curiosity and imagination, while al
         content = msg.get("content", "")
         if content.strip():  # Only add non-empty messages
             messages.append({"role": role, "content": content})
+            input_chars += len(content)
     
     # Add current user message
     messages.append({"role": "user", "content": user_message})
+    input_chars += len(user_message)
+    
+    if stats is not None:
+        stats["input_tokens"] = estimate_tokens(input_chars)
     
     return messages
 
+def _field_value(section: Optional[Dict[str, Any]], name: str) -> str:
+    """Value of a single-value profile field, or "" when it is missing or empty."""
+    field = (section or {}).get(name)
+    return (field.get("value") if isinstance(field, dict) else None) or ""
+
+def _field_keys(section: Optional[Dict[str, Any]], name: str) -> str:
+    """Comma-separated keys of a dict profile field, or "" when it is missing or empty."""
+    field = (section or {}).get(name)
+    return ", ".join(field) if isinstance(field, dict) else ""
+
 def format_profile_for_llm(profile: ProfileCard) -> str:
     """Format profile card for LLM context injection."""
-    sections = profile.sections
-    
-    # Helper function to format dictionary fields
-    def format_dict_field(field_dict: Dict[str, Any]) -> str:
-        if not field_dict:
-            return ""
-        return ", ".join(field_dict.keys())
-    
-    # Helper function to format single value fields
-    def format_value_field(field_dict: Dict[str, Any]) -> str:
-        if not field_dict or not field_dict.get("value"):
-            return ""
-        return field_dict["value"]
+    sections = profile.sections or {}
+    demo = sections.get('demographics')
+    prefs = sections.get('preferences')
+    limits = sections.get('constraints')
+    comm = sections.get('communication')
     
+    # Clients can store partial sections, so every field lookup tolerates missing or None values
     context = f"""User Profile:
-Name: {format_value_field(sections['demographics']['name'])}, Age: {format_value_field(sections['demographics']['age'])}
-Location: {format_value_field(sections['demographics']['location'])}
+Name: {_field_value(demo, 'name')}, Age: {_field_value(demo, 'age')}
+Location: {_field_value(demo, 'location')}
 
-Interests: {format_dict_field(sections['interests']['primary_interests'])}
+Interests: {_field_keys(sections.get('interests'), 'primary_interests')}
 
 Preferences:
-- Favorite animals: {format_dict_field(sections['preferences']['favorite_animals'])}
-- Favorite foods: {format_dict_field(sections['preferences']['favorite_foods'])}
-- Favorite colors: {format_dict_field(sections['preferences']['favorite_colors'])}
+- Favorite animals: {_field_keys(prefs, 'favorite_animals')}
+- Favorite foods: {_field_keys(prefs, 'favorite_foods')}
+- Favorite colors: {_field_keys(prefs, 'favorite_colors')}
 
 Constraints:
-- Safety: {format_dict_field(sections['constraints']['safety_limits'])}
-- Schedule: {format_dict_field(sections['constraints']['schedule_limits'])}
-- Health: {format_dict_field(sections['constraints']['health_limits'])}
+- Safety: {_field_keys(limits, 'safety_limits')}
+- Schedule: {_field_keys(limits, 'schedule_limits')}
+- Health: {_field_keys(limits, 'health_limits')}
 
 Current Context:
-- Goals: {format_dict_field(sections['goals']['learning_goals'])}
-- Recent events: {format_dict_field(sections['context']['recent_events'])}
+- Goals: {_field_keys(sections.get('goals'), 'learning_goals')}
+- Recent events: {_field_keys(sections.get('context'), 'recent_events')}
 
-Communication Style: {format_value_field(sections['communication']['style'])}
-Learning Level: {format_value_field(sections['communication']['learning_level'])}
+Communication Style: {_field_value(comm, 'style')}
+Learning Level: {_field_value(comm, 'learning_level')}
 """
     
     return context
 
+class SemanticCache:
+    """Per-user cache of formatted episode context keyed by query embedding.
+    
+    A lookup hits when a cached query's embedding has cosine similarity of at
+    least threshold with the new one. Entries expire after ttl seconds, each
+    user keeps at most max_entries, and at most max_users users are tracked.
+    """
+    
+    def __init__(self, threshold: float = 0.9, ttl: float = 300.0,
+                 max_entries: int = 32, max_users: int = 1000):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_users = max_users
+        # user_id -> [(expires_at, unit_vector, payload)], users in LRU order
+        self._entries: "OrderedDict[str, List[Tuple[float, np.ndarray, str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _normalize(embedding: List[float]) -> Optional[np.ndarray]:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        # Zero vectors (embeddings unavailable) cannot be compared
+        return vector / norm if norm > 0 else None
+    
+    def get(self, user_id: str, embedding: List[float]) -> Optional[str]:
+        """Return the cached payload for the most similar live query, if close enough."""
+        query = self._normalize(embedding)
+        if query is None:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entries = [entry for entry in self._entries.get(user_id, []) if entry[0] > now]
+            if not entries:
+                self._entries.pop(user_id, None)
+                return None
+            self._entries[user_id] = entries
+            self._entries.move_to_end(user_id)
+            similarities = np.stack([entry[1] for entry in entries]) @ query
+            best = int(np.argmax(similarities))
+            return entries[best][2] if similarities[best] >= self.threshold else None
+    
+    def put(self, user_id: str, embedding: List[float], payload: str) -> None:
+        """Cache payload for a query embedding."""
+        vector = self._normalize(embedding)
+        if vector is None:
+            return
+        with self._lock:
+            entries = self._entries.setdefault(user_id, [])
+            entries.append((time.monotonic() + self.ttl, vector, payload))
+            del entries[:-self.max_entries]
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+    
+    def invalidate(self, user_id: str) -> None:
+        """Drop a user's entries (e.g. after a new episode is stored)."""
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+_episode_context_cache = SemanticCache(
+    threshold=float(os.getenv("EPISODE_CONTEXT_CACHE_THRESHOLD", "0.9"))
+)
+
 def get_episode_context(user_id: str, user_message: str, max_episodes: int = 3) -> str:
     """Get relevant episodes for context injection."""
     try:
+        # Embed once: the semantic cache probe and the episode search share the
+        # embedding through episodic_memory's in-process embedding cache
+        query_embedding = get_embedding(user_message)
+        cached = _episode_context_cache.get(user_id, query_embedding)
+        if cached is not None:
+            return cached
+        
         # Search for relevant episodes
         episodes = search_user_episodes(user_id, user_message, limit=max_episodes)
         
@@ -180,68 +296,174 @@ def get_episode_context(user_id: str, user_message: str, max_episodes: int = 3)
         if not episodes:
             return ""
         
-        # Format episodes for context
-        episode_texts = []
+        # Format episodes for context, truncating each message to 100 characters
+        parts = ["\n# Recent Relevant Conversations"]
         for episode in episodes:
-            episode_text = f"• [Round {episode['round_number']}] User: {episode['user_message'][:100]}{'...' if len(episode['user_message']) > 100 else ''}\n  AI: {episode['ai_response'][:100]}{'...' if len(episode['ai_response']) > 100 else ''}"
-            episode_texts.append(episode_text)
+            user_text = episode['user_message']
+            ai_text = episode['ai_response']
+            if len(user_text) > 100:
+                user_text = user_text[:100] + '...'
+            if len(ai_text) > 100:
+                ai_text = ai_text[:100] + '...'
+            parts.append(f"• [Round {episode['round_number']}] User: {user_text}\n  AI: {ai_text}")
         
-        return f"\n# Recent Relevant Conversations\n" + "\n".join(episode_texts)
+        context = "\n".join(parts)
+        _episode_context_cache.put(user_id, query_embedding, context)
+        return context
         
     except Exception as e:
         print(f"Error getting episode context: {e}")
         return ""
 
 
-# Function definitions for OpenAI function calling
-def get_profile_update_function_definition() -> Dict[str, Any]:
-    """Get the function definition for profile updates."""
-    return {
-        "name": "profile_update",
-        "description": "Update user profile with new information learned during conversation",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "updates": {
-                    "type": "array",
-                    "description": "Array of profile updates to apply",
-                    "items": {
-                        "type": "object",
-                        "properties": {
-                            "section": {
-                                "type": "string",
-                                "description": "Profile section to update",
-                                "enum": ["demographics", "interests", "preferences", "constraints", "goals", "context", "communication"]
-                            },
-                            "field": {
-                                "type": "string",
-                                "description": "Field within the section to update"
-                            },
-                            "value": {
-                                "type": "string",
-                                "description": "New value for the field"
-                            },
-                            "confidence": {
-                                "type": "number",
-                                "minimum": 0.0,
-                                "maximum": 1.0,
-                                "description": "Confidence level for this update (0.0 to 1.0)"
-                            },
-                            "reason": {
-                                "type": "string",
-                                "description": "Reason for this update based on user input"
-                            }
+# Function definitions for OpenAI function calling (constant, built once at import)
+_PROFILE_UPDATE_FUNCTION_DEF: Dict[str, Any] = {
+    "name": "profile_update",
+    "description": "Update user profile with new information learned during conversation",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "updates": {
+                "type": "array",
+                "description": "Array of profile updates to apply",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "section": {
+                            "type": "string",
+                            "description": "Profile section to update",
+                            "enum": ["demographics", "interests", "preferences", "constraints", "goals", "context", "communication"]
+                        },
+                        "field": {
+                            "type": "string",
+                            "description": "Field within the section to update"
                         },
-                        "required": ["section", "field", "value", "confidence", "reason"]
-                    }
+                        "value": {
+                            "type": "string",
+                            "description": "New value for the field"
+                        },
+                        "confidence": {
+                            "type": "number",
+                            "minimum": 0.0,
+                            "maximum": 1.0,
+                            "description": "Confidence level for this update (0.0 to 1.0)"
+                        },
+                        "reason": {
+                            "type": "string",
+                            "description": "Reason for this update based on user input"
+                        }
+                    },
+                    "required": ["section", "field", "value", "confidence", "reason"]
                 }
-            },
-            "required": ["updates"]
-        }
+            }
+        },
+        "required": ["updates"]
     }
+}
+_FUNCTIONS_LIST = [_PROFILE_UPDATE_FUNCTION_DEF]
+
+_VALID_SECTIONS = frozenset([
+    "demographics", "interests", "preferences", "constraints", "goals", "context", "communication"
+])
+
+def get_profile_update_function_definition() -> Dict[str, Any]:
+    """Get the function definition for profile updates."""
+    return _PROFILE_UPDATE_FUNCTION_DEF
 
 
 # Streaming LLM response handling
+class StreamBuffer:
+    """Coalesce streamed text chunks into fewer, larger SSE frames.
+    
+    Buffered text is released once it reaches max_bytes or flush_interval_ms
+    has passed since the last release; the check runs as chunks arrive, so
+    callers must flush() whatever remains when the stream ends.
+    """
+    
+    def __init__(self, max_bytes: int = 8192, flush_interval_ms: float = 25):
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval_ms / 1000.0
+        self._parts: List[str] = []
+        self._size = 0
+        self._last_flush = time.monotonic()
+    
+    def add(self, chunk: str) -> Optional[str]:
+        """Buffer chunk; return the coalesced text if a threshold tripped."""
+        self._parts.append(chunk)
+        self._size += len(chunk)
+        if self._size >= self.max_bytes or time.monotonic() - self._last_flush >= self.flush_interval:
+            return self.flush()
+        return None
+    
+    def flush(self) -> str:
+        """Return and clear everything buffered so far."""
+        text = "".join(self._parts)
+        self._parts.clear()
+        self._size = 0
+        self._last_flush = time.monotonic()
+        return text
+
+class UpdatesScanner:
+    """Incrementally extracts the objects of the function call's "updates" array.
+    
+    Arguments arrive as JSON text split across stream events. feed() tracks
+    nesting and string state across chunks and returns each update object as
+    soon as its closing brace arrives, keeping only the object in progress.
+    Objects that fail to parse are counted in errors and skipped.
+    """
+    
+    # Depth of an update object: outer arguments object, then the updates array
+    _UPDATE_DEPTH = 3
+    
+    def __init__(self):
+        self._parts: List[str] = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._capturing = False
+        self.errors = 0
+    
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """Consume a chunk of argument text and return the updates it completed."""
+        completed = []
+        start = 0 if self._capturing else None
+        for i, ch in enumerate(chunk):
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+            if ch == '"':
+                self._in_string = True
+            elif ch == "{" or ch == "[":
+                self._depth += 1
+                if self._depth == self._UPDATE_DEPTH and ch == "{":
+                    self._capturing = True
+                    start = i
+            elif ch == "}" or ch == "]":
+                self._depth -= 1
+                if self._capturing and self._depth == self._UPDATE_DEPTH - 1:
+                    self._parts.append(chunk[start:i + 1])
+                    text = "".join(self._parts)
+                    self._parts.clear()
+                    self._capturing = False
+                    start = None
+                    try:
+                        update = _serde.loads(text)
+                    except _serde.JSONDecodeError:
+                        self.errors += 1
+                        continue
+                    if isinstance(update, dict):
+                        completed.append(update)
+                    else:
+                        self.errors += 1
+        if self._capturing and start is not None:
+            self._parts.append(chunk[start:])
+        return completed
+
 async def stream_llm_response(messages: List[Dict[str, str]]):
     """Stream LLM response with function call handling. Returns (chunk, profile_updates, raw_output)."""
     
@@ -254,56 +476,53 @@ async def stream_llm_response(messages: List[Dict[str, str]]):
     try:
         # Use OpenAI streaming API with function calling
         # Use "auto" but with strong prompting to ensure content generation
-        stream = _client.chat.completions.create(
+        stream = await _client.chat.completions.create(
             model=OPENAI_MODEL,
             messages=messages,
-            functions=[get_profile_update_function_definition()],
+            functions=_FUNCTIONS_LIST,
             function_call="auto",
             stream=True,
         )
         
-        buffer = ""
-        raw_output = ""
-        profile_updates = {"updates": []}
-        function_call_buffer = ""
-        in_function_call = False
+        # Accumulate in lists and join once; str += is quadratic in the worst case
+        content_parts: List[str] = []
+        raw_parts: List[str] = []
+        # Function call arguments are parsed update by update as they stream in
+        updates_scanner = UpdatesScanner()
+        parsed_updates: List[Dict[str, Any]] = []
         
-        for event in stream:
+        async for event in stream:
             delta = event.choices[0].delta
             
             # Handle content (visible text)
             if delta.content:
-                buffer += delta.content
-                raw_output += delta.content
+                content_parts.append(delta.content)
+                raw_parts.append(delta.content)
                 yield (delta.content, "", "")
             
             # Handle function calls
             if delta.function_call:
-                function_call_buffer += delta.function_call.arguments or ""
-                raw_output += f"<function_call>{delta.function_call.arguments or ''}</function_call>"
+                arguments = delta.function_call.arguments or ""
+                parsed_updates.extend(updates_scanner.feed(arguments))
+                raw_parts.append(f"<function_call>{arguments}</function_call>")
                 continue
             
             # Check if function call is complete
             if event.choices[0].finish_reason == "function_call":
-                try:
-                    # Parse the buffered function call arguments
-                    function_args = json.loads(function_call_buffer)
-                    if function_args.get("updates"):
-                        profile_updates = function_args
-                        print(f"DEBUG: Parsed {len(profile_updates['updates'])} profile updates from function call")
-                except json.JSONDecodeError as e:
-                    print(f"Error parsing function call arguments: {e}")
-                    print(f"DEBUG: Function call buffer: '{function_call_buffer}'")
+                logger.debug("Parsed %d profile updates from function call", len(parsed_updates))
+        
+        if updates_scanner.errors:
+            print(f"Error parsing function call arguments: skipped {updates_scanner.errors} malformed updates")
+        profile_updates = {"updates": parsed_updates}
         
         # If we have no content but have profile updates, generate a default response
-        if not buffer.strip() and profile_updates.get("updates"):
+        if not "".join(content_parts).strip() and profile_updates.get("updates"):
             default_response = "Thanks for sharing that information! I've updated your profile with what you told me."
-            buffer = default_response
-            raw_output += default_response
+            raw_parts.append(default_response)
             yield (default_response, "", "")
         
         # Send final profile updates
-        yield ("", json.dumps(profile_updates), raw_output)
+        yield ("", _serde.dumps(profile_updates), "".join(raw_parts))
             
     except Exception as e:
         error_msg = f"I'm sorry, there was an error processing your request: {e}"
@@ -311,7 +530,7 @@ async def stream_llm_response(messages: List[Dict[str, str]]):
         yield (error_msg, '{"updates": []}', error_msg)
 
 # Background profile update processing
-async def handle_profile_updates_background(user_id: str, profile_updates: Dict[str, Any], profile_card: ProfileCard):
+async def handle_profile_updates_background(user_id: str, profile_updates: Dict[str, Any]):
     """Handle profile updates in the background with robust validation and idempotent persistence."""
     
     try:
@@ -349,8 +568,7 @@ async def handle_profile_updates_background(user_id: str, profile_updates: Dict[
                 continue
             
             # Validate section is valid
-            valid_sections = ["demographics", "interests", "preferences", "constraints", "goals", "context", "communication"]
-            if update["section"] not in valid_sections:
+            if update["section"] not in _VALID_SECTIONS:
                 print(f"Skipping update with invalid section '{update['section']}': {update}")
                 continue
                 
@@ -360,20 +578,8 @@ async def handle_profile_updates_background(user_id: str, profile_updates: Dict[
             print(f"No valid updates found for user {user_id}")
             return
         
-        # Validate updates are actually new information
-        validated_updates = validate_updates(valid_updates, profile_card)
-        
-        if validated_updates:
-            # Update profile with confidence tracking
-            updated_profile = update_profile_with_confidence(profile_card, validated_updates)
-            save_profile_card(user_id, updated_profile)
-            
-            # Log the update
-            log_profile_update(user_id, validated_updates)
-            
-            print(f"Profile updated for user {user_id}: {len(validated_updates)} new facts")
-        else:
-            print(f"No new information to update for user {user_id}")
+        # Coalesce with other pending updates for this user into one validated write
+        await _profile_update_batcher.submit(user_id, valid_updates)
             
     except Exception as e:
         # Log error but don't fail the user experience
@@ -381,6 +587,97 @@ async def handle_profile_updates_background(user_id: str, profile_updates: Dict[
         log_request("error", f"Background profile update failed: {e}", 
                    user_id=user_id, endpoint="/api/chat")
 
+def _apply_profile_updates(user_id: str, updates: List[Dict[str, Any]]) -> None:
+    """Validate updates against the stored profile and persist the new facts in one write."""
+    # The save replaces the whole card, so start from Firestore rather than a cached copy
+    profile_card = get_profile_card(user_id, use_cache=False)
+    
+    # Validate updates are actually new information
+    validated_updates = validate_updates(updates, profile_card)
+    
+    if validated_updates:
+        # Update profile with confidence tracking
+        updated_profile = update_profile_with_confidence(profile_card, validated_updates)
+        save_profile_card(user_id, updated_profile)
+        
+        # Log the update
+        log_profile_update(user_id, validated_updates)
+        
+        print(f"Profile updated for user {user_id}: {len(validated_updates)} new facts")
+    else:
+        print(f"No new information to update for user {user_id}")
+
+class ProfileUpdateBatcher:
+    """Coalesces profile updates that arrive within a short window.
+    
+    Submissions are queued; a single consumer drains up to max_batch of them,
+    waiting at most max_delay_ms after the first, groups them by user and
+    applies each user's updates with one validation pass and one profile write.
+    """
+    
+    def __init__(self, max_batch: int = 32, max_delay_ms: float = 50):
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000.0
+        self._queue: Optional[asyncio.Queue] = None
+        self._consumer: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+    
+    def _ensure_consumer(self) -> asyncio.Queue:
+        """Start the consumer on the running loop (again, if the loop changed)."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._consumer is None or self._consumer.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._consumer = loop.create_task(self._run(self._queue))
+        return self._queue
+    
+    async def submit(self, user_id: str, updates: List[Dict[str, Any]]) -> None:
+        """Queue updates for user_id and wait until the batch containing them is written."""
+        queue = self._ensure_consumer()
+        future = asyncio.get_running_loop().create_future()
+        queue.put_nowait((user_id, updates, future))
+        await future
+    
+    async def _run(self, queue: asyncio.Queue) -> None:
+        """Drain the queue in batches forever."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._flush(batch)
+    
+    async def _flush(self, batch: List[Tuple[str, List[Dict[str, Any]], asyncio.Future]]) -> None:
+        """Apply each user's coalesced updates concurrently and resolve their futures."""
+        by_user: Dict[str, List[Any]] = {}  # user_id -> [updates, futures]
+        for user_id, updates, future in batch:
+            group = by_user.setdefault(user_id, [[], []])
+            group[0].extend(updates)
+            group[1].append(future)
+        
+        results = await asyncio.gather(*(
+            asyncio.to_thread(_apply_profile_updates, user_id, updates)
+            for user_id, (updates, _) in by_user.items()
+        ), return_exceptions=True)
+        
+        for (_, futures), result in zip(by_user.values(), results):
+            for future in futures:
+                if future.done():
+                    continue
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(None)
+
+_profile_update_batcher = ProfileUpdateBatcher()
+
 def log_profile_update(user_id: str, updates: List[Dict[str, Any]]):
     """Log profile updates for monitoring."""
     
@@ -393,6 +690,43 @@ def log_profile_update(user_id: str, updates: List[Dict[str, Any]]):
                    confidence=update["confidence"],
                    reason=update["reason"])
 
+# Fire-and-forget tasks; strong references keep them from being garbage collected mid-flight
+_BG_TASKS: set = set()
+
+def _spawn_background(coro) -> asyncio.Task:
+    """Run coro as a background task that does not hold up the streaming response."""
+    task = asyncio.create_task(coro)
+    _BG_TASKS.add(task)
+    task.add_done_callback(_BG_TASKS.discard)
+    return task
+
+def _store_round(user_id: str, user_message: str, ai_response: str, session_id: str) -> str:
+    """Reserve the next round number and store the round as an episode (blocking)."""
+    # The Firestore counter is shared by all workers; a new counter starts after the highest stored round
+    round_number = allocate_round_number(user_id, lambda: get_next_round_number(user_id))
+    return store_conversation_round(
+        user_id=user_id,
+        user_message=user_message,
+        ai_response=ai_response,
+        round_number=round_number,
+        session_id=session_id
+    )
+
+async def _store_episode(user_id: str, user_message: str, ai_response: str) -> None:
+    """Store a conversation round as an episode off the event loop."""
+    try:
+        session_id = f"s_{int(time.time())}"  # Simple session ID based on timestamp
+        
+        # Round allocation, embedding and the Chroma write all block, so run them in a thread
+        episode_id = await asyncio.to_thread(_store_round, user_id, user_message, ai_response, session_id)
+        print(f"Stored episode {episode_id} for user {user_id}")
+        # Cached episode context no longer reflects this user's history
+        _episode_context_cache.invalidate(user_id)
+        
+    except Exception as e:
+        print(f"Error storing episode: {e}")
+        # Don't fail the user experience for episode storage errors
+
 # Main chat functionality
 async def chat_with_streaming_profile_update(user_id: str, user_message: str) -> StreamingResponse:
     """Chat endpoint that streams response and updates profile in background."""
@@ -405,101 +739,88 @@ async def chat_with_streaming_profile_update(user_id: str, user_message: str) ->
                endpoint="/api/chat", 
                request_id=request_id)
     
-    # 1. Get current profile card
-    profile_card = get_profile_card(user_id)
+    # 1. Start history and episode lookups so they overlap the profile card read
+    lookups = start_context_lookups(user_id, user_message)
+    
+    # 2. Get current profile card (blocking Firestore read, so off the event loop)
+    profile_card = await asyncio.to_thread(get_profile_card, user_id)
     
-    # 2. Format messages for LLM using developer and user roles
-    messages = format_llm_messages(user_id, user_message, profile_card)
+    # 3. Format messages for LLM using developer and user roles; waits on the lookups in a thread
+    prompt_stats: Dict[str, int] = {}
+    messages = await asyncio.to_thread(
+        format_llm_messages, user_id, user_message, profile_card, lookups=lookups, stats=prompt_stats
+    )
     
-    # 3. Create streaming response
+    # 4. Create streaming response
     async def stream_response():
-        full_response = ""
+        response_parts: List[str] = []
         profile_updates = None
-        raw_llm_output = ""
+        raw_parts: List[str] = []
+        stream_buffer = StreamBuffer()
+        turn_logged = False
         
         try:
             # Stream the LLM response
             async for chunk, profile_updates_json, raw_chunk in stream_llm_response(messages):
                 # Add chunk to full response
-                full_response += chunk
-                raw_llm_output += raw_chunk
+                response_parts.append(chunk)
+                raw_parts.append(raw_chunk)
                 
                 # Check if this is the final chunk with profile updates
                 if profile_updates_json and not chunk:
                     # This is the final chunk with profile updates
                     try:
-                        profile_updates = json.loads(profile_updates_json)
-                    except json.JSONDecodeError as e:
+                        profile_updates = _serde.loads(profile_updates_json)
+                    except _serde.JSONDecodeError as e:
                         print(f"Error parsing profile updates JSON: {e}")
                         profile_updates = {"updates": []}
                     break
                 elif chunk:
-                    # Send only the content chunk to UI (no raw output metadata)
-                    chunk_data = {
-                        "content": chunk
-                    }
-                    yield f"data:{json.dumps(chunk_data)}\n\n"
+                    # Send only coalesced content to UI (no raw output metadata)
+                    ready = stream_buffer.add(chunk)
+                    if ready:
+                        yield _serde.sse_frame({'content': ready})
+            
+            # Flush content still buffered when the stream ended
+            remaining = stream_buffer.flush()
+            if remaining:
+                yield _serde.sse_frame({'content': remaining})
+            
+            full_response = "".join(response_parts)
             
             # Send completion marker with final raw output
             completion_data = {
                 "done": True,
-                "raw_output": raw_llm_output
+                "raw_output": "".join(raw_parts)
             }
-            yield f"data:{json.dumps(completion_data)}\n\n"
+            yield _serde.sse_frame(completion_data)
             
-            # Log the AI response to Firestore
+            # Log the user message and AI response to Firestore in one batch commit
+            turn = [{"role": "user", "content": user_message, "ts": start_time}]
             if full_response.strip():
-                log_message(user_id, "assistant", full_response.strip())
+                turn.append({"role": "assistant", "content": full_response.strip()})
+            log_messages_batch(user_id, turn)
+            turn_logged = True
             
-            # Store conversation round as episode
-            try:
-                # Get the next round number by checking existing episodes
-                from episodic_memory import get_user_recent_episodes
-                existing_episodes = get_user_recent_episodes(user_id, limit=100)  # Get more to find max round
-                
-                if existing_episodes:
-                    # Find the highest round number and add 1
-                    max_round = max([ep.get("round_number", 0) for ep in existing_episodes])
-                    round_number = max_round + 1
-                else:
-                    # First conversation
-                    round_number = 1
-                
-                session_id = f"s_{int(time.time())}"  # Simple session ID based on timestamp
-                
-                print(f"DEBUG: Round calculation - Found {len(existing_episodes)} existing episodes, max round: {max_round if existing_episodes else 0}, setting round_number to {round_number}")
-                
-                # Store as episode
-                episode_id = store_conversation_round(
-                    user_id=user_id,
-                    user_message=user_message,
-                    ai_response=full_response.strip(),
-                    round_number=round_number,
-                    session_id=session_id
-                )
-                print(f"Stored episode {episode_id} for user {user_id}")
-                
-            except Exception as e:
-                print(f"Error storing episode: {e}")
-                # Don't fail the user experience for episode storage errors
+            # Store the episode and apply profile updates after the response closes
+            _spawn_background(_store_episode(user_id, user_message, full_response.strip()))
             
             # Handle profile updates in background (after streaming completes)
             if profile_updates and profile_updates["updates"]:
-                print(f"DEBUG: Processing {len(profile_updates['updates'])} profile updates for user {user_id}")
-                await handle_profile_updates_background(user_id, profile_updates, profile_card)
+                logger.debug("Processing %d profile updates for user %s", len(profile_updates['updates']), user_id)
+                _spawn_background(handle_profile_updates_background(user_id, profile_updates))
             else:
-                print(f"DEBUG: No profile updates found for user {user_id}")
+                logger.debug("No profile updates found for user %s", user_id)
             
             # Record metrics
             latency_ms = (time.time() - start_time) * 1000
-            # Calculate input tokens from messages content
-            input_content = " ".join([msg["content"] for msg in messages])
+            # Input size was accumulated while the prompt was built
             metrics.record_openai_metrics(
                 user_id=user_id,
                 endpoint="/api/chat",
                 model=OPENAI_MODEL if _use_openai else "none",
-                input_tokens=len(input_content.split()) * 1.3,  # Rough estimation
-                output_tokens=len(full_response.split()) * 1.3,  # Rough estimation
+                input_tokens=prompt_stats.get("input_tokens", 0),  # Rough estimation
+                output_tokens=estimate_tokens(len(full_response)),  # Rough estimation
                 latency_ms=latency_ms,
                 cost_usd=0.0,  # TODO: Calculate actual cost
                 success=True
@@ -518,9 +839,16 @@ async def chat_with_streaming_profile_update(user_id: str, user_message: str) ->
                        user_id=user_id,
                        endpoint="/api/chat",
                        request_id=request_id)
-            yield "data:[DONE]\n\n"
+            remaining = stream_buffer.flush()
+            if remaining:
+                yield _serde.sse_frame({'content': remaining})
+            yield _serde.SSE_DONE
+        finally:
+            # Failed or disconnected streams still keep the user's message
+            if not turn_logged:
+                log_message(user_id, "user", user_message, ts=start_time)
     
-    return StreamingResponse(stream_response(), media_type="text/event-stream")
+    return StreamingResponse(stream_response(), media_type="text/event-stream", headers=_serde.SSE_HEADERS)
 
 # Fallback functions
 async def simple_streaming_chat(user_id: str, user_message: str) -> StreamingResponse:
@@ -528,13 +856,13 @@ async def simple_streaming_chat(user_id: str, user_message: str) -> StreamingRes
     
     async def fallback_stream():
         fallback_response = 'I received your message: ' + user_message
-        yield f"data:{json.dumps(fallback_response)}\n\n"
-        yield "data:[DONE]\n\n"
+        yield _serde.sse_frame(fallback_response)
+        yield _serde.SSE_DONE
         
         # Log the fallback response
         log_message(user_id, "assistant", fallback_response)
     
-    return StreamingResponse(fallback_stream(), media_type="text/event-stream")
+    return StreamingResponse(fallback_stream(), media_type="text/event-stream", headers=_serde.SSE_HEADERS)
 
 # Version information
 VERSION_TAG = "llm_integration v1.0 STREAMING"
@@ -9,11 +9,29 @@ This module provides:
 - Exception handling
 """
 
-import json
+import atexit
 import logging
+import queue
 import sys
-from datetime import datetime
-from typing import Any, Dict
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional
+
+from _serde import dumps as _dumps
+
+# Optional structured fields copied from the record when present: (record attribute, JSON key)
+_EXTRA_FIELDS = (
+    ("user_id", "user_id"),
+    ("endpoint", "endpoint"),
+    ("request_id", "request_id"),
+    ("openai_model", "openai_model"),
+    ("input_tokens", "input_tokens"),
+    ("output_tokens", "output_tokens"),
+    ("latency_ms", "latency_ms"),
+    ("cost_usd", "cost_usd"),
+    ("rate_limit_key", "rate_limit_key"),
+    ("rate_limit_hit", "rate_limit_hit"),
+)
 
 class StructuredFormatter(logging.Formatter):
     """JSON structured log formatter for production logging.
@@ -35,7 +53,7 @@ class StructuredFormatter(logging.Formatter):
             str: JSON formatted log entry
         """
         log_entry = {
-            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
             "level": record.levelname,
             "message": record.getMessage(),
             "logger": record.name,
@@ -45,41 +63,40 @@ class StructuredFormatter(logging.Formatter):
         }
         
         # Add extra fields if present
-        if hasattr(record, 'user_id'):
-            log_entry['user_id'] = record.user_id
-        if hasattr(record, 'endpoint'):
-            log_entry['endpoint'] = record.endpoint
-        if hasattr(record, 'request_id'):
-            log_entry['request_id'] = record.request_id
-        if hasattr(record, 'openai_model'):
-            log_entry['openai_model'] = record.openai_model
-        if hasattr(record, 'input_tokens'):
-            log_entry['input_tokens'] = record.input_tokens
-        if hasattr(record, 'output_tokens'):
-            log_entry['output_tokens'] = record.output_tokens
-        if hasattr(record, 'latency_ms'):
-            log_entry['latency_ms'] = record.latency_ms
-        if hasattr(record, 'cost_usd'):
-            log_entry['cost_usd'] = record.cost_usd
-        if hasattr(record, 'rate_limit_key'):
-            log_entry['rate_limit_key'] = record.rate_limit_key
-        if hasattr(record, 'rate_limit_hit'):
-            log_entry['rate_limit_hit'] = record.rate_limit_hit
+        extras = record.__dict__
+        for attr, key in _EXTRA_FIELDS:
+            value = extras.get(attr)
+            if value is not None:
+                log_entry[key] = value
         
         # Add exception info if present
         if record.exc_info:
             log_entry['exception'] = self.formatException(record.exc_info)
         
-        return json.dumps(log_entry)
+        return _dumps(log_entry)
+
+# Writes console output off the request path; started by setup_logging
+_queue_listener: Optional[QueueListener] = None
+
+def _stop_queue_listener() -> None:
+    """Drain queued records and stop the listener thread."""
+    global _queue_listener
+    if _queue_listener is not None:
+        _queue_listener.stop()
+        _queue_listener = None
+
+atexit.register(_stop_queue_listener)
 
 def setup_logging() -> None:
     """Setup structured logging for the application.
     
     Configures:
     - JSON formatter for structured logs
-    - Console output handler
+    - Queued console output written by a listener thread
     - Suppressed noisy loggers
     """
+    global _queue_listener
+    
     # Create logger
     logger = logging.getLogger()
     logger.setLevel(logging.INFO)
@@ -87,19 +104,36 @@ def setup_logging() -> None:
     # Remove existing handlers
     for handler in logger.handlers[:]:
         logger.removeHandler(handler)
+    _stop_queue_listener()
     
-    # Create console handler
+    # Create console handler; records reach it already formatted as JSON
     console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setLevel(logging.INFO)
-    console_handler.setFormatter(StructuredFormatter())
+    console_handler.setFormatter(logging.Formatter("%(message)s"))
+    
+    # The root handler only formats and enqueues, so a stalled stdout never blocks the event loop.
+    # Formatting stays on the caller so exception and extra fields are captured before the record is queued.
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.setLevel(logging.INFO)
+    queue_handler.setFormatter(StructuredFormatter())
+    logger.addHandler(queue_handler)
     
-    # Add handler to logger
-    logger.addHandler(console_handler)
+    _queue_listener = QueueListener(log_queue, console_handler)
+    _queue_listener.start()
     
     # Suppress noisy loggers
     logging.getLogger("google.cloud").setLevel(logging.WARNING)
     logging.getLogger("urllib3").setLevel(logging.WARNING)
 
+_request_logger = logging.getLogger("memo_bot.request")
+_LEVELS = {
+    "debug": logging.DEBUG,
+    "info": logging.INFO,
+    "warning": logging.WARNING,
+    "error": logging.ERROR,
+    "critical": logging.CRITICAL,
+}
+
 def log_request(level: str, message: str, **kwargs: Any) -> None:
     """Log request with structured data.
     
@@ -108,10 +142,13 @@ def log_request(level: str, message: str, **kwargs: Any) -> None:
         message: Log message
         **kwargs: Additional structured fields
     """
-    logger = logging.getLogger("memo_bot.request")
-    record = logger.makeRecord(
+    numeric_level = _LEVELS.get(level) or getattr(logging, level.upper())
+    if not _request_logger.isEnabledFor(numeric_level):
+        return
+    
+    record = _request_logger.makeRecord(
         "memo_bot.request", 
-        getattr(logging, level.upper()), 
+        numeric_level, 
         "", 0, message, (), None
     )
     
@@ -119,4 +156,4 @@ def log_request(level: str, message: str, **kwargs: Any) -> None:
     for key, value in kwargs.items():
         setattr(record, key, value)
     
-    logger.handle(record)
+    _request_logger.handle(record)
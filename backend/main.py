@@ -11,32 +11,34 @@ This is the main entry point for the Memo Bot backend, providing:
 """
 
 import os
-import json
+import sys
+import time
+import asyncio
+import hashlib
+import importlib
 from typing import Dict, Any, Optional
 
 import firebase_admin
-from firebase_admin import auth as fb_auth, credentials
-from fastapi import FastAPI, HTTPException, Depends, Request
+import jwt
+from cachetools import TTLCache
+from firebase_admin import credentials
+from fastapi import FastAPI, HTTPException, Depends, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
-from dotenv import load_dotenv
+from fastapi.responses import StreamingResponse, ORJSONResponse
+from pydantic import BaseModel, ConfigDict, field_validator
 from slowapi.errors import RateLimitExceeded
 
+# Load environment variables before local modules read their configuration
+from _env import load_once
+load_once(override=True)
+
 # Local imports
 from rate_limiter import limiter, rate_limit_exceeded_handler, apply_rate_limit
-from monitoring import metrics
 from logging_config import setup_logging, log_request
-from profile_card import (
-    get_profile_card, 
-    save_profile_card, 
-    create_default_profile_card, 
-    ProfileCard
-)
-from llm_integration import chat_with_streaming_profile_update
-from firestore_store import add_memory, get_top_facts, log_message, get_last_messages
-
-# Load environment variables
-load_dotenv(override=True)
+from profile_card import get_profile_card, save_profile_card
+from firebase_tokens import verify_id_token, FIREBASE_PROJECT_ID
+from _serde import sse_frame, SSE_DONE, SSE_HEADERS
+from firestore_store import add_memory, get_top_facts, log_message, get_last_messages, warm_user, health_check
 
 # Setup structured logging
 setup_logging()
@@ -45,10 +47,18 @@ setup_logging()
 if not firebase_admin._apps:
     cred = credentials.ApplicationDefault()
     firebase_admin.initialize_app(cred, {
-        'projectId': 'gen-lang-client-0574433212'
+        'projectId': FIREBASE_PROJECT_ID
     })
 
-def get_verified_uid(request: Request) -> str:
+# Verified ID tokens keyed by SHA-256 of the token: (uid, exp). Entries live at most
+# TOKEN_CACHE_TTL seconds and are never served past the token's own expiry.
+TOKEN_CACHE_TTL = 60
+_token_cache: TTLCache = TTLCache(maxsize=10_000, ttl=TOKEN_CACHE_TTL)
+# Recently rejected tokens, so retries of a bad token skip signature verification.
+# Only definite rejections are cached; key-fetch failures answer 503 and are retried.
+_rejected_token_cache: TTLCache = TTLCache(maxsize=10_000, ttl=5)
+
+async def get_verified_uid(request: Request) -> str:
     """
     Verify Firebase ID token and extract user UID.
     
@@ -59,22 +69,47 @@ def get_verified_uid(request: Request) -> str:
         str: Verified user UID
         
     Raises:
-        HTTPException: If token is missing or invalid
+        HTTPException: 401 if token is missing or invalid, 503 if signing keys cannot be fetched
     """
     authz = request.headers.get("authorization") or request.headers.get("Authorization")
     if not authz or not authz.lower().startswith("bearer "):
         raise HTTPException(status_code=401, detail="Missing bearer token")
     
     token = authz.split(" ", 1)[1].strip()
+    token_key = hashlib.sha256(token.encode()).digest()
+    
+    now = time.time()
+    cached = _token_cache.get(token_key)
+    if cached is not None and cached[1] > now:
+        request.state.uid = cached[0]
+        return cached[0]
+    rejected = _rejected_token_cache.get(token_key)
+    if rejected is not None:
+        raise HTTPException(status_code=401, detail=rejected)
+    
     try:
-        decoded = fb_auth.verify_id_token(token)
+        # Local RS256 check against cached Google keys. Runs in the threadpool because a key
+        # refresh (first call, hourly, unknown kid) or the emulator path does blocking I/O.
+        decoded = await asyncio.to_thread(verify_id_token, token)
         uid = decoded.get("uid")
         if not uid:
             raise ValueError("No uid in token")
         
+        # Reuse the verification until the token expires, capped by the cache TTL
+        exp = float(decoded.get("exp") or now + TOKEN_CACHE_TTL)
+        if exp > now:
+            _token_cache[token_key] = (uid, exp)
+        
         # Store UID in request state for rate limiting
         request.state.uid = uid
         return uid
+    except (jwt.PyJWKClientConnectionError, OSError) as e:
+        # Google's key endpoint is unreachable; the token may be fine, so let the client retry
+        raise HTTPException(status_code=503, detail=f"Token verification unavailable: {e}")
+    except (jwt.InvalidTokenError, ValueError) as e:
+        detail = f"Invalid ID token: {e}"
+        _rejected_token_cache[token_key] = detail
+        raise HTTPException(status_code=401, detail=detail)
     except Exception as e:
         raise HTTPException(status_code=401, detail=f"Invalid ID token: {e}")
 
@@ -82,6 +117,7 @@ def get_verified_uid(request: Request) -> str:
 # Configuration
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-5-nano")
+CHROMA_MODE = os.getenv("CHROMA_MODE", "local")
 
 # Log API key info (safely - only show first/last few chars)
 if OPENAI_API_KEY:
@@ -95,78 +131,123 @@ else:
 app = FastAPI(
     title="Memo Bot Backend",
     description="AI companion service for children",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
-# CORS middleware
+# Browser origins allowed to call the API; WEB_ORIGIN adds the deployment's own UI
+CORS_ORIGINS = list(dict.fromkeys([
+    os.getenv("WEB_ORIGIN", "http://127.0.0.1:3000"),
+    "http://localhost:3000",
+    "http://localhost:5173",
+    "https://talkydino-ui.vercel.app",
+    "https://memo-bot-ui.vercel.app",
+]))
+
+# CORS middleware; explicit methods and headers let browsers cache preflights for max_age seconds
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=[
-        os.getenv("WEB_ORIGIN", "http://127.0.0.1:3000"),
-        "http://localhost:3000",
-        "http://localhost:5173",
-        "https://talkydino-ui.vercel.app",
-        "https://memo-bot-ui.vercel.app"
-    ],
+    allow_origins=CORS_ORIGINS,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST", "OPTIONS"],
+    allow_headers=["Authorization", "Content-Type"],
+    max_age=86400,
 )
 
 # Rate limiting middleware
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, rate_limit_exceeded_handler)
 
+# Request bodies (validated by pydantic-core; unknown fields are ignored)
+class ProfileCardUpdate(BaseModel):
+    """Body of POST /api/profile-card."""
+    model_config = ConfigDict(extra="ignore")
+    
+    sections: Dict[str, Dict[str, Any]] = {}
+
+class MemoryItem(BaseModel):
+    """Body of POST /api/memory; unset fields take add_memory's defaults."""
+    model_config = ConfigDict(extra="ignore")
+    
+    type: str = "semantic"
+    key: Any = ""
+    value: Any = ""
+    confidence: float = 0.9
+    salience: float = 1.0
+    ts: Optional[float] = None
+
+class ChatRequest(BaseModel):
+    """Body of POST /api/chat."""
+    model_config = ConfigDict(extra="ignore")
+    
+    message: str = ""
+    
+    @field_validator("message", mode="before")
+    @classmethod
+    def _non_string_as_missing(cls, value: Any) -> Any:
+        # Non-string messages get the same 400 as missing ones rather than a 422
+        return value if isinstance(value, str) else ""
+
 # Health and authentication endpoints
 @app.get("/health")
-def health() -> Dict[str, bool]:
-    """Health check endpoint."""
+async def health() -> Dict[str, bool]:
+    """Health check endpoint (liveness; no backend calls)."""
     return {"ok": True}
 
+@app.get("/readyz")
+async def readyz() -> Dict[str, Any]:
+    """Readiness check; probes Firestore at most once per minute."""
+    status = await asyncio.to_thread(health_check, deep=True)
+    if not status["healthy"]:
+        raise HTTPException(503, status)
+    return {"ok": True, **status}
+
 @app.get("/test-rate-limit")
 @apply_rate_limit("/test-rate-limit")
-def test_rate_limit(request: Request, uid: str = Depends(get_verified_uid)) -> Dict[str, str]:
+async def test_rate_limit(request: Request, uid: str = Depends(get_verified_uid)) -> Dict[str, str]:
     """Test endpoint for rate limiting functionality."""
     return {"message": "Rate limit test successful", "uid": uid}
 
 @app.get("/whoami")
 @apply_rate_limit("/whoami")
-def whoami(request: Request, uid: str = Depends(get_verified_uid)) -> Dict[str, str]:
+async def whoami(request: Request, uid: str = Depends(get_verified_uid)) -> Dict[str, str]:
     """Get current user information."""
+    # Called once at sign-in: prefetch what the first chat turn will read
+    warm_user(uid)
     return {"uid": uid}
 
 # Profile Card API endpoints
 @app.get("/api/profile-card")
 @apply_rate_limit("/api/profile-card")
-def api_get_profile_card(
+async def api_get_profile_card(
     request: Request, 
     uid: str = Depends(get_verified_uid)
 ) -> Dict[str, Any]:
     """Get user's profile card."""
     try:
-        profile = get_profile_card(uid)
+        profile = await asyncio.to_thread(get_profile_card, uid)
         return {"ok": True, "profile": profile}
     except Exception as e:
         raise HTTPException(500, f"Failed to get profile card: {e}")
 
 @app.post("/api/profile-card")
 @apply_rate_limit("/api/profile-card")
-def api_update_profile_card(
+async def api_update_profile_card(
     request: Request, 
-    payload: Dict[str, Any], 
+    payload: ProfileCardUpdate, 
     uid: str = Depends(get_verified_uid)
 ) -> Dict[str, Any]:
     """Manually update profile card."""
     try:
-        profile = get_profile_card(uid)
+        # Read-modify-write of the whole card, so start from Firestore rather than the cache
+        profile = await asyncio.to_thread(get_profile_card, uid, use_cache=False)
         
         # Update sections with provided data
-        if "sections" in payload:
-            for section_name, section_data in payload["sections"].items():
-                if section_name in profile.sections:
-                    profile.sections[section_name].update(section_data)
+        for section_name, section_data in payload.sections.items():
+            if section_name in profile.sections:
+                profile.sections[section_name].update(section_data)
         
-        success = save_profile_card(uid, profile)
+        success = await asyncio.to_thread(save_profile_card, uid, profile)
         
         if success:
             return {"ok": True, "profile": profile}
@@ -178,7 +259,7 @@ def api_update_profile_card(
 
 @app.get("/api/profile-card/history")
 @apply_rate_limit("/api/profile-card/history")
-def api_get_profile_history(
+async def api_get_profile_history(
     request: Request, 
     limit: Optional[int] = 10, 
     uid: str = Depends(get_verified_uid)
@@ -186,48 +267,37 @@ def api_get_profile_history(
     """Get profile card version history."""
     try:
         from profile_card import get_profile_history
-        history = get_profile_history(uid, limit or 10)
+        history = await asyncio.to_thread(get_profile_history, uid, limit or 10)
         return {"ok": True, "history": history}
     except Exception as e:
         raise HTTPException(500, f"Failed to get profile history: {e}")
 
 @app.get("/api/profile-card/stats")
 @apply_rate_limit("/api/profile-card/stats")
-def api_get_profile_stats(
+async def api_get_profile_stats(
     request: Request, 
     uid: str = Depends(get_verified_uid)
 ) -> Dict[str, Any]:
     """Get profile card statistics."""
     try:
-        profile = get_profile_card(uid)
-        from profile_card import count_total_facts, calculate_tokens
+        profile = await asyncio.to_thread(get_profile_card, uid)
+        from profile_card import profile_stats
         
-        stats = {
-            "total_facts": count_total_facts(profile),
-            "tokens": calculate_tokens(profile),
-            "version": profile.version,
-            "last_updated": profile.metadata.get("updated_at"),
-            "sections": {
-                section_name: len(section_data) if isinstance(section_data, dict) else 0
-                for section_name, section_data in profile.sections.items()
-            }
-        }
-        
-        return {"ok": True, "stats": stats}
+        return {"ok": True, "stats": profile_stats(profile)}
     except Exception as e:
         raise HTTPException(500, f"Failed to get profile stats: {e}")
 
 # Memory API endpoints
 @app.post("/api/memory")
 @apply_rate_limit("/api/memory")
-def api_add_memory(
+async def api_add_memory(
     request: Request, 
-    payload: Dict[str, Any], 
+    payload: MemoryItem, 
     uid: str = Depends(get_verified_uid)
 ) -> Dict[str, Any]:
     """Add a memory/fact for the user."""
     try:
-        saved = add_memory(uid, payload)
+        saved = await asyncio.to_thread(add_memory, uid, payload.model_dump(exclude_unset=True))
         return {"ok": True, "memory": saved}
     except Exception as e:
         raise HTTPException(500, f"add_memory failed: {e}")
@@ -235,7 +305,7 @@ def api_add_memory(
 
 @app.get("/api/memory")
 @apply_rate_limit("/api/memory")
-def api_list_memory(
+async def api_list_memory(
     request: Request, 
     limit: Optional[int] = 12, 
     offset: Optional[int] = 0, 
@@ -243,7 +313,7 @@ def api_list_memory(
 ) -> Dict[str, Any]:
     """Get user's memories/facts."""
     try:
-        items = get_top_facts(uid, limit or 12, offset or 0)
+        items = await asyncio.to_thread(get_top_facts, uid, limit or 12, offset or 0)
         return {"ok": True, "items": items}
     except Exception as e:
         raise HTTPException(500, f"list_memory failed: {e}")
@@ -252,7 +322,7 @@ def api_list_memory(
 # Messages API endpoints
 @app.get("/api/messages")
 @apply_rate_limit("/api/messages")
-def api_list_messages(
+async def api_list_messages(
     request: Request, 
     limit: Optional[int] = 12, 
     offset: Optional[int] = 0, 
@@ -260,7 +330,7 @@ def api_list_messages(
 ) -> Dict[str, Any]:
     """Get user's conversation history."""
     try:
-        items = get_last_messages(uid, limit or 12, offset or 0)
+        items = await asyncio.to_thread(get_last_messages, uid, limit or 12, offset or 0)
         return {"ok": True, "items": items}
     except Exception as e:
         raise HTTPException(500, f"list_messages failed: {e}")
@@ -268,50 +338,42 @@ def api_list_messages(
 # Debug endpoints
 @app.get("/api/chroma/inspect")
 @apply_rate_limit("/api/chroma/inspect")
-def api_inspect_chroma(
+async def api_inspect_chroma(
     request: Request, 
+    limit: int = Query(50, ge=1, le=200), 
+    offset: int = Query(0, ge=0), 
     uid: str = Depends(get_verified_uid)
 ) -> Dict[str, Any]:
     """Inspect ChromaDB contents for debugging purposes."""
+    # Chroma client calls block, so the whole inspection runs in a worker thread
+    return await asyncio.to_thread(_inspect_chroma, uid, limit, offset)
+
+def _inspect_chroma(uid: str, limit: int = 50, offset: int = 0) -> Dict[str, Any]:
+    """Collect a page of a user's episodes and collection stats from ChromaDB."""
     try:
-        from episodic_memory import get_chroma_client, get_episodic_collection
+        from episodic_memory import get_user_episode_metadata
         
-        # Get Chroma client and ensure collection exists
-        client = get_chroma_client()
-        
-        try:
-            collection = client.get_collection("episodic_memory")
-        except Exception:
-            collection = client.create_collection(
-                name="episodic_memory",
-                metadata={"description": "Conversation rounds stored as episodes with embeddings"}
-            )
-        
-        # Get all episodes for the user
-        episodes = collection.get(where={"user_id": uid})
+        # A page of the user's episodes, most recent first, on the process-wide collection handle
+        episodes = get_user_episode_metadata(uid, limit, offset)
         
         # Format episodes for display
-        formatted_episodes = []
-        if episodes['metadatas']:
-            for i, metadata in enumerate(episodes['metadatas']):
-                episode = {
-                    "id": episodes['ids'][i],
-                    "user_message": metadata.get("user_message", ""),
-                    "ai_response": metadata.get("ai_response", ""),
-                    "round_number": metadata.get("round_number", 0),
-                    "session_id": metadata.get("session_id", ""),
-                    "timestamp": metadata.get("timestamp", ""),
-                    "tokens": metadata.get("tokens", 0)
-                }
-                formatted_episodes.append(episode)
-        
-        # Sort by timestamp (most recent first)
-        formatted_episodes.sort(key=lambda x: x.get("timestamp", ""), reverse=True)
+        formatted_episodes = [
+            {
+                "id": episode_id,
+                "user_message": metadata.get("user_message", ""),
+                "ai_response": metadata.get("ai_response", ""),
+                "round_number": metadata.get("round_number", 0),
+                "session_id": metadata.get("session_id", ""),
+                "timestamp": metadata.get("timestamp", ""),
+                "tokens": metadata.get("tokens", 0)
+            }
+            for episode_id, metadata in zip(episodes['ids'], episodes['metadatas'] or [])
+        ]
         
         stats = {
-            "total_episodes": len(formatted_episodes),
+            "total_episodes": episodes["total"],
             "collection_name": "episodic_memory",
-            "chroma_mode": os.getenv("CHROMA_MODE", "local"),
+            "chroma_mode": CHROMA_MODE,
             "collection_exists": True
         }
         
@@ -328,40 +390,47 @@ def api_inspect_chroma(
             "stats": {
                 "total_episodes": 0,
                 "collection_name": "episodic_memory",
-                "chroma_mode": os.getenv("CHROMA_MODE", "local"),
+                "chroma_mode": CHROMA_MODE,
                 "collection_exists": False,
                 "error": str(e)
             }
         }
     
 # Chat API endpoint
+async def _load_llm_integration():
+    """Import the chat pipeline on first use; it pulls in OpenAI, NumPy and ChromaDB."""
+    module = sys.modules.get("llm_integration")
+    if module is None:
+        # Module import can take seconds, so keep it off the event loop
+        module = await asyncio.to_thread(importlib.import_module, "llm_integration")
+    return module
+
 @app.post("/api/chat")
 @apply_rate_limit("/api/chat")
 async def chat(
     request: Request, 
-    payload: Dict[str, Any], 
+    payload: ChatRequest, 
     uid: str = Depends(get_verified_uid)
 ) -> StreamingResponse:
     """Chat endpoint with Profile Card integration and streaming responses."""
     
-    msg = (payload or {}).get("message", "")
-    if not isinstance(msg, str) or not msg.strip():
+    msg = payload.message
+    if not msg.strip():
         raise HTTPException(400, "message is required")
 
-    # Persist user message
-    log_message(uid, "user", msg)
-
-    # Use Profile Card system with streaming
+    # Use Profile Card system with streaming; it persists the turn once the response ends
     try:
-        return await chat_with_streaming_profile_update(uid, msg)
+        llm_integration = await _load_llm_integration()
+        return await llm_integration.chat_with_streaming_profile_update(uid, msg)
     except Exception as e:
+        log_message(uid, "user", msg)
         # Fallback to simple response if Profile Card system fails
         log_request("error", f"Profile Card chat failed, using fallback: {e}",
                    user_id=uid,
                    endpoint="/api/chat")
         
         async def fallback_stream():
-            yield f"data:{json.dumps('I received your message: ' + msg)}\n\n"
-            yield "data:[DONE]\n\n"
+            yield sse_frame('I received your message: ' + msg)
+            yield SSE_DONE
         
-        return StreamingResponse(fallback_stream(), media_type="text/event-stream")
\ No newline at end of file
+        return StreamingResponse(fallback_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
\ No newline at end of file
@@ -7,26 +7,34 @@ This module provides:
 - Rate limiting metrics
 - Performance tracking
 - Error monitoring
+- Batched background writes of metric points
 """
 
 import os
 import time
+import atexit
 import datetime
 import logging
-from typing import Dict, Any, Optional
+import threading
+from typing import Dict, Any, Optional, Tuple
 
 from google.cloud import monitoring_v3
 from google.cloud.monitoring_v3.types.metric import metric_pb2
 from google.cloud.monitoring_v3.types import TimeSeries, Point
 from google.protobuf.timestamp_pb2 import Timestamp
-from dotenv import load_dotenv
 
-load_dotenv()
+from _env import load_once
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+load_once()
+
+# Logging is configured by the application (logging_config.setup_logging)
 logger = logging.getLogger(__name__)
 
+# Points are queued and written by a background thread in batches; Cloud Monitoring
+# accepts up to 200 time series per create_time_series call
+METRICS_BATCH_SIZE = 200
+METRICS_FLUSH_INTERVAL = 5.0  # seconds; also the minimum sampling period per series
+
 class MemoBotMetrics:
     """Custom metrics for Memo Bot application.
     
@@ -41,6 +49,15 @@ class MemoBotMetrics:
         self.client = monitoring_v3.MetricServiceClient()
         self.project_id = os.getenv("GOOGLE_CLOUD_PROJECT", "gen-lang-client-0574433212")
         self.project_name = f"projects/{self.project_id}"
+        # Descriptors this process has already created
+        self._created: set = set()
+        # Pending points keyed by series (metric, labels); a later point replaces an earlier
+        # one because a request may not repeat a series or sample it more often than 5s
+        self._pending: Dict[Tuple[str, Tuple], Tuple[str, Dict[str, str], float, Timestamp]] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True).start()
+        atexit.register(self.flush)
         
     def create_custom_metric(self, metric_type: str, description: str) -> None:
         """Create a custom metric descriptor.
@@ -66,9 +83,67 @@ class MemoBotMetrics:
                 name=self.project_name,
                 metric_descriptor=descriptor
             )
-            logger.info(f"Created metric: {metric_type}")
+            logger.info("Created metric: %s", metric_type)
         except Exception as e:
-            logger.warning(f"Metric {metric_type} may already exist: {e}")
+            logger.warning("Metric %s may already exist: %s", metric_type, e)
+    
+    def _enqueue(self, metric_name: str, description: str, labels: Dict[str, str], value: float) -> None:
+        """Queue one point for the background flusher."""
+        timestamp = Timestamp()
+        timestamp.FromDatetime(datetime.datetime.utcnow())
+        key = (metric_name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._pending[key] = (description, labels, float(value), timestamp)
+            full = len(self._pending) >= METRICS_BATCH_SIZE
+        if full:
+            self._wakeup.set()
+    
+    def _flush_loop(self) -> None:
+        """Flush pending points every METRICS_FLUSH_INTERVAL or as soon as a batch fills."""
+        while True:
+            self._wakeup.wait(METRICS_FLUSH_INTERVAL)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                # Keep the thread alive; otherwise nothing drains _pending again
+                logger.error("Metrics flush failed: %s", e)
+    
+    def flush(self) -> None:
+        """Write all pending points, creating descriptors this process has not created yet."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        
+        series = []
+        for (metric_name, _), (description, labels, value, timestamp) in pending.items():
+            try:
+                if metric_name not in self._created:
+                    self.create_custom_metric(metric_name, description)
+                    self._created.add(metric_name)
+                series.append(TimeSeries(
+                    metric={
+                        "type": f"custom.googleapis.com/memo_bot/{metric_name}",
+                        "labels": labels,
+                    },
+                    resource={
+                        "type": "global",
+                        "labels": {
+                            "project_id": self.project_id,
+                        }
+                    },
+                    points=[Point({"value": {"double_value": value}, "interval": {"end_time": timestamp}})]
+                ))
+            except Exception as e:
+                logger.error("Dropping metric point %s: %s", metric_name, e)
+        
+        for start in range(0, len(series), METRICS_BATCH_SIZE):
+            batch = series[start:start + METRICS_BATCH_SIZE]
+            try:
+                self.client.create_time_series(name=self.project_name, time_series=batch)
+            except Exception as e:
+                logger.error("Failed to write %d metric points: %s", len(batch), e)
     
     def record_openai_metrics(self, 
                            user_id: str, 
@@ -79,7 +154,7 @@ class MemoBotMetrics:
                            latency_ms: float,
                            cost_usd: float,
                            success: bool) -> None:
-        """Record OpenAI API metrics.
+        """Record OpenAI API metrics; points are queued and written in the background.
         
         Args:
             user_id: User identifier
@@ -92,50 +167,25 @@ class MemoBotMetrics:
             success: Whether the API call was successful
         """
         try:
-            # Create time series for each metric
-            timestamp = Timestamp()
-            timestamp.FromDatetime(datetime.datetime.utcnow())
-            
-            metrics = [
-                ("openai_input_tokens", input_tokens, "Input tokens used"),
-                ("openai_output_tokens", output_tokens, "Output tokens generated"),
-                ("openai_latency_ms", latency_ms, "API response time in milliseconds"),
-                ("openai_cost_usd", cost_usd, "Estimated cost in USD"),
-                ("openai_success_rate", 1.0 if success else 0.0, "API call success indicator"),
-            ]
-            
-            for metric_name, value, description in metrics:
-                self.create_custom_metric(metric_name, description)
-                
-                series = TimeSeries(
-                    metric={
-                        "type": f"custom.googleapis.com/memo_bot/{metric_name}",
-                        "labels": {
-                            "user_id": user_id,
-                            "endpoint": endpoint,
-                            "model": model,
-                        }
-                    },
-                    resource={
-                        "type": "global",
-                        "labels": {
-                            "project_id": self.project_id,
-                        }
-                    },
-                    points=[Point({"value": {"double_value": value}, "interval": {"end_time": timestamp}})]
-                )
-                
-                self.client.create_time_series(name=self.project_name, time_series=[series])
-                
+            labels = {
+                "user_id": user_id,
+                "endpoint": endpoint,
+                "model": model,
+            }
+            self._enqueue("openai_input_tokens", "Input tokens used", labels, input_tokens)
+            self._enqueue("openai_output_tokens", "Output tokens generated", labels, output_tokens)
+            self._enqueue("openai_latency_ms", "API response time in milliseconds", labels, latency_ms)
+            self._enqueue("openai_cost_usd", "Estimated cost in USD", labels, cost_usd)
+            self._enqueue("openai_success_rate", "API call success indicator", labels, 1.0 if success else 0.0)
         except Exception as e:
-            logger.error(f"Failed to record OpenAI metrics: {e}")
+            logger.error("Failed to record OpenAI metrics: %s", e)
     
     def record_rate_limit_metrics(self,
                                 user_id: str,
                                 endpoint: str,
                                 rate_limit_hit: bool,
                                 remaining_quota: int) -> None:
-        """Record rate limiting metrics.
+        """Record rate limiting metrics; points are queued and written in the background.
         
         Args:
             user_id: User identifier
@@ -144,53 +194,14 @@ class MemoBotMetrics:
             remaining_quota: Remaining quota for the user
         """
         try:
-            timestamp = Timestamp()
-            timestamp.FromDatetime(datetime.datetime.utcnow())
-            
-            # Rate limit hit metric
-            self.create_custom_metric("rate_limit_hit", "Rate limit hit indicator")
-            series = TimeSeries(
-                metric={
-                    "type": "custom.googleapis.com/memo_bot/rate_limit_hit",
-                    "labels": {
-                        "user_id": user_id,
-                        "endpoint": endpoint,
-                    }
-                },
-                resource={
-                    "type": "global",
-                    "labels": {
-                        "project_id": self.project_id,
-                    }
-                },
-                points=[Point({"value": {"double_value": 1.0 if rate_limit_hit else 0.0}, "interval": {"end_time": timestamp}})]
-            )
-            
-            self.client.create_time_series(name=self.project_name, time_series=[series])
-            
-            # Remaining quota metric
-            self.create_custom_metric("rate_limit_remaining", "Remaining rate limit quota")
-            series = TimeSeries(
-                metric={
-                    "type": "custom.googleapis.com/memo_bot/rate_limit_remaining",
-                    "labels": {
-                        "user_id": user_id,
-                        "endpoint": endpoint,
-                    }
-                },
-                resource={
-                    "type": "global",
-                    "labels": {
-                        "project_id": self.project_id,
-                    }
-                },
-                points=[Point({"value": {"double_value": float(remaining_quota)}, "interval": {"end_time": timestamp}})]
-            )
-            
-            self.client.create_time_series(name=self.project_name, time_series=[series])
-            
+            labels = {
+                "user_id": user_id,
+                "endpoint": endpoint,
+            }
+            self._enqueue("rate_limit_hit", "Rate limit hit indicator", labels, 1.0 if rate_limit_hit else 0.0)
+            self._enqueue("rate_limit_remaining", "Remaining rate limit quota", labels, remaining_quota)
         except Exception as e:
-            logger.error(f"Failed to record rate limit metrics: {e}")
+            logger.error("Failed to record rate limit metrics: %s", e)
 
 # Global metrics instance
 metrics = MemoBotMetrics()
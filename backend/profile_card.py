@@ -10,20 +10,31 @@ This module provides a comprehensive user profiling system that:
 
 from __future__ import annotations
 import os
+import copy
 import time
+import threading
 from typing import Dict, Any, List, Optional
 from dataclasses import dataclass, asdict
-from dotenv import load_dotenv
+from cachetools import TTLCache
 
 from google.cloud import firestore
 from google.cloud.firestore_v1 import FieldFilter
 
-load_dotenv()
+from _env import load_once
+
+load_once()
 
 # Firestore client configuration
 _PROJECT = os.getenv("FIRESTORE_PROJECT")
 _db = firestore.Client(project=_PROJECT)
 
+# Profile cards are read on every chat turn and UI refresh; saves write through.
+# The cache is per process, so read-modify-write paths bypass it (use_cache=False)
+# rather than risk saving over a newer card written by another worker or instance.
+PROFILE_CACHE_TTL = 30  # seconds
+_profile_cache: TTLCache = TTLCache(maxsize=5000, ttl=PROFILE_CACHE_TTL)
+_profile_cache_lock = threading.Lock()
+
 # Data structures
 @dataclass
 class FactEntry:
@@ -107,15 +118,32 @@ def _get_profile_ref(user_id: str):
     """Get Firestore reference for user's profile card."""
     return _db.collection("users").document(user_id).collection("meta").document("profile_card")
 
-def get_profile_card(user_id: str) -> ProfileCard:
-    """Get user's profile card from Firestore."""
+def _cache_profile_card(user_id: str, profile: Optional[ProfileCard]) -> None:
+    """Store a private copy of a profile card in the cache, or drop it when None."""
+    with _profile_cache_lock:
+        if profile is None:
+            _profile_cache.pop(user_id, None)
+        else:
+            _profile_cache[user_id] = copy.deepcopy(profile)
+
+def get_profile_card(user_id: str, use_cache: bool = True) -> ProfileCard:
+    """Get user's profile card, served from a short-lived cache unless use_cache is False."""
+    if use_cache:
+        with _profile_cache_lock:
+            cached = _profile_cache.get(user_id)
+        if cached is not None:
+            # Callers may mutate the card, so never hand out the cached object
+            return copy.deepcopy(cached)
+    
     try:
         ref = _get_profile_ref(user_id)
         doc = ref.get()
         
         if doc.exists:
             data = doc.to_dict()
-            return ProfileCard(**data)
+            profile = ProfileCard(**data)
+            _cache_profile_card(user_id, profile)
+            return profile
         else:
             # Create default profile card if none exists
             profile = create_default_profile_card(user_id)
@@ -139,6 +167,7 @@ def save_profile_card(user_id: str, profile: ProfileCard) -> bool:
         # Convert to dict and save
         data = asdict(profile)
         ref.set(data)
+        _cache_profile_card(user_id, profile)
         
         # Save version history
         save_profile_version(user_id, profile)
@@ -147,6 +176,7 @@ def save_profile_card(user_id: str, profile: ProfileCard) -> bool:
         
     except Exception as e:
         print(f"Error saving profile card for user {user_id}: {e}")
+        _cache_profile_card(user_id, None)
         return False
 
 def save_profile_version(user_id: str, profile: ProfileCard) -> bool:
@@ -177,24 +207,30 @@ def get_profile_history(user_id: str, limit: int = 10) -> List[ProfileCard]:
         return []
 
 # Profile card operations
-def count_total_facts(profile: ProfileCard) -> int:
-    """Count total facts in profile card."""
+def _count_section_facts(section_data: Dict[str, Any]) -> int:
+    """Count facts in one profile section."""
     count = 0
     
-    for section_name, section_data in profile.sections.items():
-        if isinstance(section_data, dict):
-            for field_name, field_data in section_data.items():
-                if isinstance(field_data, dict):
-                    if "value" in field_data:
-                        # Single value field
-                        if field_data["value"]:
-                            count += 1
-                    else:
-                        # Dictionary field (like interests, preferences)
-                        count += len(field_data)
+    for field_data in section_data.values():
+        if isinstance(field_data, dict):
+            if "value" in field_data:
+                # Single value field
+                if field_data["value"]:
+                    count += 1
+            else:
+                # Dictionary field (like interests, preferences)
+                count += len(field_data)
     
     return count
 
+def count_total_facts(profile: ProfileCard) -> int:
+    """Count total facts in profile card."""
+    return sum(
+        _count_section_facts(section_data)
+        for section_data in profile.sections.values()
+        if isinstance(section_data, dict)
+    )
+
 def format_profile_for_llm(profile: ProfileCard) -> str:
     """Format profile card for LLM context injection."""
     sections = profile.sections
@@ -231,6 +267,26 @@ def calculate_tokens(profile: ProfileCard) -> int:
     # Rough token estimation (1 token ≈ 4 characters)
     return len(text) // 4
 
+def profile_stats(profile: ProfileCard) -> Dict[str, Any]:
+    """Compute fact, token and per-section field counts in a single pass over the sections."""
+    total_facts = 0
+    sections = {}
+    
+    for section_name, section_data in profile.sections.items():
+        if isinstance(section_data, dict):
+            sections[section_name] = len(section_data)
+            total_facts += _count_section_facts(section_data)
+        else:
+            sections[section_name] = 0
+    
+    return {
+        "total_facts": total_facts,
+        "tokens": calculate_tokens(profile),
+        "version": profile.version,
+        "last_updated": profile.metadata.get("updated_at"),
+        "sections": sections,
+    }
+
 # Profile update operations
 def update_profile_with_confidence(profile: ProfileCard, updates: List[Dict[str, Any]]) -> ProfileCard:
     """Update profile card with confidence tracking."""
@@ -18,11 +18,11 @@ from slowapi.errors import RateLimitExceeded
 from fastapi import Request, HTTPException
 from fastapi.responses import JSONResponse
 import redis
-from dotenv import load_dotenv
 
+from _env import load_once
 from monitoring import metrics
 
-load_dotenv()
+load_once()
 
 # Rate limit configuration per endpoint
 RATE_LIMITS = {
@@ -39,6 +39,10 @@ RATE_LIMITS = {
 # Default rate limit for unlisted endpoints
 DEFAULT_RATE_LIMIT = "30/minute"
 
+# Shared (Redis) storage uses a moving window: each hit is one atomic Lua call,
+# and limits hold across workers without the fixed window's boundary bursts
+SHARED_RATE_LIMIT_STRATEGY = "moving-window"
+
 def get_user_identifier(request: Request) -> str:
     """
     Create a rate limiting key based on user UID and IP.
@@ -80,6 +84,7 @@ def create_limiter() -> Limiter:
             return Limiter(
                 key_func=get_user_identifier,
                 storage_uri=redis_url,
+                strategy=SHARED_RATE_LIMIT_STRATEGY,
                 default_limits=[DEFAULT_RATE_LIMIT]
             )
         except Exception as e:
@@ -87,6 +92,8 @@ def create_limiter() -> Limiter:
     
     # Fallback to in-memory storage
     print("Rate limiter: Using in-memory storage")
+    if int(os.getenv("WEB_CONCURRENCY", "1")) > 1:
+        print("WARNING: in-memory rate limits are counted per worker; set REDIS_URL to share them")
     return Limiter(
         key_func=get_user_identifier,
         default_limits=[DEFAULT_RATE_LIMIT]
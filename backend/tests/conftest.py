@@ -41,7 +41,7 @@ def client():
 @pytest.fixture
 def mock_firebase_auth():
     """Mock Firebase authentication for testing."""
-    with patch('main.fb_auth.verify_id_token') as mock_verify:
+    with patch('main.verify_id_token') as mock_verify:
         mock_verify.return_value = {"uid": "test-user-123"}
         yield mock_verify
 
@@ -89,6 +89,33 @@ def auth_headers():
     return {"Authorization": "Bearer fake-firebase-token"}
 
 
+@pytest.fixture(autouse=True)
+def reset_token_cache():
+    """Forget verified ID tokens so each test's auth mock decides the outcome."""
+    import main
+    main._token_cache.clear()
+    main._rejected_token_cache.clear()
+    yield
+
+
+@pytest.fixture(autouse=True)
+def reset_profile_cache():
+    """Start every test without cached profile cards."""
+    import profile_card
+    profile_card._profile_cache.clear()
+    yield
+    profile_card._profile_cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def reset_episodic_memory():
+    """Drop the shared EpisodicMemory so each test's Chroma patches take effect."""
+    import episodic_memory
+    episodic_memory._memory = None
+    yield
+    episodic_memory._memory = None
+
+
 @pytest.fixture(autouse=True)
 def reset_rate_limiter():
     """Reset rate limiter state before each test."""
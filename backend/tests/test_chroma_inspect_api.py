@@ -282,6 +282,55 @@ class TestChromaInspectAPI:
             assert stats["collection_name"] == "episodic_memory"
             assert stats["chroma_mode"] == "local"
             assert stats["collection_exists"] is True
+    
+    def test_chroma_inspect_pagination(self, client, mock_firebase_auth, auth_headers):
+        """Test pages are cut from the newest-first order and only the page's metadata is read."""
+        with patch('episodic_memory.get_episodic_collection') as mock_get_collection:
+            mock_collection = Mock()
+            mock_get_collection.return_value = mock_collection
+            # Insertion order differs from time order; same-second episodes tie-break on ISO time
+            ids = ['ep_100_a', 'ep_300_c', 'ep_100_b', 'ep_50_z']
+            mock_collection.get.side_effect = [
+                {'ids': ids, 'metadatas': None},
+                {
+                    'ids': ['ep_100_a', 'ep_100_b'],
+                    'metadatas': [
+                        {"round_number": 1, "timestamp_unix": 100, "timestamp": "2023-01-01T00:01:40.100"},
+                        {"round_number": 2, "timestamp_unix": 100, "timestamp": "2023-01-01T00:01:40.900"},
+                    ],
+                },
+            ]
+            
+            response = client.get("/api/chroma/inspect?limit=2&offset=1", headers=auth_headers)
+            
+            assert response.status_code == 200
+            data = response.json()
+            assert [e["id"] for e in data["episodes"]] == ['ep_100_b', 'ep_100_a']
+            assert data["stats"]["total_episodes"] == 4
+            assert mock_collection.get.call_args_list[0].kwargs == {
+                "where": {"user_id": "test-user-123"}, "include": []}
+            assert mock_collection.get.call_args_list[1].kwargs == {
+                "ids": ['ep_100_a', 'ep_100_b'], "include": ["metadatas"]}
+    
+    @pytest.mark.parametrize("query", ["offset=-1", "limit=0", "limit=201"])
+    def test_chroma_inspect_rejects_bad_paging(self, client, mock_firebase_auth, auth_headers, query):
+        """Test out-of-range limit and offset are rejected before Chroma is read."""
+        with patch('episodic_memory.get_episodic_collection') as mock_get_collection:
+            response = client.get(f"/api/chroma/inspect?{query}", headers=auth_headers)
+            
+            assert response.status_code == 422
+            mock_get_collection.return_value.get.assert_not_called()
+    
+    def test_chroma_inspect_reuses_collection(self, client, mock_firebase_auth, auth_headers):
+        """Test repeated inspections share one collection handle instead of reconnecting."""
+        with patch('episodic_memory.get_episodic_collection') as mock_get_collection:
+            mock_get_collection.return_value.get.return_value = {'metadatas': [], 'ids': []}
+            
+            client.get("/api/chroma/inspect", headers=auth_headers)
+            client.get("/api/chroma/inspect", headers=auth_headers)
+            
+            mock_get_collection.assert_called_once()
+            assert mock_get_collection.return_value.get.call_count == 2
 
 
 class TestChromaInspectAPIRateLimiting:
@@ -322,7 +371,7 @@ class TestChromaInspectAPIAuthentication:
         """Test ChromaDB inspection endpoint with invalid token."""
         invalid_headers = {"Authorization": "Bearer invalid-token"}
         
-        with patch('main.fb_auth.verify_id_token', side_effect=Exception("Invalid token")):
+        with patch('main.verify_id_token', side_effect=Exception("Invalid token")):
             response = client.get("/api/chroma/inspect", headers=invalid_headers)
             assert response.status_code == 401
             assert "Invalid ID token" in response.json()["detail"]
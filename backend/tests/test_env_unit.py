@@ -0,0 +1,42 @@
+"""
+Unit tests for the shared .env loader.
+
+This module tests:
+- .env is parsed once, with the first caller's override policy
+- MEMO_BOT_SKIP_DOTENV=1 skips .env entirely
+"""
+
+import pytest
+from unittest.mock import patch
+
+import _env
+
+
+@pytest.fixture
+def fresh_env(monkeypatch):
+    """Reset the loaded flag so each test sees a first load."""
+    monkeypatch.setattr(_env, '_loaded', False)
+    monkeypatch.delenv('MEMO_BOT_SKIP_DOTENV', raising=False)
+    with patch('_env.dotenv.load_dotenv') as mock_load:
+        yield mock_load
+
+
+class TestLoadOnce:
+    """Test .env loading is shared across modules."""
+
+    def test_first_caller_sets_override(self, fresh_env):
+        """Test later calls are no-ops even with a different override."""
+        _env.load_once(override=True)
+        _env.load_once()
+        _env.load_once(override=False)
+
+        fresh_env.assert_called_once_with(override=True)
+
+    def test_skip_sentinel(self, fresh_env, monkeypatch):
+        """Test MEMO_BOT_SKIP_DOTENV=1 never reads .env."""
+        monkeypatch.setenv('MEMO_BOT_SKIP_DOTENV', '1')
+
+        _env.load_once(override=True)
+        _env.load_once()
+
+        fresh_env.assert_not_called()
@@ -13,18 +13,24 @@ This module tests:
 import pytest
 import time
 import uuid
+import numpy as np
 from unittest.mock import patch, Mock, MagicMock
 from datetime import datetime
 
 from episodic_memory import (
     Episode,
     EpisodicMemory,
+    AsyncEpisodicMemory,
+    ChromaConfig,
     get_chroma_client,
     get_episodic_collection,
     get_embedding,
+    get_embeddings_batch,
+    _embedding_memo,
     create_episode_embeddings,
     create_episode,
     store_conversation_round,
+    store_conversation_rounds,
     search_user_episodes,
     get_user_recent_episodes,
     test_episodic_memory
@@ -57,7 +63,17 @@ class TestEpisodeDataModel:
         assert episode.session_id == session_id
         assert isinstance(episode.timestamp, datetime)
         assert episode.id.startswith("ep_")
-        assert len(episode.id) > 10  # Should have timestamp + uuid
+        assert len(episode.id) > 10  # Should have timestamp + suffix
+    
+    def test_episode_ids_unique(self):
+        """Test that episodes created in the same second get distinct ids."""
+        embeddings = create_episode_embeddings("Hello", "Hi")
+        ids = {
+            Episode("test_user", "Hello", "Hi", i, "test_session", embeddings=embeddings).id
+            for i in range(100)
+        }
+        
+        assert len(ids) == 100
     
     def test_episode_embeddings_generation(self):
         """Test that episode generates embeddings."""
@@ -80,8 +96,9 @@ class TestEpisodeDataModel:
         assert len(episode.combined_embedding) == 1536
         
         # Combined embedding should be average of user and AI embeddings
-        expected_combined = [(u + a) / 2 for u, a in zip(episode.user_embedding, episode.ai_embedding)]
-        assert episode.combined_embedding == expected_combined
+        expected_combined = (episode.user_embedding + episode.ai_embedding) / 2
+        assert np.allclose(episode.combined_embedding, expected_combined, atol=1e-3)
+        assert episode.combined_embedding.dtype == np.float32
     
     def test_episode_token_calculation(self):
         """Test token calculation for episodes."""
@@ -93,8 +110,8 @@ class TestEpisodeDataModel:
             session_id="test_session"
         )
         
-        # Should calculate tokens based on word count
-        assert episode.tokens == 4  # "Hello world" (2) + "Hi there!" (2)
+        # Should estimate tokens at ~4 characters per token
+        assert episode.tokens == 5  # ("Hello world" (11) + "Hi there!" (9)) // 4
     
     def test_episode_to_dict(self):
         """Test converting episode to dictionary."""
@@ -114,42 +131,31 @@ class TestEpisodeDataModel:
         assert episode_dict["ai_response"] == "Hi there!"
         assert episode_dict["round_number"] == 1
         assert episode_dict["session_id"] == "test_session"
-        assert episode_dict["tokens"] == 4
+        assert episode_dict["tokens"] == 5
         assert "timestamp" in episode_dict
-        assert "user_embedding" in episode_dict
-        assert "ai_embedding" in episode_dict
-        assert "combined_embedding" in episode_dict
+        assert "user_embedding" not in episode_dict
+        assert "ai_embedding" not in episode_dict
+        assert "combined_embedding" not in episode_dict
 
 
 class TestChromaClientOperations:
     """Test ChromaDB client operations."""
     
-    @patch('episodic_memory.os.getenv')
-    def test_get_chroma_client_local_mode(self, mock_getenv):
+    @patch('episodic_memory._CONFIG', ChromaConfig(mode="local", api_key=None, tenant=None, database=None))
+    def test_get_chroma_client_local_mode(self):
         """Test getting Chroma client in local mode."""
-        mock_getenv.side_effect = lambda key, default=None: {
-            "CHROMA_MODE": "local",
-            "OPENAI_API_KEY": "test_key"
-        }.get(key, default)
-        
-        with patch('episodic_memory.chromadb.PersistentClient') as mock_client:
+        with patch('chromadb.PersistentClient') as mock_client:
             client = get_chroma_client()
             
             mock_client.assert_called_once_with(path="./chroma_db")
             assert client == mock_client.return_value
     
-    @patch('episodic_memory.os.getenv')
-    def test_get_chroma_client_cloud_mode(self, mock_getenv):
+    @patch('episodic_memory._CONFIG', ChromaConfig(
+        mode="cloud", api_key="test_api_key", tenant="test_tenant", database="test_database"
+    ))
+    def test_get_chroma_client_cloud_mode(self):
         """Test getting Chroma client in cloud mode."""
-        mock_getenv.side_effect = lambda key, default=None: {
-            "CHROMA_MODE": "cloud",
-            "CHROMA_API_KEY": "test_api_key",
-            "CHROMA_TENANT": "test_tenant",
-            "CHROMA_DATABASE": "test_database",
-            "OPENAI_API_KEY": "test_key"
-        }.get(key, default)
-        
-        with patch('episodic_memory.chromadb.CloudClient') as mock_client:
+        with patch('chromadb.CloudClient') as mock_client:
             client = get_chroma_client()
             
             mock_client.assert_called_once_with(
@@ -159,16 +165,11 @@ class TestChromaClientOperations:
             )
             assert client == mock_client.return_value
     
-    @patch('episodic_memory.os.getenv')
-    def test_get_chroma_client_cloud_mode_missing_vars(self, mock_getenv):
+    @patch('episodic_memory._CONFIG', ChromaConfig(
+        mode="cloud", api_key="test_api_key", tenant=None, database=None  # Missing tenant and database
+    ))
+    def test_get_chroma_client_cloud_mode_missing_vars(self):
         """Test getting Chroma client in cloud mode with missing environment variables."""
-        mock_getenv.side_effect = lambda key, default=None: {
-            "CHROMA_MODE": "cloud",
-            "CHROMA_API_KEY": "test_api_key",
-            # Missing CHROMA_TENANT and CHROMA_DATABASE
-            "OPENAI_API_KEY": "test_key"
-        }.get(key, default)
-        
         with pytest.raises(ValueError, match="Chroma Cloud mode requires"):
             get_chroma_client()
     
@@ -199,16 +200,42 @@ class TestChromaClientOperations:
         assert collection == mock_collection
         mock_client.create_collection.assert_called_once_with(
             name="episodic_memory",
-            metadata={"description": "Conversation rounds stored as episodes with embeddings"}
+            metadata={
+                "description": "Conversation rounds stored as episodes with embeddings",
+                "hnsw:space": "cosine"
+            }
         )
 
 
 class TestEmbeddingOperations:
     """Test embedding generation operations."""
     
-    @patch('episodic_memory._openai_client')
-    def test_get_embedding_success(self, mock_client):
+    def setup_method(self):
+        """Start each test with an empty embedding cache."""
+        _embedding_memo.clear()
+    
+    def test_disk_cache_opened_once(self, tmp_path):
+        """Test the on-disk tier keeps one handle per process and serves entries after the LRU drops them."""
+        import shelve
+        import episodic_memory
+        
+        open_shelf = shelve.open
+        with patch.object(episodic_memory, 'EMBEDDING_CACHE_PATH', str(tmp_path / "embeddings")), \
+             patch.object(episodic_memory, '_embedding_store', None), \
+             patch('episodic_memory.shelve.open', side_effect=open_shelf) as mock_open, \
+             patch('episodic_memory.atexit.register'):
+            episodic_memory._cache_put("hello", (0.5,) * 4)
+            _embedding_memo.clear()
+            cached = episodic_memory._cache_get("hello")
+            episodic_memory._embedding_store.close()
+        
+        assert cached == (0.5,) * 4
+        mock_open.assert_called_once()
+    
+    @patch('episodic_memory._get_openai_client')
+    def test_get_embedding_success(self, mock_get_client):
         """Test successful embedding generation."""
+        mock_client = mock_get_client.return_value
         mock_response = Mock()
         mock_response.data = [Mock(embedding=[0.1] * 1536)]
         mock_client.embeddings.create.return_value = mock_response
@@ -222,9 +249,24 @@ class TestEmbeddingOperations:
             input="test text"
         )
     
-    @patch('episodic_memory._openai_client')
-    def test_get_embedding_error(self, mock_client):
+    @patch('episodic_memory._get_openai_client')
+    def test_get_embedding_cached(self, mock_get_client):
+        """Test repeated text is served from the embedding cache."""
+        mock_client = mock_get_client.return_value
+        mock_response = Mock()
+        mock_response.data = [Mock(embedding=[0.1] * 1536)]
+        mock_client.embeddings.create.return_value = mock_response
+        
+        first = get_embedding("repeated text")
+        second = get_embedding("repeated text")
+        
+        assert first == second == [0.1] * 1536
+        mock_client.embeddings.create.assert_called_once()
+    
+    @patch('episodic_memory._get_openai_client')
+    def test_get_embedding_error(self, mock_get_client):
         """Test embedding generation error handling."""
+        mock_client = mock_get_client.return_value
         mock_client.embeddings.create.side_effect = Exception("API error")
         
         embedding = get_embedding("test text")
@@ -242,10 +284,35 @@ class TestEmbeddingOperations:
         assert len(embedding) == 1536
         assert embedding == [0.0] * 1536
     
-    @patch('episodic_memory.get_embedding')
-    def test_create_episode_embeddings(self, mock_get_embedding):
+    @patch('episodic_memory._get_openai_client')
+    def test_get_embeddings_batch_single_request(self, mock_get_client):
+        """Test batch embedding fetches all cache misses in one request."""
+        mock_client = mock_get_client.return_value
+        mock_response = Mock()
+        mock_response.data = [Mock(embedding=[0.1] * 1536), Mock(embedding=[0.2] * 1536)]
+        mock_client.embeddings.create.return_value = mock_response
+        
+        embeddings = get_embeddings_batch(["first", "second", "first"])
+        
+        assert [list(e) for e in embeddings] == [[0.1] * 1536, [0.2] * 1536, [0.1] * 1536]
+        mock_client.embeddings.create.assert_called_once_with(
+            model="text-embedding-3-small",
+            input=["first", "second"]
+        )
+    
+    @patch('episodic_memory._use_openai', False)
+    def test_create_episode_embeddings_no_openai(self):
+        """Test fallback embeddings share a single read-only zero vector."""
+        embeddings = create_episode_embeddings("Hello", "Hi there!")
+        
+        assert embeddings["user_embedding"] is embeddings["ai_embedding"]
+        assert len(embeddings["combined_embedding"]) == 1536
+        assert not embeddings["combined_embedding"].any()
+    
+    @patch('episodic_memory.get_embeddings_batch')
+    def test_create_episode_embeddings(self, mock_get_embeddings_batch):
         """Test creating embeddings for episode storage."""
-        mock_get_embedding.side_effect = [
+        mock_get_embeddings_batch.return_value = [
             [0.1] * 1536,  # user embedding
             [0.2] * 1536   # ai embedding
         ]
@@ -256,12 +323,13 @@ class TestEmbeddingOperations:
         assert "ai_embedding" in embeddings
         assert "combined_embedding" in embeddings
         
-        assert embeddings["user_embedding"] == [0.1] * 1536
-        assert embeddings["ai_embedding"] == [0.2] * 1536
+        assert np.allclose(embeddings["user_embedding"], [0.1] * 1536)
+        assert np.allclose(embeddings["ai_embedding"], [0.2] * 1536)
         
         # Combined should be average
         expected_combined = [0.15] * 1536
-        assert embeddings["combined_embedding"] == expected_combined
+        assert np.allclose(embeddings["combined_embedding"], expected_combined, atol=1e-3)
+        assert embeddings["combined_embedding"].dtype == np.float32
 
 
 class TestEpisodicMemoryOperations:
@@ -306,6 +374,33 @@ class TestEpisodicMemoryOperations:
             assert len(call_args[1]['ids']) == 1
             assert call_args[1]['ids'][0] == episode.id
     
+    def test_store_episodes_single_add(self):
+        """Test bulk episode storage issues one Chroma add call."""
+        with patch('episodic_memory.get_episodic_collection') as mock_get_collection:
+            mock_collection = Mock()
+            mock_get_collection.return_value = mock_collection
+            
+            memory = EpisodicMemory()
+            episodes = [
+                Episode(
+                    user_id="test_user",
+                    user_message=f"Hello {i}",
+                    ai_response="Hi!",
+                    round_number=i,
+                    session_id="test_session"
+                )
+                for i in range(1, 4)
+            ]
+            
+            episode_ids = memory.store_episodes(episodes)
+            
+            assert episode_ids == [episode.id for episode in episodes]
+            mock_collection.add.assert_called_once()
+            call_args = mock_collection.add.call_args
+            assert len(call_args[1]['embeddings']) == 3
+            assert len(call_args[1]['metadatas']) == 3
+            assert call_args[1]['ids'] == episode_ids
+    
     def test_store_episode_error(self):
         """Test episode storage error handling."""
         with patch('episodic_memory.get_episodic_collection') as mock_get_collection:
@@ -362,6 +457,38 @@ class TestEpisodicMemoryOperations:
             assert episode["similarity"] == 0.8  # 1 - 0.2
             assert episode["id"] == "episode_1"
     
+    def test_search_episodes_rerank(self):
+        """Test rerank recomputes similarity from stored embeddings and re-sorts."""
+        with patch('episodic_memory.get_episodic_collection') as mock_get_collection, \
+             patch('episodic_memory.get_embedding') as mock_get_embedding:
+            
+            mock_collection = Mock()
+            mock_get_collection.return_value = mock_collection
+            
+            metadata = {
+                "user_message": "msg",
+                "ai_response": "resp",
+                "round_number": 1,
+                "session_id": "session_1",
+                "timestamp": "2023-01-01T00:00:00",
+                "tokens": 1
+            }
+            mock_collection.query.return_value = {
+                'metadatas': [[metadata, metadata, metadata]],
+                'ids': [['orthogonal', 'aligned', 'zero']],
+                'distances': [[0.1, 0.5, 0.9]],
+                'embeddings': [[[0.0, 1.0], [2.0, 0.0], [0.0, 0.0]]]
+            }
+            mock_get_embedding.return_value = [1.0, 0.0]
+            
+            memory = EpisodicMemory()
+            episodes = memory.search_episodes("test_user", "query", rerank=True)
+            
+            assert [episode["id"] for episode in episodes] == ["aligned", "orthogonal", "zero"]
+            assert episodes[0]["similarity"] == pytest.approx(1.0)
+            assert episodes[2]["similarity"] == 0.0
+            assert "embeddings" in mock_collection.query.call_args.kwargs["include"]
+    
     def test_search_episodes_no_results(self):
         """Test episode search with no results."""
         with patch('episodic_memory.get_episodic_collection') as mock_get_collection, \
@@ -433,6 +560,60 @@ class TestEpisodicMemoryOperations:
             assert episodes[0]["user_message"] == "Recent message 1"
             assert episodes[1]["user_message"] == "Recent message 2"
     
+    def test_get_recent_episodes_incremental(self):
+        """Test later calls only fetch episodes newer than the cached cursor."""
+        with patch('episodic_memory.get_episodic_collection') as mock_get_collection:
+            mock_collection = Mock()
+            mock_get_collection.return_value = mock_collection
+            
+            first_metadata = {
+                "user_message": "Old message",
+                "ai_response": "Old response",
+                "round_number": 1,
+                "session_id": "session_1",
+                "timestamp": "2023-01-01T00:00:00",
+                "timestamp_unix": 1672531200,
+                "tokens": 4
+            }
+            new_metadata = {**first_metadata, "user_message": "New message", "round_number": 2,
+                            "timestamp": "2023-01-02T00:00:00", "timestamp_unix": 1672617600}
+            mock_collection.get.side_effect = [
+                {'metadatas': [first_metadata], 'ids': ['ep1']},
+                {'metadatas': [new_metadata], 'ids': ['ep2']},
+            ]
+            
+            memory = EpisodicMemory()
+            memory.get_recent_episodes("test_user", limit=10)
+            episodes = memory.get_recent_episodes("test_user", limit=10)
+            
+            assert [ep["id"] for ep in episodes] == ["ep2", "ep1"]
+            second_where = mock_collection.get.call_args_list[1][1]["where"]
+            assert second_where == {"$and": [
+                {"user_id": "test_user"},
+                {"timestamp_unix": {"$gte": 1672531200}}
+            ]}
+    
+    def test_get_recent_episodes_same_second_order(self):
+        """Test episodes stored within one second keep their ISO-time and round order."""
+        with patch('episodic_memory.get_episodic_collection') as mock_get_collection:
+            mock_collection = Mock()
+            mock_get_collection.return_value = mock_collection
+            
+            base = {"ai_response": "Hi", "session_id": "s", "timestamp_unix": 1672531200, "tokens": 1}
+            mock_collection.get.return_value = {
+                'metadatas': [
+                    {**base, "user_message": "first", "round_number": 1, "timestamp": "2023-01-01T00:00:00.100000"},
+                    {**base, "user_message": "third", "round_number": 3, "timestamp": "2023-01-01T00:00:00.900000"},
+                    {**base, "user_message": "second", "round_number": 2, "timestamp": "2023-01-01T00:00:00.500000"},
+                ],
+                'ids': ['ep1', 'ep3', 'ep2']
+            }
+            
+            memory = EpisodicMemory()
+            episodes = memory.get_recent_episodes("test_user", limit=10)
+            
+            assert [ep["id"] for ep in episodes] == ["ep3", "ep2", "ep1"]
+    
     def test_get_recent_episodes_error(self):
         """Test recent episodes retrieval error handling."""
         with patch('episodic_memory.get_episodic_collection') as mock_get_collection:
@@ -459,6 +640,55 @@ class TestEpisodicMemoryOperations:
             
             assert count == 3
     
+    def test_get_episode_count_cached(self):
+        """Test episode count is fetched once and then tracked locally."""
+        with patch('episodic_memory.get_episodic_collection') as mock_get_collection:
+            mock_collection = Mock()
+            mock_get_collection.return_value = mock_collection
+            mock_collection.get.return_value = {'ids': ['ep1', 'ep2']}
+            
+            memory = EpisodicMemory()
+            assert memory.get_episode_count("test_user") == 2
+            
+            memory.store_episode(Episode(
+                user_id="test_user",
+                user_message="Hello",
+                ai_response="Hi!",
+                round_number=3,
+                session_id="test_session"
+            ))
+            
+            assert memory.get_episode_count("test_user") == 3
+            mock_collection.get.assert_called_once()
+    
+    def test_get_next_round_number_reads_stored_rounds(self):
+        """Test next round number always follows the highest round stored in Chroma."""
+        with patch('episodic_memory.get_episodic_collection') as mock_get_collection:
+            mock_collection = Mock()
+            mock_get_collection.return_value = mock_collection
+            mock_collection.get.return_value = {
+                'ids': ['ep1', 'ep2'],
+                'metadatas': [{"round_number": 4}, {"round_number": 2}]
+            }
+            
+            memory = EpisodicMemory()
+            assert memory.get_next_round_number("test_user") == 5
+            
+            memory.store_episode(Episode(
+                user_id="test_user",
+                user_message="Hello",
+                ai_response="Hi!",
+                round_number=5,
+                session_id="test_session"
+            ))
+            
+            mock_collection.get.return_value = {
+                'ids': ['ep1', 'ep2', 'ep3'],
+                'metadatas': [{"round_number": 4}, {"round_number": 2}, {"round_number": 5}]
+            }
+            assert memory.get_next_round_number("test_user") == 6
+            assert mock_collection.get.call_count == 2
+    
     def test_get_episode_count_error(self):
         """Test episode count retrieval error handling."""
         with patch('episodic_memory.get_episodic_collection') as mock_get_collection:
@@ -472,6 +702,28 @@ class TestEpisodicMemoryOperations:
             assert count == 0
 
 
+class TestAsyncEpisodicMemory:
+    """Test AsyncEpisodicMemory bulk ingest."""
+    
+    @pytest.mark.asyncio
+    @patch('episodic_memory._use_openai', False)
+    async def test_store_conversation_rounds_pipelined(self):
+        """Test rounds are embedded and stored batch by batch in order."""
+        mock_memory = Mock()
+        mock_memory.store_episodes.side_effect = lambda episodes: [
+            f"ep{episode.round_number}" for episode in episodes
+        ]
+        
+        memory = AsyncEpisodicMemory(mock_memory)
+        rounds = [(f"Hello {i}", "Hi!") for i in range(5)]
+        episode_ids = await memory.store_conversation_rounds(
+            "test_user", rounds, "test_session", batch_size=2
+        )
+        
+        assert episode_ids == ["ep1", "ep2", "ep3", "ep4", "ep5"]
+        assert mock_memory.store_episodes.call_count == 3
+
+
 class TestConvenienceFunctions:
     """Test convenience functions."""
     
@@ -492,6 +744,7 @@ class TestConvenienceFunctions:
         assert episode.round_number == 1
         assert episode.session_id == "test_session"
     
+    @patch('episodic_memory._memory', None)
     @patch('episodic_memory.EpisodicMemory')
     def test_store_conversation_round(self, mock_memory_class):
         """Test store_conversation_round convenience function."""
@@ -511,6 +764,26 @@ class TestConvenienceFunctions:
         mock_memory_class.assert_called_once()
         mock_memory.store_episode.assert_called_once()
     
+    @patch('episodic_memory._memory', None)
+    @patch('episodic_memory.EpisodicMemory')
+    @patch('episodic_memory.get_embeddings_batch')
+    def test_store_conversation_rounds(self, mock_get_embeddings_batch, mock_memory_class):
+        """Test store_conversation_rounds embeds all rounds in one batch."""
+        mock_get_embeddings_batch.return_value = [[0.1] * 1536] * 4
+        mock_memory = Mock()
+        mock_memory_class.return_value = mock_memory
+        mock_memory.store_episodes.return_value = ["ep1", "ep2"]
+        
+        episode_ids = store_conversation_rounds(
+            "test_user", [("Hello", "Hi!"), ("Bye", "See you!")], "test_session"
+        )
+        
+        assert episode_ids == ["ep1", "ep2"]
+        mock_get_embeddings_batch.assert_called_once_with(["Hello", "Hi!", "Bye", "See you!"])
+        episodes = mock_memory.store_episodes.call_args[0][0]
+        assert [ep.round_number for ep in episodes] == [1, 2]
+    
+    @patch('episodic_memory._memory', None)
     @patch('episodic_memory.EpisodicMemory')
     def test_search_user_episodes(self, mock_memory_class):
         """Test search_user_episodes convenience function."""
@@ -525,6 +798,7 @@ class TestConvenienceFunctions:
         mock_memory_class.assert_called_once()
         mock_memory.search_episodes.assert_called_once_with("test_user", "query", 5)
     
+    @patch('episodic_memory._memory', None)
     @patch('episodic_memory.EpisodicMemory')
     def test_get_user_recent_episodes(self, mock_memory_class):
         """Test get_user_recent_episodes convenience function."""
@@ -538,17 +812,26 @@ class TestConvenienceFunctions:
         assert episodes[0]["id"] == "ep1"
         mock_memory_class.assert_called_once()
         mock_memory.get_recent_episodes.assert_called_once_with("test_user", 10)
+    
+    @patch('episodic_memory._memory', None)
+    @patch('episodic_memory.EpisodicMemory')
+    def test_convenience_functions_reuse_memory(self, mock_memory_class):
+        """Test convenience functions share a single EpisodicMemory instance."""
+        search_user_episodes("test_user", "query", limit=5)
+        get_user_recent_episodes("test_user", limit=10)
+        
+        mock_memory_class.assert_called_once()
 
 
 class TestEpisodicMemoryTestFunction:
     """Test the test_episodic_memory function."""
     
-    @patch('episodic_memory.store_conversation_round')
+    @patch('episodic_memory.store_conversation_rounds')
     @patch('episodic_memory.search_user_episodes')
     @patch('episodic_memory.get_user_recent_episodes')
     def test_episodic_memory_test_function(self, mock_get_recent, mock_search, mock_store):
         """Test the episodic memory test function."""
-        mock_store.return_value = "episode_id"
+        mock_store.return_value = ["episode_id"] * 5
         mock_search.return_value = [{"user_message": "I love hiking", "similarity": 0.9}]
         mock_get_recent.return_value = [{"round_number": 1, "user_message": "Hello"}]
         
@@ -556,6 +839,7 @@ class TestEpisodicMemoryTestFunction:
         test_episodic_memory()
         
         # Verify that functions were called
-        assert mock_store.call_count == 5  # 5 test episodes
+        assert mock_store.call_count == 1  # 5 test episodes stored in bulk
+        assert len(mock_store.call_args[0][1]) == 5
         assert mock_search.call_count == 4  # 4 search queries
         assert mock_get_recent.call_count == 1  # 1 recent episodes call
@@ -23,7 +23,7 @@ class TestNetworkFailures:
     
     def test_firebase_auth_network_failure(self, client):
         """Test Firebase authentication network failure."""
-        with patch('main.fb_auth.verify_id_token', side_effect=ConnectionError("Network error")):
+        with patch('main.verify_id_token', side_effect=ConnectionError("Network error")):
             response = client.get("/whoami", headers={"Authorization": "Bearer test-token"})
             
             assert response.status_code == 401
@@ -68,7 +68,7 @@ class TestServiceUnavailability:
     
     def test_firebase_service_down(self, client):
         """Test when Firebase service is down."""
-        with patch('main.fb_auth.verify_id_token', 
+        with patch('main.verify_id_token', 
                   side_effect=HTTPException(status_code=503, detail="Service unavailable")):
             response = client.get("/whoami", headers={"Authorization": "Bearer test-token"})
             
@@ -406,7 +406,7 @@ class TestEdgeCases:
     def test_very_long_user_id(self, client, mock_firebase_auth):
         """Test with very long user ID."""
         long_uid = "x" * 1000
-        with patch('main.fb_auth.verify_id_token', return_value={"uid": long_uid}):
+        with patch('main.verify_id_token', return_value={"uid": long_uid}):
             response = client.get("/whoami", headers={"Authorization": "Bearer test-token"})
             
             assert response.status_code == 200
@@ -0,0 +1,72 @@
+"""
+Unit tests for Firebase ID-token verification.
+
+This module tests:
+- Accepting correctly signed tokens
+- Rejecting wrong audience, expired and unsigned tokens
+"""
+
+import time
+
+import jwt
+import pytest
+from unittest.mock import patch, Mock
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+import firebase_tokens
+from firebase_tokens import verify_id_token, FIREBASE_PROJECT_ID
+
+
+@pytest.fixture(scope="module")
+def private_key():
+    """RSA key standing in for Google's signing key."""
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+@pytest.fixture
+def signing_key(private_key):
+    """Serve the test public key from the JWKS client."""
+    with patch.object(firebase_tokens._jwks, 'get_signing_key_from_jwt',
+                      return_value=Mock(key=private_key.public_key())):
+        yield
+
+
+def _token(private_key, **overrides):
+    """Sign a Firebase-shaped ID token."""
+    now = int(time.time())
+    claims = {
+        "iss": f"https://securetoken.google.com/{FIREBASE_PROJECT_ID}",
+        "aud": FIREBASE_PROJECT_ID,
+        "sub": "user_1",
+        "iat": now,
+        "exp": now + 3600,
+    }
+    claims.update(overrides)
+    return jwt.encode(claims, private_key, algorithm="RS256", headers={"kid": "k1"})
+
+
+class TestVerifyIdToken:
+    """Test local ID-token verification."""
+
+    def test_valid_token(self, private_key, signing_key):
+        """Test a correctly signed token yields its claims with uid."""
+        claims = verify_id_token(_token(private_key))
+
+        assert claims["uid"] == "user_1"
+
+    @pytest.mark.parametrize("overrides", [
+        {"aud": "other-project"},
+        {"iss": "https://securetoken.google.com/other-project"},
+        {"exp": int(time.time()) - 10},
+    ])
+    def test_invalid_claims_rejected(self, private_key, signing_key, overrides):
+        """Test wrong audience, issuer or expiry is rejected."""
+        with pytest.raises(jwt.PyJWTError):
+            verify_id_token(_token(private_key, **overrides))
+
+    def test_unsigned_token_rejected(self, signing_key):
+        """Test a token without an RS256 signature is rejected."""
+        token = jwt.encode({"sub": "user_1"}, key=None, algorithm="none")
+
+        with pytest.raises(jwt.PyJWTError):
+            verify_id_token(token)
@@ -0,0 +1,354 @@
+"""
+Unit tests for Firestore storage operations.
+
+This module tests:
+- Read caching for top facts and recent messages
+- Cache invalidation on writes
+- Background message writes
+- Memory upserts
+- Document-id slugs
+- Health probes
+- Session-start prefetching
+- Episode round allocation
+"""
+
+import pytest
+from unittest.mock import patch, Mock
+from cachetools import TTLCache
+
+import firestore_store
+from firestore_store import (
+    add_memory,
+    get_top_facts,
+    log_message,
+    get_last_messages,
+    warm_user,
+)
+
+
+def _snapshot(doc_id, data):
+    """Build a mock Firestore document snapshot."""
+    snap = Mock()
+    snap.id = doc_id
+    snap.exists = True
+    snap.to_dict.return_value = dict(data)
+    return snap
+
+
+@pytest.fixture
+def mock_refs():
+    """Patch per-user references and start every test with empty read caches."""
+    firestore_store._facts_cache.clear()
+    firestore_store._messages_cache.clear()
+    firestore_store._history_cache.clear()
+    firestore_store._history_inflight[:] = [0] * len(firestore_store._history_inflight)
+    refs = Mock()
+    with patch('firestore_store._user_refs', return_value=refs):
+        yield refs
+    firestore_store._facts_cache.clear()
+    firestore_store._messages_cache.clear()
+    firestore_store._history_cache.clear()
+
+
+class TestReadCache:
+    """Test TTL caching of Firestore reads."""
+
+    def test_get_top_facts_cached(self, mock_refs):
+        """Test repeated top-facts reads hit Firestore once."""
+        query = mock_refs.memories.where.return_value.order_by.return_value.limit.return_value.offset.return_value.select.return_value
+        query.stream.return_value = [_snapshot("semantic:name", {"key": "name", "value": "Rex"})]
+
+        first = get_top_facts("user_1")
+        second = get_top_facts("user_1")
+
+        assert first == second == [{"key": "name", "value": "Rex", "id": "semantic:name"}]
+        assert query.stream.call_count == 1
+        projection = mock_refs.memories.where.return_value.order_by.return_value.limit.return_value.offset.return_value.select
+        projection.assert_called_once_with(firestore_store._FACT_FIELDS)
+
+    def test_add_memory_invalidates_top_facts(self, mock_refs):
+        """Test writing a memory drops the user's cached facts."""
+        query = mock_refs.memories.where.return_value.order_by.return_value.limit.return_value.offset.return_value.select.return_value
+        query.stream.return_value = []
+        mock_refs.memories.document.return_value.get.return_value = Mock(exists=False)
+
+        get_top_facts("user_1")
+        add_memory("user_1", {"key": "name", "value": "Rex"})
+        get_top_facts("user_1")
+
+        assert query.stream.call_count == 2
+
+    def test_invalidation_is_per_user(self, mock_refs):
+        """Test a write drops every cached page for its user and leaves other users cached."""
+        query = mock_refs.memories.where.return_value.order_by.return_value.limit.return_value.offset.return_value.select.return_value
+        query.stream.return_value = []
+        mock_refs.memories.document.return_value.get.return_value = Mock(exists=False)
+        
+        get_top_facts("user_1", 6, 0)
+        get_top_facts("user_1", 6, 6)
+        get_top_facts("user_2", 6, 0)
+        add_memory("user_1", {"key": "name", "value": "Rex"})
+        
+        assert "user_1" not in firestore_store._facts_cache
+        assert firestore_store._facts_cache["user_2"] == {(6, 0): []}
+    
+    def test_get_last_messages_cached_oldest_first(self, mock_refs):
+        """Test recent messages are returned oldest first and cached."""
+        query = mock_refs.messages.order_by.return_value.limit.return_value.offset.return_value
+        query.stream.return_value = [
+            _snapshot("m2", {"role": "assistant", "content": "Roar!", "ts": 2.0}),
+            _snapshot("m1", {"role": "user", "content": "Hi", "ts": 1.0}),
+        ]
+
+        messages = get_last_messages("user_1")
+        get_last_messages("user_1")
+
+        assert [m["content"] for m in messages] == ["Hi", "Roar!"]
+        assert query.stream.call_count == 1
+
+    def test_log_message_writes_through_history(self, mock_refs):
+        """Test logged messages are served from the history cache without a re-read."""
+        query = mock_refs.messages.order_by.return_value.limit.return_value.offset.return_value
+        query.stream.return_value = [_snapshot("m1", {"role": "user", "content": "Hi", "ts": 1.0})]
+
+        get_last_messages("user_1", 12)
+        with patch.object(firestore_store, '_write_executor'):
+            log_message("user_1", "assistant", "Roar!", ts=2.0)
+        messages = get_last_messages("user_1", 1)
+
+        assert messages == [{"role": "assistant", "content": "Roar!", "ts": 2.0}]
+        assert query.stream.call_count == 1
+
+    def test_history_cache_expires(self, mock_refs):
+        """Test a seeded history is re-read once its TTL passes, so other writers' messages show up."""
+        query = mock_refs.messages.order_by.return_value.limit.return_value.offset.return_value
+        query.stream.return_value = []
+        clock = [0.0]
+        history = TTLCache(maxsize=8, ttl=firestore_store.HISTORY_CACHE_TTL, timer=lambda: clock[0])
+        
+        with patch.object(firestore_store, '_history_cache', history):
+            get_last_messages("user_1", 12)
+            get_last_messages("user_1", 12)
+            clock[0] = firestore_store.HISTORY_CACHE_TTL + 1
+            firestore_store._messages_cache.clear()
+            get_last_messages("user_1", 12)
+        
+        assert query.stream.call_count == 2
+
+    def test_history_not_seeded_when_write_races_read(self, mock_refs):
+        """Test a cold read overlapping a write is not cached as the user's history."""
+        query = mock_refs.messages.order_by.return_value.limit.return_value.offset.return_value
+
+        def stream_during_write():
+            with patch.object(firestore_store, '_write_executor'):
+                log_message("user_1", "user", "Hello")
+            return []
+        query.stream.side_effect = stream_during_write
+
+        get_last_messages("user_1", 12)
+
+        assert "user_1" not in firestore_store._history_cache
+
+    def test_history_not_seeded_while_write_in_flight(self, mock_refs):
+        """Test a cold read during an unfinished write is not cached; one after it lands is."""
+        query = mock_refs.messages.order_by.return_value.limit.return_value.offset.return_value
+        query.stream.return_value = []
+        
+        with patch.object(firestore_store, '_write_executor') as mock_executor:
+            log_message("user_1", "user", "Hello")
+            get_last_messages("user_1", 12)
+            assert "user_1" not in firestore_store._history_cache
+            
+            fn, *args = mock_executor.submit.call_args.args
+            fn(*args)
+        get_last_messages("user_1", 12)
+        
+        assert "user_1" in firestore_store._history_cache
+    
+    def test_log_message_invalidates_paged_reads(self, mock_refs):
+        """Test logging a message drops cached pages the history cache does not serve."""
+        query = mock_refs.messages.order_by.return_value.limit.return_value.offset.return_value
+        query.stream.return_value = []
+
+        get_last_messages("user_1", 12, 12)
+        with patch.object(firestore_store, '_write_executor'):
+            log_message("user_1", "user", "Hello")
+        get_last_messages("user_1", 12, 12)
+
+        assert query.stream.call_count == 2
+
+    def test_log_message_writes_in_background(self, mock_refs):
+        """Test log_message returns the client-side id and defers the write."""
+        ref = mock_refs.messages.document.return_value
+        ref.id = "msg_1"
+
+        with patch.object(firestore_store, '_write_executor') as mock_executor:
+            message_id = log_message("user_1", "user", "Hello", ts=1.0)
+
+            assert message_id == "msg_1"
+            ref.set.assert_not_called()
+            fn, *args = mock_executor.submit.call_args.args
+            fn(*args)
+
+        ref.set.assert_called_once_with({"role": "user", "content": "Hello", "ts": 1.0})
+        doc_id = mock_refs.messages.document.call_args.args[0]
+        assert doc_id.startswith("00000000000f4240-")  # 1.0s in microseconds
+
+    def test_log_messages_batch_single_commit(self, mock_refs):
+        """Test a chat turn is written with one batch commit and cached in order."""
+        mock_refs.messages.order_by.return_value.limit.return_value.offset.return_value.stream.return_value = []
+        get_last_messages("user_1", 12)
+
+        with patch.object(firestore_store, '_write_executor') as mock_executor, \
+             patch.object(firestore_store, '_db') as mock_db:
+            ids = firestore_store.log_messages_batch("user_1", [
+                {"role": "user", "content": "Hi", "ts": 1.0},
+                {"role": "assistant", "content": "Roar!", "ts": 2.0},
+            ])
+            fn, *args = mock_executor.submit.call_args.args
+            fn(*args)
+
+            batch = mock_db.batch.return_value
+            assert batch.set.call_count == 2
+            batch.commit.assert_called_once()
+
+        assert len(ids) == 2
+        assert [m["content"] for m in get_last_messages("user_1", 12)] == ["Hi", "Roar!"]
+
+    def test_message_ids_sort_by_time(self):
+        """Test message ids order lexicographically by timestamp."""
+        ids = [firestore_store._message_id(ts) for ts in (1.5, 10.0, 1700000000.25)]
+
+        assert ids == sorted(ids)
+
+
+class TestWarmUser:
+    """Test session-start prefetching."""
+
+    def test_warm_user_populates_caches(self, mock_refs):
+        """Test warm_user loads facts and messages with the default page size."""
+        facts_query = mock_refs.memories.where.return_value.order_by.return_value.limit.return_value.offset.return_value.select.return_value
+        facts_query.stream.return_value = []
+        messages_query = mock_refs.messages.order_by.return_value.limit.return_value.offset.return_value
+        messages_query.stream.return_value = []
+
+        with patch.object(firestore_store, '_prefetch_executor') as mock_executor:
+            mock_executor.submit.side_effect = lambda fn, *args: fn(*args)
+            warm_user("user_1")
+
+        get_top_facts("user_1", 12, 0)
+        get_last_messages("user_1", 12, 0)
+
+        assert facts_query.stream.call_count == 1
+        assert messages_query.stream.call_count == 1
+
+
+class TestAllocateRoundNumber:
+    """Test the shared per-user episode round counter."""
+    
+    @pytest.fixture
+    def transactional(self):
+        """Run transactional functions directly with a mock transaction."""
+        with patch.object(firestore_store.firestore, 'transactional', side_effect=lambda fn: fn):
+            yield
+    
+    def test_new_counter_is_seeded(self, mock_refs, transactional):
+        """Test a missing counter starts at first_round() and is written back."""
+        mock_refs.episodes.get.return_value = Mock(exists=False)
+        
+        with patch.object(firestore_store, '_db') as mock_db:
+            round_number = firestore_store.allocate_round_number("user_1", lambda: 5)
+        
+        assert round_number == 5
+        mock_db.transaction.return_value.set.assert_called_once_with(
+            mock_refs.episodes, {"last_round": 5}, merge=True)
+    
+    def test_existing_counter_is_incremented(self, mock_refs, transactional):
+        """Test an existing counter advances without consulting first_round."""
+        mock_refs.episodes.get.return_value = _snapshot("episodes", {"last_round": 7})
+        first_round = Mock()
+        
+        with patch.object(firestore_store, '_db'):
+            assert firestore_store.allocate_round_number("user_1", first_round) == 8
+        
+        first_round.assert_not_called()
+
+
+class TestAddMemory:
+    """Test memory upserts."""
+
+    def test_add_memory_server_timestamp(self, mock_refs):
+        """Test updated_at is written as the server timestamp sentinel."""
+        doc_ref = mock_refs.memories.document.return_value
+        doc_ref.get.return_value = Mock(exists=False)
+
+        saved = add_memory("user_1", {"key": "Favorite Color", "value": "green", "ts": 1.0})
+
+        mock_refs.memories.document.assert_called_once_with("semantic:favorite-color")
+        written = doc_ref.set.call_args.args[0]
+        assert written["updated_at"] is firestore_store.firestore.SERVER_TIMESTAMP
+        assert written["ts"] == 1.0
+        assert "updated_at" not in saved
+        assert saved["score"] == pytest.approx(0.9)
+
+
+    def test_add_memories_bulk(self, mock_refs):
+        """Test bulk upsert reads once, merges existing docs and writes via BulkWriter."""
+        def make_ref(doc_id):
+            ref = Mock()
+            ref.id = doc_id
+            return ref
+        mock_refs.memories.document.side_effect = make_ref
+        existing = _snapshot("semantic:color", {"type": "semantic", "value": "green", "salience": 1.0, "confidence": 0.5, "ts": 1.0})
+
+        with patch.object(firestore_store, '_db') as mock_db:
+            mock_db.get_all.return_value = [existing]
+            saved = firestore_store.add_memories_bulk("user_1", [
+                {"key": "color", "value": "green", "confidence": 0.8, "ts": 5.0},
+                {"key": "pet", "value": "dog", "ts": 5.0},
+                {"key": "Pet", "value": "cat", "ts": 6.0},
+            ])
+
+            assert mock_db.get_all.call_count == 1
+            writer = mock_db.bulk_writer.return_value
+            assert writer.set.call_count == 2
+            writer.close.assert_called_once()
+
+        color, pet = saved
+        assert color["salience"] == pytest.approx(1.2)
+        assert color["confidence"] == 0.8
+        assert color["ts"] == 1.0
+        assert pet["value"] == "cat"
+
+
+class TestSlug:
+    """Test document-id slugs."""
+
+    @pytest.mark.parametrize("raw", [
+        "Favorite Color", "  a--b  ", "", "---", "x_y.z!!", "ABC123 def", "Ünïcode Key",
+    ])
+    def test_slug_matches_regex(self, raw):
+        """Test the ASCII fast path produces the same ids as the regex."""
+        expected = firestore_store._slug_rx.sub("-", raw.lower()).strip("-")
+        assert firestore_store._slug(raw) == expected
+
+
+class TestHealthCheck:
+    """Test liveness and rate-limited readiness probes."""
+
+    def test_shallow_health_check_makes_no_calls(self):
+        """Test liveness does not touch Firestore."""
+        with patch.object(firestore_store, '_db') as mock_db:
+            assert firestore_store.health_check() == {"healthy": True, "cached": True}
+            mock_db.collection.assert_not_called()
+
+    def test_deep_health_check_is_rate_limited(self):
+        """Test the readiness probe reuses its result within the interval."""
+        with patch.object(firestore_store, '_db') as mock_db, \
+             patch.object(firestore_store, '_last_probe_result', None):
+            first = firestore_store.health_check(deep=True)
+            second = firestore_store.health_check(deep=True)
+
+            assert first == {"healthy": True, "cached": False}
+            assert second == {"healthy": True, "cached": True}
+            assert mock_db.collection.call_count == 1
@@ -4,6 +4,8 @@ Integration tests for API endpoints with rate limiting.
 """
 import pytest
 import json
+import time
+import jwt
 from unittest.mock import patch, Mock
 from fastapi.testclient import TestClient
 
@@ -136,7 +138,7 @@ class TestAuthenticationIntegration:
         """Test that invalid tokens return 401, not rate limit errors."""
         invalid_headers = {"Authorization": "Bearer invalid-token"}
         
-        with patch('main.fb_auth.verify_id_token', side_effect=Exception("Invalid token")):
+        with patch('main.verify_id_token', side_effect=Exception("Invalid token")):
             response = client.get("/whoami", headers=invalid_headers)
             assert response.status_code == 401
             assert "Invalid ID token" in response.json()["detail"]
@@ -154,6 +156,48 @@ class TestAuthenticationIntegration:
         
         # The UID should be stored in request.state.uid by get_verified_uid
         # This is tested indirectly through rate limiting working correctly
+    
+    def test_verified_token_is_cached(self, client, mock_firebase_auth, auth_headers):
+        """Test repeated requests with the same token verify it once."""
+        mock_firebase_auth.return_value = {"uid": "test-user-123", "exp": time.time() + 3600}
+        
+        with patch('main.warm_user'):
+            for _ in range(3):
+                response = client.get("/whoami", headers=auth_headers)
+                assert response.json() == {"uid": "test-user-123"}
+        
+        assert mock_firebase_auth.call_count == 1
+    
+    def test_expired_token_is_not_cached(self, client, mock_firebase_auth, auth_headers):
+        """Test a token past its expiry is verified again on every request."""
+        mock_firebase_auth.return_value = {"uid": "test-user-123", "exp": time.time() - 1}
+        
+        with patch('main.warm_user'):
+            client.get("/whoami", headers=auth_headers)
+            client.get("/whoami", headers=auth_headers)
+        
+        assert mock_firebase_auth.call_count == 2
+    
+    def test_rejected_token_is_cached_briefly(self, client):
+        """Test retries of an invalid token skip verification."""
+        invalid_headers = {"Authorization": "Bearer invalid-token"}
+        
+        with patch('main.verify_id_token', side_effect=jwt.InvalidTokenError("Invalid token")) as mock_verify:
+            first = client.get("/whoami", headers=invalid_headers)
+            second = client.get("/whoami", headers=invalid_headers)
+        
+        assert first.status_code == second.status_code == 401
+        assert second.json()["detail"] == first.json()["detail"]
+        assert mock_verify.call_count == 1
+    
+    def test_key_fetch_failure_is_not_cached(self, client, auth_headers):
+        """Test an unreachable key endpoint answers 503 and the next request verifies again."""
+        with patch('main.verify_id_token', side_effect=jwt.PyJWKClientConnectionError("timed out")) as mock_verify:
+            first = client.get("/whoami", headers=auth_headers)
+            second = client.get("/whoami", headers=auth_headers)
+        
+        assert first.status_code == second.status_code == 503
+        assert mock_verify.call_count == 2
 
 
 class TestErrorHandling:
@@ -16,6 +16,8 @@ import asyncio
 from unittest.mock import patch, Mock, AsyncMock
 from fastapi.responses import StreamingResponse
 
+import llm_integration
+
 from llm_integration import (
     format_llm_messages,
     format_profile_for_llm,
@@ -25,10 +27,20 @@ from llm_integration import (
     handle_profile_updates_background,
     log_profile_update,
     chat_with_streaming_profile_update,
-    simple_streaming_chat
+    simple_streaming_chat,
+    StreamBuffer,
+    SemanticCache,
+    ProfileUpdateBatcher,
+    UpdatesScanner
 )
 
 
+async def _aiter(items):
+    """Async iterator over items, standing in for an AsyncOpenAI stream."""
+    for item in items:
+        yield item
+
+
 class TestMessageFormatting:
     """Test LLM message formatting."""
     
@@ -134,6 +146,25 @@ class TestMessageFormatting:
         assert "English" in formatted  # Default language preference
         # Should handle empty values gracefully
     
+    def test_format_profile_for_llm_none_and_missing_fields(self):
+        """Test None and missing fields stored through the API render as empty."""
+        from profile_card import ProfileCard
+        
+        profile = Mock(spec=ProfileCard)
+        profile.sections = {
+            'demographics': {'name': None, 'age': {'value': None}},
+            'interests': None,
+            'preferences': {'favorite_animals': None, 'favorite_foods': {'pizza': {}}},
+            'communication': {'style': {}},
+        }
+        
+        formatted = format_profile_for_llm(profile)
+        
+        assert "Name: , Age: \nLocation: \n" in formatted
+        assert "- Favorite animals: \n- Favorite foods: pizza\n" in formatted
+        assert "Communication Style: \n" in formatted
+    
+    @patch('llm_integration.get_embedding', new=Mock(return_value=[0.0] * 4))
     @patch('llm_integration.search_user_episodes')
     @patch('llm_integration.get_user_recent_episodes')
     def test_get_episode_context_with_relevant_episodes(self, mock_get_recent, mock_search):
@@ -158,6 +189,7 @@ class TestMessageFormatting:
         assert "Round 1" in context
         mock_search.assert_called_once_with("test_user", "Tell me about dinosaurs", limit=3)
     
+    @patch('llm_integration.get_embedding', new=Mock(return_value=[0.0] * 4))
     @patch('llm_integration.search_user_episodes')
     @patch('llm_integration.get_user_recent_episodes')
     def test_get_episode_context_fallback_to_recent(self, mock_get_recent, mock_search):
@@ -183,6 +215,7 @@ class TestMessageFormatting:
         mock_search.assert_called_once()
         mock_get_recent.assert_called_once_with("test_user", limit=3)
     
+    @patch('llm_integration.get_embedding', new=Mock(return_value=[0.0] * 4))
     @patch('llm_integration.search_user_episodes')
     @patch('llm_integration.get_user_recent_episodes')
     def test_get_episode_context_no_episodes(self, mock_get_recent, mock_search):
@@ -196,6 +229,7 @@ class TestMessageFormatting:
         mock_search.assert_called_once()
         mock_get_recent.assert_called_once()
     
+    @patch('llm_integration.get_embedding', new=Mock(return_value=[0.0] * 4))
     @patch('llm_integration.search_user_episodes')
     def test_get_episode_context_error(self, mock_search):
         """Test episode context error handling."""
@@ -205,6 +239,24 @@ class TestMessageFormatting:
         
         assert context == ""
     
+    @patch('llm_integration.get_embedding', new=Mock(return_value=[1.0, 0.0]))
+    @patch('llm_integration.search_user_episodes')
+    def test_get_episode_context_semantic_cache(self, mock_search):
+        """Test a repeated query is served from the semantic cache until invalidated."""
+        from llm_integration import _episode_context_cache
+        _episode_context_cache.invalidate("cache_user")
+        mock_search.return_value = [
+            {"user_message": "I love dinosaurs", "ai_response": "Roar!", "round_number": 1}
+        ]
+        
+        first = get_episode_context("cache_user", "Tell me about dinosaurs")
+        second = get_episode_context("cache_user", "Tell me about dinosaurs!")
+        _episode_context_cache.invalidate("cache_user")
+        get_episode_context("cache_user", "Tell me about dinosaurs")
+        
+        assert first == second
+        assert mock_search.call_count == 2
+    
     def test_format_llm_messages(self):
         """Test formatting messages for LLM."""
         from profile_card import ProfileCard
@@ -245,6 +297,19 @@ class TestMessageFormatting:
             assert messages[2]["content"] == "Previous response"
             assert messages[3]["role"] == "user"
             assert messages[3]["content"] == "Hello world"
+    
+    def test_format_llm_messages_estimates_input_tokens(self):
+        """Test the prompt token estimate is accumulated while messages are built."""
+        from profile_card import ProfileCard
+        
+        with patch('llm_integration.format_profile_for_llm', return_value="Profile"), \
+             patch('llm_integration.get_episode_context', return_value=""), \
+             patch('llm_integration.get_last_messages', return_value=[{"role": "user", "content": "one two"}]):
+            
+            stats = {}
+            messages = format_llm_messages("test_user", "three four five", Mock(spec=ProfileCard), stats=stats)
+            
+            assert stats["input_tokens"] == sum(len(m["content"]) for m in messages) // 4
 
 
 class TestFunctionCalling:
@@ -303,21 +368,24 @@ class TestStreamingResponse:
         mock_response1.choices = [Mock()]
         mock_response1.choices[0].delta = Mock()
         mock_response1.choices[0].delta.content = "Hello"
+        mock_response1.choices[0].delta.function_call = None
         mock_response1.choices[0].finish_reason = None
         
         mock_response2 = Mock()
         mock_response2.choices = [Mock()]
         mock_response2.choices[0].delta = Mock()
         mock_response2.choices[0].delta.content = " there!"
+        mock_response2.choices[0].delta.function_call = None
         mock_response2.choices[0].finish_reason = None
         
         mock_response3 = Mock()
         mock_response3.choices = [Mock()]
         mock_response3.choices[0].delta = Mock()
-        mock_response3.choices[0].delta = None
+        mock_response3.choices[0].delta.content = None
+        mock_response3.choices[0].delta.function_call = None
         mock_response3.choices[0].finish_reason = "stop"
         
-        mock_client.chat.completions.create.return_value = iter([mock_response1, mock_response2, mock_response3])
+        mock_client.chat.completions.create = AsyncMock(return_value=_aiter([mock_response1, mock_response2, mock_response3]))
         
         messages = [{"role": "user", "content": "Hello"}]
         
@@ -329,7 +397,7 @@ class TestStreamingResponse:
         assert chunks[0][0] == "Hello"
         assert chunks[1][0] == " there!"
         assert chunks[2][0] == ""  # Final chunk
-        assert chunks[2][1] == '{"updates": []}'  # No profile updates
+        assert json.loads(chunks[2][1]) == {"updates": []}  # No profile updates
     
     @patch('llm_integration._client')
     @pytest.mark.asyncio
@@ -340,6 +408,7 @@ class TestStreamingResponse:
         mock_response1.choices = [Mock()]
         mock_response1.choices[0].delta = Mock()
         mock_response1.choices[0].delta.content = "Thanks for sharing!"
+        mock_response1.choices[0].delta.function_call = None
         mock_response1.choices[0].finish_reason = None
         
         mock_response2 = Mock()
@@ -350,7 +419,7 @@ class TestStreamingResponse:
         mock_response2.choices[0].delta.function_call.arguments = '{"updates": [{"section": "demographics", "field": "name", "value": "Alex", "confidence": 0.95, "reason": "User stated name"}]}'
         mock_response2.choices[0].finish_reason = "function_call"
         
-        mock_client.chat.completions.create.return_value = iter([mock_response1, mock_response2])
+        mock_client.chat.completions.create = AsyncMock(return_value=_aiter([mock_response1, mock_response2]))
         
         messages = [{"role": "user", "content": "My name is Alex"}]
         
@@ -361,13 +430,13 @@ class TestStreamingResponse:
         assert len(chunks) == 2
         assert chunks[0][0] == "Thanks for sharing!"
         assert chunks[1][0] == ""  # Final chunk
-        assert chunks[1][1] == '{"updates": [{"section": "demographics", "field": "name", "value": "Alex", "confidence": 0.95, "reason": "User stated name"}]}'
+        assert json.loads(chunks[1][1]) == {"updates": [{"section": "demographics", "field": "name", "value": "Alex", "confidence": 0.95, "reason": "User stated name"}]}
     
     @patch('llm_integration._client')
     @pytest.mark.asyncio
     async def test_stream_llm_response_error(self, mock_client):
         """Test streaming response error handling."""
-        mock_client.chat.completions.create.side_effect = Exception("API error")
+        mock_client.chat.completions.create = AsyncMock(side_effect=Exception("API error"))
         
         messages = [{"role": "user", "content": "Hello"}]
         
@@ -379,6 +448,56 @@ class TestStreamingResponse:
         assert "error processing your request" in chunks[0][0]
         assert chunks[0][1] == '{"updates": []}'
 
+    
+    def test_stream_buffer_coalesces_until_size(self):
+        """Test StreamBuffer holds chunks until the byte threshold trips."""
+        buffer = StreamBuffer(max_bytes=10, flush_interval_ms=60_000)
+        
+        assert buffer.add("Hello") is None
+        assert buffer.add(" there") == "Hello there"
+        assert buffer.add("!") is None
+        assert buffer.flush() == "!"
+        assert buffer.flush() == ""
+    
+    def test_stream_buffer_flushes_after_interval(self):
+        """Test StreamBuffer releases text once the interval has passed."""
+        buffer = StreamBuffer(max_bytes=8192, flush_interval_ms=0)
+        
+        assert buffer.add("Hi") == "Hi"
+
+
+class TestSemanticCache:
+    """Test the per-user semantic cache for episode context."""
+    
+    def test_hit_requires_similarity_threshold(self):
+        """Test only sufficiently similar queries hit."""
+        cache = SemanticCache(threshold=0.9)
+        cache.put("user_1", [1.0, 0.0], "dinosaur context")
+        
+        assert cache.get("user_1", [0.99, 0.05]) == "dinosaur context"
+        assert cache.get("user_1", [0.0, 1.0]) is None
+    
+    def test_entries_are_per_user(self):
+        """Test one user's context is never served to another."""
+        cache = SemanticCache()
+        cache.put("user_1", [1.0, 0.0], "user 1 context")
+        
+        assert cache.get("user_2", [1.0, 0.0]) is None
+    
+    def test_entries_expire(self):
+        """Test entries are ignored after their TTL."""
+        cache = SemanticCache(ttl=0.0)
+        cache.put("user_1", [1.0, 0.0], "stale")
+        
+        assert cache.get("user_1", [1.0, 0.0]) is None
+    
+    def test_zero_embeddings_are_not_cached(self):
+        """Test zero vectors (embeddings unavailable) never hit."""
+        cache = SemanticCache()
+        cache.put("user_1", [0.0, 0.0], "context")
+        
+        assert cache.get("user_1", [0.0, 0.0]) is None
+
 
 class TestBackgroundProfileProcessing:
     """Test background profile processing."""
@@ -406,7 +525,8 @@ class TestBackgroundProfileProcessing:
             ]
         }
         
-        with patch('llm_integration.validate_updates') as mock_validate, \
+        with patch('llm_integration.get_profile_card', return_value=profile), \
+             patch('llm_integration.validate_updates') as mock_validate, \
              patch('llm_integration.update_profile_with_confidence') as mock_update, \
              patch('llm_integration.save_profile_card') as mock_save, \
              patch('llm_integration.log_profile_update') as mock_log:
@@ -415,7 +535,7 @@ class TestBackgroundProfileProcessing:
             mock_update.return_value = profile
             mock_save.return_value = True
             
-            await handle_profile_updates_background("test_user", profile_updates, profile)
+            await handle_profile_updates_background("test_user", profile_updates)
             
             mock_validate.assert_called_once_with(profile_updates["updates"], profile)
             mock_update.assert_called_once_with(profile, profile_updates["updates"])
@@ -425,12 +545,10 @@ class TestBackgroundProfileProcessing:
     @pytest.mark.asyncio
     async def test_handle_profile_updates_background_invalid_structure(self):
         """Test background processing with invalid structure."""
-        profile = Mock()
-        
         invalid_updates = {"invalid": "structure"}
         
         with patch('llm_integration.validate_updates') as mock_validate:
-            await handle_profile_updates_background("test_user", invalid_updates, profile)
+            await handle_profile_updates_background("test_user", invalid_updates)
             
             # Should not call validate_updates for invalid structure
             mock_validate.assert_not_called()
@@ -452,10 +570,11 @@ class TestBackgroundProfileProcessing:
             ]
         }
         
-        with patch('llm_integration.validate_updates') as mock_validate:
+        with patch('llm_integration.get_profile_card', return_value=profile), \
+             patch('llm_integration.validate_updates') as mock_validate:
             mock_validate.return_value = []  # No valid updates
             
-            await handle_profile_updates_background("test_user", profile_updates, profile)
+            await handle_profile_updates_background("test_user", profile_updates)
             
             mock_validate.assert_called_once()
     
@@ -476,9 +595,10 @@ class TestBackgroundProfileProcessing:
             ]
         }
         
-        with patch('llm_integration.validate_updates', side_effect=Exception("Validation error")):
+        with patch('llm_integration.get_profile_card', return_value=profile), \
+             patch('llm_integration.validate_updates', side_effect=Exception("Validation error")):
             # Should not raise exception
-            await handle_profile_updates_background("test_user", profile_updates, profile)
+            await handle_profile_updates_background("test_user", profile_updates)
     
     def test_log_profile_update(self):
         """Test profile update logging."""
@@ -506,6 +626,76 @@ class TestBackgroundProfileProcessing:
             )
 
 
+class TestUpdatesScanner:
+    """Test incremental parsing of function call arguments."""
+    
+    def test_updates_parsed_across_arbitrary_chunk_boundaries(self):
+        """Test every split point yields the same updates as a full parse."""
+        updates = [
+            {"section": "demographics", "field": "name", "value": "Al {\"x\"} [y]", "confidence": 0.9, "reason": "a\\"},
+            {"section": "preferences", "field": "favorite_foods", "value": {"pizza": []}, "confidence": 0.8, "reason": "b"},
+        ]
+        text = json.dumps({"updates": updates})
+        
+        for split in range(len(text) + 1):
+            scanner = UpdatesScanner()
+            parsed = scanner.feed(text[:split]) + scanner.feed(text[split:])
+            assert parsed == updates
+            assert scanner.errors == 0
+    
+    def test_update_returned_when_its_object_closes(self):
+        """Test an update is emitted before the rest of the arguments arrive."""
+        scanner = UpdatesScanner()
+        
+        assert scanner.feed('{"updates": [{"section": "context"}, {"sec') == [{"section": "context"}]
+        assert scanner.feed('tion": "goals"}]}') == [{"section": "goals"}]
+    
+    def test_malformed_update_skipped(self):
+        """Test an object that is not valid JSON is counted and skipped."""
+        scanner = UpdatesScanner()
+        
+        assert scanner.feed('{"updates": [{"section": bad}, {"section": "goals"}]}') == [{"section": "goals"}]
+        assert scanner.errors == 1
+
+
+class TestProfileUpdateBatcher:
+    """Test coalescing of profile updates."""
+    
+    @pytest.mark.asyncio
+    async def test_concurrent_updates_share_one_write_per_user(self):
+        """Test updates submitted in the same window are validated and saved once per user."""
+        batcher = ProfileUpdateBatcher(max_batch=32, max_delay_ms=20)
+        first = {"section": "demographics", "field": "name", "value": "Alex"}
+        second = {"section": "preferences", "field": "favorite_colors", "value": "green"}
+        
+        with patch('llm_integration.get_profile_card') as mock_get_profile, \
+             patch('llm_integration.validate_updates', side_effect=lambda updates, card: updates) as mock_validate, \
+             patch('llm_integration.update_profile_with_confidence') as mock_update, \
+             patch('llm_integration.save_profile_card') as mock_save, \
+             patch('llm_integration.log_profile_update'):
+            
+            await asyncio.gather(
+                batcher.submit("user_a", [first]),
+                batcher.submit("user_a", [second]),
+                batcher.submit("user_b", [first]),
+            )
+            
+            assert mock_save.call_count == 2
+            mock_get_profile.assert_any_call("user_a", use_cache=False)
+            merged = [c.args[0] for c in mock_validate.call_args_list if c.args[0] != [first]]
+            assert merged == [[first, second]]
+            mock_update.assert_any_call(mock_get_profile.return_value, [first, second])
+    
+    @pytest.mark.asyncio
+    async def test_failed_write_propagates_to_submitter(self):
+        """Test a persistence error is raised from submit."""
+        batcher = ProfileUpdateBatcher(max_delay_ms=1)
+        
+        with patch('llm_integration.get_profile_card', side_effect=Exception("Firestore down")):
+            with pytest.raises(Exception, match="Firestore down"):
+                await batcher.submit("user_a", [{"section": "demographics"}])
+
+
 class TestMainChatFunctionality:
     """Test main chat functionality."""
     
@@ -514,8 +704,10 @@ class TestMainChatFunctionality:
         """Test successful chat with streaming and profile update."""
         with patch('llm_integration.get_profile_card') as mock_get_profile, \
              patch('llm_integration.format_llm_messages') as mock_format_messages, \
+             patch('llm_integration.start_context_lookups') as mock_lookups, \
              patch('llm_integration.stream_llm_response') as mock_stream, \
-             patch('llm_integration.log_message') as mock_log_message, \
+             patch('llm_integration.log_messages_batch') as mock_log_turn, \
+             patch('llm_integration.allocate_round_number', return_value=1), \
              patch('llm_integration.store_conversation_round') as mock_store_episode, \
              patch('llm_integration.handle_profile_updates_background') as mock_handle_updates, \
              patch('llm_integration.metrics') as mock_metrics, \
@@ -544,11 +736,19 @@ class TestMainChatFunctionality:
             
             assert isinstance(response, StreamingResponse)
             assert response.media_type == "text/event-stream"
+            assert response.headers["x-accel-buffering"] == "no"
+            [frame async for frame in response.body_iterator]
+            await asyncio.gather(*llm_integration._BG_TASKS)
             
             # Verify calls
             mock_get_profile.assert_called_once_with("test_user")
-            mock_format_messages.assert_called_once_with("test_user", "Hello", mock_profile)
-            mock_log_message.assert_called_once_with("test_user", "user", "Hello")
+            mock_lookups.assert_called_once_with("test_user", "Hello")
+            mock_format_messages.assert_called_once_with(
+                "test_user", "Hello", mock_profile,
+                lookups=mock_lookups.return_value, stats={})
+            [(uid, turn)] = [c.args for c in mock_log_turn.call_args_list]
+            assert uid == "test_user"
+            assert [(m["role"], m["content"]) for m in turn] == [("user", "Hello"), ("assistant", "Hello there!")]
             mock_store_episode.assert_called_once()
             mock_handle_updates.assert_called_once()
             mock_metrics.record_openai_metrics.assert_called_once()
@@ -556,7 +756,8 @@ class TestMainChatFunctionality:
     @pytest.mark.asyncio
     async def test_chat_with_streaming_profile_update_error(self):
         """Test chat error handling."""
-        with patch('llm_integration.get_profile_card', side_effect=Exception("Profile error")), \
+        with patch('llm_integration.start_context_lookups'), \
+             patch('llm_integration.get_profile_card', side_effect=Exception("Profile error")), \
              patch('llm_integration.log_request') as mock_log_request:
             
             response = await chat_with_streaming_profile_update("test_user", "Hello")
@@ -564,6 +765,41 @@ class TestMainChatFunctionality:
             assert isinstance(response, StreamingResponse)
             mock_log_request.assert_called()
     
+    @pytest.mark.asyncio
+    async def test_chat_stream_does_not_wait_for_background_work(self):
+        """Test the stream closes before episode storage and profile updates finish."""
+        release = asyncio.Event()
+        
+        async def slow_updates(*args):
+            await release.wait()
+        
+        async def mock_stream_gen():
+            yield ("Hi!", "", "")
+            yield ("", '{"updates": [{"section": "demographics", "field": "name", "value": "Alex"}]}', "")
+        
+        with patch('llm_integration.start_context_lookups'), \
+             patch('llm_integration.get_profile_card'), \
+             patch('llm_integration.format_llm_messages', return_value=[]), \
+             patch('llm_integration.stream_llm_response', return_value=mock_stream_gen()), \
+             patch('llm_integration.log_messages_batch'), \
+             patch('llm_integration.allocate_round_number', return_value=1), \
+             patch('llm_integration.store_conversation_round', return_value="ep_1") as mock_store_episode, \
+             patch('llm_integration.handle_profile_updates_background', side_effect=slow_updates), \
+             patch('llm_integration.metrics'), \
+             patch('llm_integration.log_request'):
+            
+            response = await chat_with_streaming_profile_update("test_user", "Hello")
+            frames = [frame async for frame in response.body_iterator]
+            
+            assert frames[-1].startswith(b'data:{"done":true')
+            pending = set(llm_integration._BG_TASKS)
+            assert pending
+            
+            release.set()
+            await asyncio.gather(*pending)
+            mock_store_episode.assert_called_once()
+            assert not llm_integration._BG_TASKS
+    
     @pytest.mark.asyncio
     async def test_simple_streaming_chat(self):
         """Test simple streaming chat fallback."""
@@ -591,7 +827,7 @@ class TestErrorHandling:
             mock_response.choices[0].delta.function_call.arguments = '{"invalid": json}'  # Malformed JSON
             mock_response.choices[0].finish_reason = "function_call"
             
-            mock_client.chat.completions.create.return_value = iter([mock_response])
+            mock_client.chat.completions.create = AsyncMock(return_value=_aiter([mock_response]))
             
             messages = [{"role": "user", "content": "Hello"}]
             
@@ -600,7 +836,7 @@ class TestErrorHandling:
                 chunks.append((chunk, profile_updates_json, raw_chunk))
             
             assert len(chunks) == 1
-            assert chunks[0][1] == '{"updates": []}'  # Should fallback to empty updates
+            assert json.loads(chunks[0][1]) == {"updates": []}  # Should fallback to empty updates
     
     @pytest.mark.asyncio
     async def test_handle_profile_updates_background_validation_error(self):
@@ -619,10 +855,11 @@ class TestErrorHandling:
             ]
         }
         
-        with patch('llm_integration.validate_updates') as mock_validate:
+        with patch('llm_integration.get_profile_card', return_value=profile), \
+             patch('llm_integration.validate_updates') as mock_validate:
             mock_validate.return_value = []  # No valid updates after validation
             
-            await handle_profile_updates_background("test_user", profile_updates, profile)
+            await handle_profile_updates_background("test_user", profile_updates)
             
             mock_validate.assert_called_once()
     
@@ -644,7 +881,8 @@ class TestErrorHandling:
             ]
         }
         
-        with patch('llm_integration.validate_updates') as mock_validate, \
+        with patch('llm_integration.get_profile_card', return_value=profile), \
+             patch('llm_integration.validate_updates') as mock_validate, \
              patch('llm_integration.update_profile_with_confidence') as mock_update, \
              patch('llm_integration.save_profile_card') as mock_save, \
              patch('llm_integration.log_request') as mock_log_request:
@@ -654,6 +892,6 @@ class TestErrorHandling:
             mock_save.side_effect = Exception("Save error")
             
             # Should not raise exception
-            await handle_profile_updates_background("test_user", profile_updates, profile)
+            await handle_profile_updates_background("test_user", profile_updates)
             
             mock_log_request.assert_called()
@@ -0,0 +1,60 @@
+"""
+Unit tests for structured logging configuration.
+
+This module tests:
+- The root logger only enqueues records
+- Queued records are written as JSON with extra and exception fields
+"""
+
+import io
+import logging
+import logging.handlers
+
+import pytest
+from unittest.mock import patch
+
+import logging_config
+from _serde import loads
+from logging_config import setup_logging, log_request
+
+
+@pytest.fixture
+def stdout():
+    """Configure logging against a captured stdout and restore the root handlers afterwards."""
+    root = logging.getLogger()
+    saved_handlers, saved_level = root.handlers[:], root.level
+    buffer = io.StringIO()
+    with patch('logging_config.sys.stdout', buffer):
+        setup_logging()
+    yield buffer
+    logging_config._stop_queue_listener()
+    root.handlers[:] = saved_handlers
+    root.setLevel(saved_level)
+
+
+class TestQueuedLogging:
+    """Test records are written by the listener thread."""
+
+    def test_root_handler_is_queue(self, stdout):
+        """Test the root logger enqueues and only the listener writes to stdout."""
+        queued = [h for h in logging.getLogger().handlers if isinstance(h, logging.handlers.QueueHandler)]
+
+        assert len(queued) == 1
+        assert queued[0].queue is logging_config._queue_listener.queue
+        assert [h.stream for h in logging_config._queue_listener.handlers] == [stdout]
+
+    def test_log_request_written_as_json(self, stdout):
+        """Test a request log reaches stdout with its structured fields."""
+        try:
+            raise RuntimeError("boom")
+        except RuntimeError:
+            logging.getLogger("memo_bot.test").exception("failed %s", "chat")
+        log_request("error", "Chat error", user_id="user_1", endpoint="/api/chat")
+        logging_config._stop_queue_listener()
+
+        first, second = [loads(line) for line in stdout.getvalue().splitlines()]
+        assert first["message"] == "failed chat"
+        assert "RuntimeError: boom" in first["exception"]
+        assert second["message"] == "Chat error"
+        assert second["user_id"] == "user_1"
+        assert second["endpoint"] == "/api/chat"
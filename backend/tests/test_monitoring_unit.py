@@ -0,0 +1,84 @@
+"""
+Unit tests for Cloud Monitoring metrics.
+
+This module tests:
+- Queued points are written in one batched call
+- Repeated points for a series collapse to the latest
+- Metric descriptors are created once per process
+- Metrics failures are logged, never raised
+"""
+
+import pytest
+from unittest.mock import patch
+
+from monitoring import MemoBotMetrics
+
+
+@pytest.fixture
+def metrics():
+    """Metrics recorder with a mocked Cloud Monitoring client; series are built as plain dicts."""
+    with patch('monitoring.monitoring_v3'), \
+         patch('monitoring.TimeSeries', side_effect=lambda **kwargs: kwargs), \
+         patch('monitoring.Point', side_effect=lambda point: point):
+        yield MemoBotMetrics()
+
+
+class TestBatchedWrites:
+    """Test points are queued and flushed in batches."""
+    
+    def test_record_does_not_call_api(self, metrics):
+        """Test recording only queues points."""
+        metrics.record_openai_metrics("user_1", "/api/chat", "gpt", 10, 20, 150.0, 0.0, True)
+        
+        metrics.client.create_time_series.assert_not_called()
+        metrics.client.create_metric_descriptor.assert_not_called()
+    
+    def test_flush_writes_one_batch(self, metrics):
+        """Test a flush sends every series in a single call, keeping the latest point per series."""
+        metrics.record_openai_metrics("user_1", "/api/chat", "gpt", 10, 20, 150.0, 0.0, True)
+        metrics.record_openai_metrics("user_1", "/api/chat", "gpt", 11, 21, 160.0, 0.0, True)
+        metrics.record_openai_metrics("user_2", "/api/chat", "gpt", 12, 22, 170.0, 0.0, False)
+        
+        metrics.flush()
+        
+        assert metrics.client.create_time_series.call_count == 1
+        series = metrics.client.create_time_series.call_args.kwargs["time_series"]
+        assert len(series) == 10
+        latencies = [s["points"][0]["value"]["double_value"] for s in series
+                     if s["metric"]["type"].endswith("openai_latency_ms")]
+        assert sorted(latencies) == [160.0, 170.0]
+    
+    def test_descriptors_created_once(self, metrics):
+        """Test descriptors are created on the first flush only."""
+        metrics.record_rate_limit_metrics("user_1", "/api/chat", True, 0)
+        metrics.flush()
+        metrics.record_rate_limit_metrics("user_1", "/api/chat", True, 0)
+        metrics.flush()
+        
+        assert metrics.client.create_metric_descriptor.call_count == 2
+        assert metrics.client.create_time_series.call_count == 2
+    
+    def test_flush_without_points_is_noop(self, metrics):
+        """Test an empty flush makes no API calls."""
+        metrics.flush()
+        
+        metrics.client.create_time_series.assert_not_called()
+    
+    def test_bad_point_does_not_drop_batch(self, metrics):
+        """Test a point that fails to build is skipped and the rest are still written."""
+        metrics.record_rate_limit_metrics("user_1", "/api/chat", True, 0)
+        
+        with patch('monitoring.TimeSeries', side_effect=[ValueError("bad point"), {"ok": True}]):
+            metrics.flush()
+        
+        assert metrics.client.create_time_series.call_args.kwargs["time_series"] == [{"ok": True}]
+        assert metrics._pending == {}
+    
+    def test_record_errors_are_logged(self, metrics):
+        """Test a failure while recording does not reach the request."""
+        with patch.object(metrics, '_enqueue', side_effect=RuntimeError("boom")), \
+             patch('monitoring.logger') as mock_logger:
+            metrics.record_openai_metrics("user_1", "/api/chat", "gpt", 10, 20, 150.0, 0.0, True)
+            metrics.record_rate_limit_metrics("user_1", "/api/chat", True, 0)
+        
+        assert mock_logger.error.call_count == 2
@@ -25,7 +25,7 @@ class TestMultiUserRateLimiting:
             else:
                 raise Exception("Invalid token")
         
-        with patch('main.fb_auth.verify_id_token', side_effect=mock_verify_id_token):
+        with patch('main.verify_id_token', side_effect=mock_verify_id_token):
             # User 1 hits rate limit (5 requests)
             for i in range(5):
                 response = client.get("/test-rate-limit", headers=user1_headers)
@@ -58,7 +58,7 @@ class TestMultiUserRateLimiting:
             return "192.168.1.1"
         
         with patch('rate_limiter.get_remote_address', side_effect=mock_get_remote_address), \
-             patch('main.fb_auth.verify_id_token', return_value={"uid": "same-user"}):
+             patch('main.verify_id_token', return_value={"uid": "same-user"}):
             
             # Same user from IP 1
             headers_ip1 = {
@@ -136,7 +136,7 @@ class TestMultiUserDataIsolation:
             else:
                 raise Exception("Invalid token")
         
-        with patch('main.fb_auth.verify_id_token', side_effect=mock_verify_id_token), \
+        with patch('main.verify_id_token', side_effect=mock_verify_id_token), \
              patch('main.add_memory') as mock_add, \
              patch('main.get_top_facts') as mock_get:
             
@@ -170,26 +170,33 @@ class TestMultiUserDataIsolation:
             else:
                 raise Exception("Invalid token")
         
-        with patch('main.fb_auth.verify_id_token', side_effect=mock_verify_id_token), \
-             patch('main.log_message') as mock_log, \
+        with patch('main.verify_id_token', side_effect=mock_verify_id_token), \
+             patch('llm_integration.log_messages_batch') as mock_batch, \
+             patch('llm_integration.log_message') as mock_log, \
              patch('main.get_last_messages') as mock_get:
             
+            def logged_user_messages():
+                # The turn is batched on success; failed streams log the user message alone
+                logged = [(c.args[0], c.args[1][0]["content"]) for c in mock_batch.call_args_list]
+                logged += [(c.args[0], c.args[2]) for c in mock_log.call_args_list]
+                return logged
+            
             # User 1 sends chat message
             chat_data = {"message": "Hello from user 1"}
             response = client.post("/api/chat", json=chat_data, headers=user1_headers)
             assert response.status_code == 200
             
-            # Verify log_message was called with user-1 UID
-            mock_log.assert_called_with("user-1", "user", "Hello from user 1")
+            # Verify the message was logged with user-1 UID
+            assert logged_user_messages() == [("user-1", "Hello from user 1")]
             
             # User 2 sends different chat message
             chat_data2 = {"message": "Hello from user 2"}
             response = client.post("/api/chat", json=chat_data2, headers=user2_headers)
             assert response.status_code == 200
             
-            # Verify log_message was called with user-2 UID
-            assert mock_log.call_count == 2
-            mock_log.assert_called_with("user-2", "user", "Hello from user 2")
+            # Verify the message was logged with user-2 UID
+            assert ("user-2", "Hello from user 2") in logged_user_messages()
+            assert len(logged_user_messages()) == 2
 
 
 class TestMultiUserEndpoints:
@@ -208,7 +215,7 @@ class TestMultiUserEndpoints:
             else:
                 raise Exception("Invalid token")
         
-        with patch('main.fb_auth.verify_id_token', side_effect=mock_verify_id_token), \
+        with patch('main.verify_id_token', side_effect=mock_verify_id_token), \
              patch('main.add_memory', return_value={"id": "test"}), \
              patch('main.get_top_facts', return_value=[]), \
              patch('main.log_message', return_value="test"), \
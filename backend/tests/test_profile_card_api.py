@@ -101,7 +101,7 @@ class TestProfileCardAPI:
             data = response.json()
             assert data["ok"] is True
             assert "profile" in data
-            mock_get_profile.assert_called_once_with("test-user-123")
+            mock_get_profile.assert_called_once_with("test-user-123", use_cache=False)
             mock_save_profile.assert_called_once()
     
     def test_update_profile_card_save_failure(self, client, mock_firebase_auth, auth_headers):
@@ -179,7 +179,6 @@ class TestProfileCardAPI:
     def test_get_profile_stats_success(self, client, mock_firebase_auth, auth_headers):
         """Test successful profile statistics retrieval."""
         with patch('main.get_profile_card') as mock_get_profile, \
-             patch('profile_card.count_total_facts') as mock_count_facts, \
              patch('profile_card.calculate_tokens') as mock_calculate_tokens:
             
             # Mock profile data - use real ProfileCard structure
@@ -195,7 +194,6 @@ class TestProfileCardAPI:
                 metadata={'updated_at': 1234567890}
             )
             mock_get_profile.return_value = mock_profile
-            mock_count_facts.return_value = 3
             mock_calculate_tokens.return_value = 150
             
             response = client.get("/api/profile-card/stats", headers=auth_headers)
@@ -215,7 +213,6 @@ class TestProfileCardAPI:
             assert stats["sections"]["preferences"] == 1
             
             mock_get_profile.assert_called_once_with("test-user-123")
-            mock_count_facts.assert_called_once_with(mock_profile)
             mock_calculate_tokens.assert_called_once_with(mock_profile)
     
     def test_get_profile_stats_error(self, client, mock_firebase_auth, auth_headers):
@@ -297,7 +294,7 @@ class TestProfileCardAPIAuthentication:
         """Test profile card endpoints with invalid token."""
         invalid_headers = {"Authorization": "Bearer invalid-token"}
         
-        with patch('main.fb_auth.verify_id_token', side_effect=Exception("Invalid token")):
+        with patch('main.verify_id_token', side_effect=Exception("Invalid token")):
             response = client.get("/api/profile-card", headers=invalid_headers)
             assert response.status_code == 401
             assert "Invalid ID token" in response.json()["detail"]
@@ -362,3 +359,30 @@ class TestProfileCardAPIValidation:
             # Should still work, but limit will be handled by the function
             assert response.status_code == 200
             mock_get_history.assert_called_once_with("test-user-123", -1)
+
+
+class TestProfileCardAPICORS:
+    """Test cross-origin preflight handling."""
+    
+    def test_preflight_is_cacheable(self, client):
+        """Test preflights list concrete methods and headers and are cached for a day."""
+        response = client.options("/api/profile-card", headers={
+            "Origin": "http://localhost:5173",
+            "Access-Control-Request-Method": "GET",
+            "Access-Control-Request-Headers": "authorization",
+        })
+        
+        assert response.status_code == 200
+        assert response.headers["access-control-allow-origin"] == "http://localhost:5173"
+        assert response.headers["access-control-max-age"] == "86400"
+        assert "Authorization" in response.headers["access-control-allow-headers"]
+    
+    def test_preflight_rejects_unlisted_header(self, client):
+        """Test a preflight asking for a header outside the allow-list is refused."""
+        response = client.options("/api/profile-card", headers={
+            "Origin": "http://localhost:5173",
+            "Access-Control-Request-Method": "GET",
+            "Access-Control-Request-Headers": "x-custom",
+        })
+        
+        assert response.status_code == 400
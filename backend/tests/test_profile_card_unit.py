@@ -27,6 +27,7 @@ from profile_card import (
     count_total_facts,
     format_profile_for_llm,
     calculate_tokens,
+    profile_stats,
     save_profile_version,
     get_profile_history
 )
@@ -134,6 +135,21 @@ class TestProfileCardOperations:
         count = count_total_facts(profile)
         assert count == 5  # 2 demographics + 2 animals + 1 default language preference
     
+    def test_profile_stats_matches_separate_counts(self):
+        """Test the single-pass stats agree with count_total_facts and calculate_tokens."""
+        profile = create_default_profile_card("test_user")
+        profile.sections["demographics"]["name"]["value"] = "Alex"
+        profile.sections["preferences"]["favorite_animals"]["triceratops"] = {
+            "confidence": 0.95, "count": 3, "reasons": []
+        }
+        
+        stats = profile_stats(profile)
+        
+        assert stats["total_facts"] == count_total_facts(profile)
+        assert stats["tokens"] == calculate_tokens(profile)
+        assert stats["sections"] == {name: len(data) for name, data in profile.sections.items()}
+        assert stats["version"] == profile.version
+    
     def test_format_profile_for_llm(self):
         """Test formatting profile for LLM context."""
         profile = create_default_profile_card("test_user")
@@ -492,6 +508,45 @@ class TestProfileCardPersistence:
             assert profile.version == 1
             mock_save.assert_called_once()
     
+    @patch('profile_card._get_profile_ref')
+    def test_get_profile_card_cached(self, mock_get_ref):
+        """Test repeated reads hit Firestore once and return independent copies."""
+        mock_doc = Mock(exists=True)
+        mock_doc.to_dict.return_value = asdict(create_default_profile_card("test_user"))
+        mock_get_ref.return_value.get.return_value = mock_doc
+        
+        first = get_profile_card("test_user")
+        first.sections["demographics"]["name"]["value"] = "Alex"
+        second = get_profile_card("test_user")
+        
+        assert mock_get_ref.return_value.get.call_count == 1
+        assert second.sections["demographics"]["name"]["value"] == ""
+    
+    @patch('profile_card._get_profile_ref')
+    def test_save_profile_card_writes_through_cache(self, mock_get_ref):
+        """Test a saved profile card is served from the cache without a re-read."""
+        profile = create_default_profile_card("test_user")
+        profile.version = 3
+        
+        with patch('profile_card.save_profile_version'):
+            assert save_profile_card("test_user", profile) is True
+        cached = get_profile_card("test_user")
+        
+        assert cached.version == 3
+        mock_get_ref.return_value.get.assert_not_called()
+    
+    @patch('profile_card._get_profile_ref')
+    def test_get_profile_card_bypasses_cache_for_writes(self, mock_get_ref):
+        """Test use_cache=False reads Firestore even when the card is cached."""
+        mock_doc = Mock(exists=True)
+        mock_doc.to_dict.return_value = asdict(create_default_profile_card("test_user"))
+        mock_get_ref.return_value.get.return_value = mock_doc
+        
+        get_profile_card("test_user")
+        get_profile_card("test_user", use_cache=False)
+        
+        assert mock_get_ref.return_value.get.call_count == 2
+    
     @patch('profile_card._get_profile_ref')
     def test_get_profile_card_error(self, mock_get_ref):
         """Test profile card retrieval error handling."""
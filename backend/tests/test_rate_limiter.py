@@ -163,3 +163,15 @@ class TestRateLimitStorage:
         # This test is complex due to module reloading, so we'll skip it for now
         # In a real scenario, Redis would be properly mocked at the module level
         pass
+    
+    def test_redis_storage_uses_moving_window(self):
+        """Test the shared Redis limiter counts hits in a moving window."""
+        import rate_limiter
+        with patch('rate_limiter.redis'), \
+             patch('rate_limiter.Limiter') as mock_limiter, \
+             patch.dict('os.environ', {"REDIS_URL": "redis://localhost:6379/0"}):
+            rate_limiter.create_limiter()
+        
+        kwargs = mock_limiter.call_args.kwargs
+        assert kwargs["storage_uri"] == "redis://localhost:6379/0"
+        assert kwargs["strategy"] == "moving-window"